@@ -49,6 +49,8 @@ typedef struct{
 	unsigned char ResponseDataLength;
 	unsigned char ResponseData[255];
 	unsigned char IgnoreError;
+	SSP_PORT Port;
+	void* Poller; // the SSP_POLLER owning the port, NULL if none
 }SSP_COMMAND;
 
 
@@ -62,9 +64,43 @@ typedef struct{
 	unsigned char SSPAddress;
 	unsigned char NewResponse;
 	unsigned char CheckStuff;
+	unsigned short rxCrc;
+	unsigned char crcErrors;	/* frames for us dropped on a bad crc */
 }SSP_TX_RX_PACKET;
 
 
+/* upper bounds (in microseconds) of the round trip time histogram buckets,
+   the last bucket takes the longer round trips   */
+#define SSP_STATS_BUCKETS 12
+extern const unsigned long SSP_STATS_BUCKET_US[SSP_STATS_BUCKETS - 1];
+
+typedef struct{
+	unsigned int count;			/* commands sent with this code */
+	unsigned int timeouts;		/* no reply after every retry */
+	unsigned int retries;		/* frames sent again, from RetryLevel */
+	unsigned int max_us;
+	unsigned long long total_us;	/* sum of the round trip times */
+	unsigned int buckets[SSP_STATS_BUCKETS];
+}SSP_COMMAND_STATS;
+
+/* link health of one device (port and SSP address)   */
+typedef struct{
+	unsigned long long bytes_sent;
+	unsigned long long bytes_received;
+	unsigned int crc_errors;			/* in SSPDataIn */
+	unsigned int counter_mismatches;	/* encrypted packet counter */
+	unsigned int packet_errors;			/* other bad replies */
+	unsigned int port_errors;
+	unsigned int negotiations;			/* key exchanges */
+	unsigned int negotiation_failures;
+	unsigned int precomputed_keys;		/* negotiations with pool keys */
+	unsigned int negotiation_last_us;
+	unsigned int negotiation_max_us;
+	unsigned long long negotiation_total_us;
+	SSP_COMMAND_STATS commands[256];	/* by command code */
+}SSP_STATS;
+
+
 
 typedef struct{
     long long Generator;
@@ -152,6 +188,74 @@ Notes:
 */
 int  SSPSendCommand(const SSP_PORT,SSP_COMMAND* cmd);
 
+/*
+Name: GetSSPStats
+Inputs:
+    SSP_PORT The port handle (returned from OpenSSPPort)
+    unsigned char The SSP address of the device
+    SSP_STATS* Filled with the counters of the device
+Return:
+    1 on success
+    0 if no command was sent to the device since the port was opened
+Notes:
+    The counters are kept by SSPSendCommand, the copy is consistent.
+*/
+int  GetSSPStats(const SSP_PORT port, const unsigned char ssp_address, SSP_STATS* stats);
+
+/* SSP capture files: an SSP_CAPTURE_FILE_HEADER bytes header (the magic,
+   then the flags, 4 bytes LE) followed by records of an
+   SSP_CAPTURE_RECORD_HEADER bytes header (CLOCK_MONOTONIC timestamp in ns,
+   8 bytes LE, kind, SSP address, port, 2 bytes LE, length, 2 bytes LE)
+   and length bytes. Version 1 files had a one byte length. */
+#define SSP_CAPTURE_MAGIC "ESSPCAP2"
+#define SSP_CAPTURE_FILE_HEADER 12
+#define SSP_CAPTURE_RECORD_HEADER 14
+/* flags   */
+#define SSP_CAPTURE_PLAIN 0x01
+/* record kinds   */
+#define SSP_CAPTURE_TX 0			/* a frame sent */
+#define SSP_CAPTURE_RX 1			/* bytes read while waiting for the reply */
+#define SSP_CAPTURE_COMMAND 2		/* command data, before encryption */
+#define SSP_CAPTURE_RESPONSE 3		/* reply data, after decryption */
+#define SSP_CAPTURE_RETRY 4			/* the frame sent again */
+
+/*
+Name: PrepareSSPKeys
+Notes:
+    Starts the thread making host keys (primes and intermediate key) in the
+    background, so that NegotiateSSPEncryption only exchanges them with the
+    device. The first negotiation starts it otherwise.
+*/
+void PrepareSSPKeys(void);
+
+/*
+Name: StartSSPCapture
+Inputs:
+    char* path: The file to write, replaced if it exists
+    unsigned int flags: SSP_CAPTURE_PLAIN to also write the commands before
+        encryption and the replies after decryption
+Return:
+    1 on success
+    0 if the file cannot be opened or a capture is running
+Notes:
+    The plain records hold the decrypted traffic, keep them private.
+*/
+int  StartSSPCapture(const char* path, const unsigned int flags);
+
+/* Flush and close the capture file   */
+void StopSSPCapture(void);
+
+/*
+Name: SSPResetRx, SSPFeedData
+Notes:
+    Frame the bytes read from a port as SSPSendCommand does: SSPResetRx
+    prepares ss for the reply of the device at address, SSPFeedData passes
+    it bytes until a reply with a valid CRC is complete (ss->NewResponse,
+    the frame in ss->rxData) and returns the number of bytes used.
+*/
+void SSPResetRx(SSP_TX_RX_PACKET* ss, const unsigned char address);
+int  SSPFeedData(SSP_TX_RX_PACKET* ss, const unsigned char* data, const int length);
+
 /*
 Name: OpenSSPPort
 Inputs:
@@ -174,6 +278,33 @@ Notes:
 */
 void CloseSSPPort(const SSP_PORT port);
 
+/*
+Name: SetWritePacing
+Inputs:
+    SSP_PORT port: The port to configure
+    unsigned long pacing: Pause after every transmitted frame (in microseconds), 0 to disable
+Return:
+    1 on success
+    0 if too many ports are paced
+Notes:
+    Only needed for devices that cannot take back to back frames.
+*/
+int SetWritePacing(const SSP_PORT port, const unsigned long pacing);
+
+/*
+Name: SetBaud
+Inputs:
+    SSP_PORT port: The port to configure
+    unsigned long baud: 9600, 19200, 38400, 57600 or 115200
+Return:
+    1 on success
+    0 if the rate is not supported or the port refused it
+Notes:
+    Only changes the host side, the device is switched with the set baud
+    rate command (see ssp6_set_baud_rate).
+*/
+int SetBaud(const SSP_PORT port, const unsigned long baud);
+
 
 
 
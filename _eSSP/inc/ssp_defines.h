@@ -35,6 +35,7 @@
 #define SSP_CMD_PAYOUT_VALUE 0x33
 #define SSP_CMD_SET_COIN_AMOUNT 0x34
 #define SSP_CMD_GET_COIN_AMOUNT 0x35
+#define SSP_CMD_GET_ALL_LEVELS 0x22
 #define SSP_CMD_HALT_PAYOUT     0x38
 #define SSP_CMD_SET_ROUTING 0x3B
 #define SSP_CMD_GET_ROUTING 0x3C
@@ -127,6 +128,9 @@ SSP_RESPONSE_TIMEOUT = 0xFF,
 #define SSP_CMD_SET_MODULUS 0x4B
 #define SSP_CMD_REQ_KEY_EXCHANGE 0x4C
 
+//line speed
+#define SSP_CMD_SET_BAUD_RATE 0x4D
+
 //download
 #define DOWNLOAD_COMPLETE				0x100000
 #define OPEN_FILE_ERROR					0x100001
@@ -15,6 +15,9 @@ SSP_COMMAND* ssp_init(char* port_c, char* addr_c, int debug)
     sspC->RetryLevel = 3;
     sspC->BaudRate = 9600;
     sspC->Key.EncryptKey = 1; // Just to make sure
+    sspC->Poller = NULL;
+    // The host keys of the negotiation are made while the port opens
+    PrepareSSPKeys();
 
     // Open the COM port
     if (debug == 1)
@@ -23,7 +26,7 @@ SSP_COMMAND* ssp_init(char* port_c, char* addr_c, int debug)
         printf("##%s##\n", port_c);
     }
 
-    if (open_ssp_port(port_c) == 0)
+    if (open_ssp_port(sspC, port_c) == 0)
     {
         free(sspC);
         printf("Port Error\n");
@@ -32,7 +35,22 @@ SSP_COMMAND* ssp_init(char* port_c, char* addr_c, int debug)
 
     // run_validator(&sspC);
     // close the com port
-    // close_ssp_port();
+    // close_ssp_port(sspC);
 
     return sspC;
 }
+
+// Open the device at addr_c on the port of sspC, for several devices on one
+// bus. The port stays owned by sspC, the returned command must not close it.
+SSP_COMMAND* ssp_init_address(const SSP_COMMAND* sspC, char* addr_c)
+{
+    SSP_COMMAND* device = malloc(sizeof(SSP_COMMAND));
+
+    *device = *sspC;
+    device->SSPAddress = (int)(strtod(addr_c, NULL));
+    device->EncryptionStatus = NO_ENCRYPTION;
+    device->Key.EncryptKey = 1;
+    device->Poller = NULL;
+
+    return device;
+}
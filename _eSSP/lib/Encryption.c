@@ -1,5 +1,7 @@
 #include "../inc/itl_types.h"
 #include <stdlib.h>
+#include <string.h>
+#include <pthread.h>
 #include "Encryption.h"
 
 
@@ -34,12 +36,15 @@
 
 
 
-  // compute S-Box substitutions during execution
-#define FORWARD_SUB_BYTE(input) forward_s_box_compute((input))
+  // S-Box substitutions, looked up in the tables built by aes_gen_tables
+#define FORWARD_SUB_BYTE(input) fsb[(input)]
 
 
-   // compute S-Box substitution during execution
-#define INVERSE_SUB_BYTE(input) inverse_s_box_compute((input))
+   // inverse S-Box substitution, looked up in the tables built by aes_gen_tables
+#define INVERSE_SUB_BYTE(input) rsb[(input)]
+
+// number of expanded keys kept by aes_get_context
+#define AES_KEY_CACHE_SIZE 8
 
 
 /***************************************************************************
@@ -66,6 +71,37 @@ static const UINT8 rcon[10] =
 };
 
 
+// forward and inverse S-Box
+static UINT8 fsb[256];
+static UINT8 rsb[256];
+
+// forward tables: MixCol of one S-Box substituted byte in each row
+static UINT32 FT0[256];
+static UINT32 FT1[256];
+static UINT32 FT2[256];
+static UINT32 FT3[256];
+
+// inverse tables: inverse MixCol of one inverse S-Box substituted byte in each row
+static UINT32 RT0[256];
+static UINT32 RT1[256];
+static UINT32 RT2[256];
+static UINT32 RT3[256];
+
+static pthread_once_t aes_tables_once = PTHREAD_ONCE_INIT;
+
+
+// expanded keys of the last used keys, an SSP key only changes on negotiation
+static struct
+{
+  UINT8       used;
+  UINT8       key[C_MAX_KEY_LENGTH];
+  aes_context ctx;
+} aes_key_cache[AES_KEY_CACHE_SIZE];
+
+static int aes_key_cache_next = 0;
+static pthread_mutex_t aes_key_cache_lock = PTHREAD_MUTEX_INITIALIZER;
+
+
 
 
 void mem_copy(UINT8* dest, const UINT8* source)
@@ -281,6 +317,42 @@ UINT8 inverse_s_box_compute( UINT8 input )
 
 
 
+static UINT32 forward_mix_col(UINT32 state_in);
+static UINT32 inverse_mix_col(UINT32 state_in);
+
+
+// fill the S-Box and T-tables, once per process (see aes_tables_once)
+static void aes_gen_tables( void )
+{
+  // declarations
+  int i;
+  UINT32 s;
+
+  for ( i = 0; i < 256; i++ )
+  {
+    fsb[i] = forward_s_box_compute( (UINT8) i );
+    rsb[i] = inverse_s_box_compute( (UINT8) i );
+  }
+
+  for ( i = 0; i < 256; i++ )
+  {
+    s = fsb[i];
+    FT0[i] = forward_mix_col( s << 24 );
+    FT1[i] = forward_mix_col( s << 16 );
+    FT2[i] = forward_mix_col( s <<  8 );
+    FT3[i] = forward_mix_col( s       );
+
+    s = rsb[i];
+    RT0[i] = inverse_mix_col( s << 24 );
+    RT1[i] = inverse_mix_col( s << 16 );
+    RT2[i] = inverse_mix_col( s <<  8 );
+    RT3[i] = inverse_mix_col( s       );
+  }
+}
+
+
+
+
 static int aes_set_key( /*@out@*/ aes_context *ctx,
                             const UINT8       *key,
                             const UINT8       *IV )
@@ -291,6 +363,8 @@ static int aes_set_key( /*@out@*/ aes_context *ctx,
 
 
 
+  // the S-Box is needed for the key expansion
+  pthread_once( &aes_tables_once, aes_gen_tables );
 
   // get pointer to encryption round keys
   enc_round_key = ctx->enc_round_keys;
@@ -321,6 +395,16 @@ static int aes_set_key( /*@out@*/ aes_context *ctx,
   }
   // break;
 
+  // decryption round keys of the equivalent inverse cipher (FIPS-197 5.3.5):
+  // the inner round keys go through inverse MixCol, the first and last are kept
+  for ( i = 0; i < 44; i++ )
+  {
+    if ( i < 4 || i >= 40 )
+      ctx->dec_round_keys[i] = ctx->enc_round_keys[i];
+    else
+      ctx->dec_round_keys[i] = inverse_mix_col( ctx->enc_round_keys[i] );
+  }
+
   // set initialization vector
   if ( IV != NULL )
   {
@@ -362,30 +446,15 @@ static int aes_encrypt_16_byte_block( const aes_context *ctx,
   cx3 ^= round_key[3];
 
    // do encryption rounds 1..9
-   // forward S-box, ShiftRows() via input structure, MixCol, XOR round_key
+   // forward S-box, ShiftRows() via input structure and MixCol in the T-tables, XOR round_key
   round_key+=4;
   i = 0;
   while ( i < 9 )
   {
-    cy0 = round_key[0] ^ forward_mix_col( ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_0( cx0 ) ) ) ) << 24 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_1( cx1 ) ) ) ) << 16 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_2( cx2 ) ) ) ) <<  8 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_3( cx3 ) ) ) )       ) );
-
-    cy1 = round_key[1] ^ forward_mix_col( ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_0( cx1 ) ) ) ) << 24 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_1( cx2 ) ) ) ) << 16 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_2( cx3 ) ) ) ) <<  8 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_3( cx0 ) ) ) )       ) );
-
-    cy2 = round_key[2] ^ forward_mix_col( ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_0( cx2 ) ) ) ) << 24 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_1( cx3 ) ) ) ) << 16 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_2( cx0 ) ) ) ) <<  8 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_3( cx1 ) ) ) )       ) );
-
-    cy3 = round_key[3] ^ forward_mix_col( ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_0( cx3 ) ) ) ) << 24 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_1( cx0 ) ) ) ) << 16 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_2( cx1 ) ) ) ) <<  8 ) ^
-                                          ( ( (UINT32) (FORWARD_SUB_BYTE( (int) BYTE_3( cx2 ) ) ) )       ) );
+    cy0 = round_key[0] ^ FT0[ BYTE_0( cx0 ) ] ^ FT1[ BYTE_1( cx1 ) ] ^ FT2[ BYTE_2( cx2 ) ] ^ FT3[ BYTE_3( cx3 ) ];
+    cy1 = round_key[1] ^ FT0[ BYTE_0( cx1 ) ] ^ FT1[ BYTE_1( cx2 ) ] ^ FT2[ BYTE_2( cx3 ) ] ^ FT3[ BYTE_3( cx0 ) ];
+    cy2 = round_key[2] ^ FT0[ BYTE_0( cx2 ) ] ^ FT1[ BYTE_1( cx3 ) ] ^ FT2[ BYTE_2( cx0 ) ] ^ FT3[ BYTE_3( cx1 ) ];
+    cy3 = round_key[3] ^ FT0[ BYTE_0( cx3 ) ] ^ FT1[ BYTE_1( cx0 ) ] ^ FT2[ BYTE_2( cx1 ) ] ^ FT3[ BYTE_3( cx2 ) ];
 
     round_key += 4;
     i++;
@@ -443,8 +512,8 @@ static int aes_decrypt_16_byte_block( const aes_context *ctx,
 
 
 
-  // get decryption round keys --> changed: get encryption round keys
-  round_key = (UINT32 *) ctx->enc_round_keys;
+  // get decryption round keys
+  round_key = (UINT32 *) ctx->dec_round_keys;
   round_key += 40;
 
   // read 16 cipher text bytes into four 32-bit words (FIPS-197: state = in )
@@ -460,32 +529,16 @@ static int aes_decrypt_16_byte_block( const aes_context *ctx,
   cx3 ^= round_key[3];
 
   // do decryption rounds 9..1
-  // inverse S-box, inverse ShiftRows() via input structure, inverseMixCol, XOR round_key
+  // inverse S-box, inverse ShiftRows() via input structure and inverseMixCol in the T-tables,
+  // XOR round_key (already passed through inverseMixCol by aes_set_key)
   i = 0;
   round_key -= 4;
   while ( i < 9 )
   {
-
-
-    cy0 = inverse_mix_col( round_key[0] ^ ( ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_0( cx0 ) ) ) << 24 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_1( cx3 ) ) ) << 16 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_2( cx2 ) ) ) <<  8 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_3( cx1 ) ) )       ) ) );
-
-    cy1 = inverse_mix_col( round_key[1] ^ ( ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_0( cx1 ) ) ) << 24 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_1( cx0 ) ) ) << 16 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_2( cx3 ) ) ) <<  8 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_3( cx2 ) ) )       ) ) );
-
-    cy2 = inverse_mix_col( round_key[2] ^ ( ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_0 ( cx2 ) ) ) << 24 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_1 ( cx1 ) ) ) << 16 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_2 ( cx0 ) ) ) <<  8 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_3 ( cx3 ) ) )       ) ) );
-
-    cy3 = inverse_mix_col( round_key[3] ^ ( ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_0 ( cx3 ) ) ) << 24 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_1 ( cx2 ) ) ) << 16 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_2 ( cx1 ) ) ) <<  8 ) ^
-                                            ( (UINT32) INVERSE_SUB_BYTE( (int)( BYTE_3 ( cx0 ) ) )       ) ) );
+    cy0 = round_key[0] ^ RT0[ BYTE_0( cx0 ) ] ^ RT1[ BYTE_1( cx3 ) ] ^ RT2[ BYTE_2( cx2 ) ] ^ RT3[ BYTE_3( cx1 ) ];
+    cy1 = round_key[1] ^ RT0[ BYTE_0( cx1 ) ] ^ RT1[ BYTE_1( cx0 ) ] ^ RT2[ BYTE_2( cx3 ) ] ^ RT3[ BYTE_3( cx2 ) ];
+    cy2 = round_key[2] ^ RT0[ BYTE_0( cx2 ) ] ^ RT1[ BYTE_1( cx1 ) ] ^ RT2[ BYTE_2( cx0 ) ] ^ RT3[ BYTE_3( cx3 ) ];
+    cy3 = round_key[3] ^ RT0[ BYTE_0( cx3 ) ] ^ RT1[ BYTE_1( cx2 ) ] ^ RT2[ BYTE_2( cx1 ) ] ^ RT3[ BYTE_3( cx0 ) ];
 
      i++;
      round_key -= 4;
@@ -532,6 +585,59 @@ static int aes_decrypt_16_byte_block( const aes_context *ctx,
 
 
 
+// copy the expanded <key> to <ctx>, expanding it only if it is not cached
+static void aes_get_context( /*@out@*/ aes_context *ctx,
+                                 const UINT8       *key,
+                                 const UINT8       *IV )
+{
+  // declarations
+  int i;
+  int ret;
+
+  pthread_mutex_lock( &aes_key_cache_lock );
+  for ( i = 0; i < AES_KEY_CACHE_SIZE; i++ )
+  {
+    if ( aes_key_cache[i].used && memcmp( aes_key_cache[i].key, key, C_MAX_KEY_LENGTH ) == 0 )
+      break;
+  }
+  if ( i == AES_KEY_CACHE_SIZE )
+  {
+    // not cached, replace the oldest entry
+    i = aes_key_cache_next;
+    aes_key_cache_next = ( aes_key_cache_next + 1 ) % AES_KEY_CACHE_SIZE;
+    ret = aes_set_key( &aes_key_cache[i].ctx, key, NULL );
+    assert( ret == 0 );
+    memcpy( aes_key_cache[i].key, key, C_MAX_KEY_LENGTH );
+    aes_key_cache[i].used = 1;
+  }
+  memcpy( ctx, &aes_key_cache[i].ctx, sizeof( aes_context ) );
+  pthread_mutex_unlock( &aes_key_cache_lock );
+
+  // set initialization vector
+  if ( IV != NULL )
+  {
+    mem_copy( ctx->IV, IV );
+  }
+}
+
+
+
+extern void aes_forget_key( const UINT8 *aes_key )
+{
+  // declarations
+  int i;
+
+  pthread_mutex_lock( &aes_key_cache_lock );
+  for ( i = 0; i < AES_KEY_CACHE_SIZE; i++ )
+  {
+    if ( aes_key_cache[i].used && memcmp( aes_key_cache[i].key, aes_key, C_MAX_KEY_LENGTH ) == 0 )
+      memset( &aes_key_cache[i], 0, sizeof( aes_key_cache[i] ) );
+  }
+  pthread_mutex_unlock( &aes_key_cache_lock );
+}
+
+
+
 extern UINT8 aes_encrypt( const UINT8   aes_mode,
                           const UINT8  *aes_key,
                           const UINT32  aes_key_length,
@@ -552,9 +658,8 @@ extern UINT8 aes_encrypt( const UINT8   aes_mode,
 
 
 
-  // init encryption keys
-  ret = aes_set_key( &aes_ctx, aes_key, IV );
-  assert( ret == 0 );
+  // get the expanded encryption keys
+  aes_get_context( &aes_ctx, aes_key, IV );
 
   // get number of blocks and padding
   num_blocks = (UINT32) ( data_length / 16 );
@@ -619,9 +724,8 @@ extern UINT8 aes_decrypt( const UINT8   aes_mode,
 
 
 
-  // init encryption keys
-  ret = aes_set_key( &aes_ctx, aes_key, IV );
-  assert( ret == 0 );
+  // get the expanded encryption keys
+  aes_get_context( &aes_ctx, aes_key, IV );
 
   // get number of blocks and padding
   num_blocks = (UINT32) ( data_length / 16 );
@@ -664,11 +768,55 @@ extern UINT8 aes_decrypt( const UINT8   aes_mode,
 
 
 
+/* CRC_SSP_POLY applied to every possible high byte of the crc   */
+const unsigned short crcTableSSP[256] = {
+	0x0000, 0x8005, 0x800F, 0x000A, 0x801B, 0x001E, 0x0014, 0x8011,
+	0x8033, 0x0036, 0x003C, 0x8039, 0x0028, 0x802D, 0x8027, 0x0022,
+	0x8063, 0x0066, 0x006C, 0x8069, 0x0078, 0x807D, 0x8077, 0x0072,
+	0x0050, 0x8055, 0x805F, 0x005A, 0x804B, 0x004E, 0x0044, 0x8041,
+	0x80C3, 0x00C6, 0x00CC, 0x80C9, 0x00D8, 0x80DD, 0x80D7, 0x00D2,
+	0x00F0, 0x80F5, 0x80FF, 0x00FA, 0x80EB, 0x00EE, 0x00E4, 0x80E1,
+	0x00A0, 0x80A5, 0x80AF, 0x00AA, 0x80BB, 0x00BE, 0x00B4, 0x80B1,
+	0x8093, 0x0096, 0x009C, 0x8099, 0x0088, 0x808D, 0x8087, 0x0082,
+	0x8183, 0x0186, 0x018C, 0x8189, 0x0198, 0x819D, 0x8197, 0x0192,
+	0x01B0, 0x81B5, 0x81BF, 0x01BA, 0x81AB, 0x01AE, 0x01A4, 0x81A1,
+	0x01E0, 0x81E5, 0x81EF, 0x01EA, 0x81FB, 0x01FE, 0x01F4, 0x81F1,
+	0x81D3, 0x01D6, 0x01DC, 0x81D9, 0x01C8, 0x81CD, 0x81C7, 0x01C2,
+	0x0140, 0x8145, 0x814F, 0x014A, 0x815B, 0x015E, 0x0154, 0x8151,
+	0x8173, 0x0176, 0x017C, 0x8179, 0x0168, 0x816D, 0x8167, 0x0162,
+	0x8123, 0x0126, 0x012C, 0x8129, 0x0138, 0x813D, 0x8137, 0x0132,
+	0x0110, 0x8115, 0x811F, 0x011A, 0x810B, 0x010E, 0x0104, 0x8101,
+	0x8303, 0x0306, 0x030C, 0x8309, 0x0318, 0x831D, 0x8317, 0x0312,
+	0x0330, 0x8335, 0x833F, 0x033A, 0x832B, 0x032E, 0x0324, 0x8321,
+	0x0360, 0x8365, 0x836F, 0x036A, 0x837B, 0x037E, 0x0374, 0x8371,
+	0x8353, 0x0356, 0x035C, 0x8359, 0x0348, 0x834D, 0x8347, 0x0342,
+	0x03C0, 0x83C5, 0x83CF, 0x03CA, 0x83DB, 0x03DE, 0x03D4, 0x83D1,
+	0x83F3, 0x03F6, 0x03FC, 0x83F9, 0x03E8, 0x83ED, 0x83E7, 0x03E2,
+	0x83A3, 0x03A6, 0x03AC, 0x83A9, 0x03B8, 0x83BD, 0x83B7, 0x03B2,
+	0x0390, 0x8395, 0x839F, 0x039A, 0x838B, 0x038E, 0x0384, 0x8381,
+	0x0280, 0x8285, 0x828F, 0x028A, 0x829B, 0x029E, 0x0294, 0x8291,
+	0x82B3, 0x02B6, 0x02BC, 0x82B9, 0x02A8, 0x82AD, 0x82A7, 0x02A2,
+	0x82E3, 0x02E6, 0x02EC, 0x82E9, 0x02F8, 0x82FD, 0x82F7, 0x02F2,
+	0x02D0, 0x82D5, 0x82DF, 0x02DA, 0x82CB, 0x02CE, 0x02C4, 0x82C1,
+	0x8243, 0x0246, 0x024C, 0x8249, 0x0258, 0x825D, 0x8257, 0x0252,
+	0x0270, 0x8275, 0x827F, 0x027A, 0x826B, 0x026E, 0x0264, 0x8261,
+	0x0220, 0x8225, 0x822F, 0x022A, 0x823B, 0x023E, 0x0234, 0x8231,
+	0x8213, 0x0216, 0x021C, 0x8219, 0x0208, 0x820D, 0x8207, 0x0202,
+};
+
 unsigned short cal_crc_loop_CCITT_A( short l, unsigned char* p, unsigned short seed,unsigned short cd )
 {
 	int i, j;
 	unsigned short crc = seed;
 
+	if ( cd == CRC_SSP_POLY )
+	{
+		/* one table lookup per byte instead of 8 shifts   */
+		for ( i = 0; i < l; ++i )
+			crc = CRC_SSP_UPDATE( crc, p[ i ] );
+		return crc;
+	}
+
 	for ( i = 0; i < l; ++i )
 	{
 		crc ^= ( p[ i ] << 8 );
@@ -42,6 +42,7 @@
 typedef struct
 {
     UINT32 enc_round_keys[(C_NUMBER_ROUNDS + 1) * C_MAX_KEY_LENGTH/4];   /* encryption round keys         */
+    UINT32 dec_round_keys[(C_NUMBER_ROUNDS + 1) * C_MAX_KEY_LENGTH/4];   /* decryption round keys         */
     UINT8  IV[16];                                                       /* 128-bit initialization vector */
 } aes_context;
 
@@ -73,12 +74,22 @@ extern UINT8 aes_decrypt( const UINT8   aes_mode,              // the AES mode (
                                 UINT8  *cipher_data,           // pointer to encrypted data to decrypt (might be same as plain_data)
                           const UINT32  data_length );         // length of data to decrypt in bytes (must be a multiple of 16)
 
+/* F-AES/130: aes_forget_key */
+extern void aes_forget_key( const UINT8 *aes_key );                    // drop a key no longer in use from the expanded key cache
+
 
 unsigned short cal_crc_loop_CCITT_A( short l, unsigned char* p, unsigned short seed,unsigned short cd );
+
+/* crcTableSSP: the CRC_SSP_POLY crc of every byte, see CRC_SSP_UPDATE   */
+extern const unsigned short crcTableSSP[256];
 /***************************************************************************
  * 6. MACRO FUNCTIONS                                                      *
  ***************************************************************************/
 
+/* add one byte to a CRC_SSP_POLY crc   */
+#define CRC_SSP_UPDATE(crc, byte) \
+	((unsigned short)(((crc) << 8) ^ crcTableSSP[(((crc) >> 8) ^ (byte)) & 0xFF]))
+
 /***************************************************************************
  * 7. END                                                                  *
  ***************************************************************************/
@@ -8,6 +8,7 @@
 #include <stdio.h>
 
 #include <pthread.h>
+#include <time.h>
 extern unsigned char download_in_progress;
 
 
@@ -16,8 +17,17 @@ extern unsigned char download_in_progress;
 #define VER_REV	 0	// not > 255
 
 
-unsigned int encPktCount[MAX_SSP_PORT];
-unsigned char sspSeq[MAX_SSP_PORT];
+static SSP_LINK sspLinks[MAX_SSP_LINKS];
+static pthread_mutex_t sspLinksLock = PTHREAD_MUTEX_INITIALIZER;
+
+/* host keys (generator, modulus, host random and intermediate key) made in
+   the background by the key pool thread, each used by one negotiation   */
+#define SSP_KEY_POOL_SIZE 4
+static SSP_KEYS keyPool[SSP_KEY_POOL_SIZE];
+static int keyPoolCount = 0;
+static pthread_mutex_t keyPoolLock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t keyPoolTaken = PTHREAD_COND_INITIALIZER;
+static pthread_once_t keyPoolOnce = PTHREAD_ONCE_INIT;
 /*
 extern int PortStatus,PortStatus2,PortStatusUSB,PortStatusCCT;
 extern HANDLE hDevice,hDevice2,hDeviceUSB,hDeviceCCT;
@@ -51,33 +61,260 @@ int GetProcDLLVersion(unsigned char* ver)
 }
 
 
-/*    DLL function call to generate host intermediate numbers to send to slave  */
-int InitiateSSPHostKeys(SSP_KEYS *  keyArray, const unsigned char ssp_address)
+/*
+Name: GetSSPLink
+Inputs:
+    SSP_PORT port: The port handle (returned from OpenSSPPort)
+Return:
+    The protocol state of the port, NULL if MAX_SSP_LINKS ports are in use
+Notes:
+    The state is created on the first command sent to the port and released
+    by CloseSSPPort, so every open port has its own sequence bits and packet
+    counters.
+*/
+SSP_LINK* GetSSPLink(const SSP_PORT port)
+{
+	SSP_LINK* link = NULL;
+	int i;
+
+	pthread_mutex_lock(&sspLinksLock);
+	for(i = 0; i < MAX_SSP_LINKS; i++){
+		if(sspLinks[i].port == port){
+			link = &sspLinks[i];
+			break;
+		}
+		if(link == NULL && sspLinks[i].port == -1)
+			link = &sspLinks[i];
+	}
+	if(link != NULL && link->port != port){
+		/* a command may still be sent on the link of a closed port   */
+		pthread_mutex_lock(&link->lock);
+		for(i = 0; i < MAX_SSP_PORT; i++){
+			link->encPktCount[i] = 0;
+			link->sspSeq[i] = 0x80;
+		}
+		link->port = port;
+		pthread_mutex_unlock(&link->lock);
+	}
+	pthread_mutex_unlock(&sspLinksLock);
+	return link;
+}
+
+/* the statistics of the device at address on the link, allocated on the
+   first use, NULL if they cannot be. The link lock must be held   */
+SSP_STATS* GetSSPLinkStats(SSP_LINK* link, const unsigned char address)
+{
+	if (address >= MAX_SSP_PORT)
+		return NULL;
+	if (link->stats[address] == NULL)
+		link->stats[address] = calloc(1, sizeof(SSP_STATS));
+	return link->stats[address];
+}
+
+void ReleaseSSPLink(const SSP_PORT port)
 {
+	int i, j;
+
+	pthread_mutex_lock(&sspLinksLock);
+	for(i = 0; i < MAX_SSP_LINKS; i++){
+		if(sspLinks[i].port == port){
+			pthread_mutex_lock(&sspLinks[i].lock);
+			for(j = 0; j < MAX_SSP_PORT; j++){
+				free(sspLinks[i].stats[j]);
+				sspLinks[i].stats[j] = NULL;
+			}
+			sspLinks[i].port = -1;
+			pthread_mutex_unlock(&sspLinks[i].lock);
+		}
+	}
+	pthread_mutex_unlock(&sspLinksLock);
+}
 
 
+/*
+Name: GetSSPStats
+Inputs:
+    SSP_PORT port: The port handle (returned from OpenSSPPort)
+    unsigned char ssp_address: The SSP address of the device
+    SSP_STATS* stats: Filled with the counters of the device
+Return:
+    1 on success
+    0 if no command was sent to the device since the port was opened
+Notes:
+    The link lock is held while copying, so the counters of one command are
+    never half updated: it waits for the command in progress on the port.
+*/
+int GetSSPStats(const SSP_PORT port, const unsigned char ssp_address, SSP_STATS* stats)
+{
+	SSP_LINK* link = NULL;
+	int i;
+	int found = 0;
+
+	if(ssp_address >= MAX_SSP_PORT)
+		return 0;
+	pthread_mutex_lock(&sspLinksLock);
+	for(i = 0; i < MAX_SSP_LINKS; i++){
+		if(sspLinks[i].port == port){
+			link = &sspLinks[i];
+			break;
+		}
+	}
+	pthread_mutex_unlock(&sspLinksLock);
+	if(link == NULL)
+		return 0;
+
+	pthread_mutex_lock(&link->lock);
+	if(link->port == port && link->stats[ssp_address] != NULL){
+		*stats = *link->stats[ssp_address];
+		found = 1;
+	}
+	pthread_mutex_unlock(&link->lock);
+	return found;
+}
+
+
+/* create the two random prime numbers and the host intermediate key   */
+static int _create_host_keys(SSP_KEYS* keyArray)
+{
 	long long swap = 0;
 
-	/* create the two random prime numbers  */
-	keyArray->Generator = GeneratePrime();
-	keyArray->Modulus = GeneratePrime();
-	/* make sure Generator is larger than Modulus   */
+	do{
+		keyArray->Generator = GeneratePrime();
+		keyArray->Modulus = GeneratePrime();
+	}while(keyArray->Generator == keyArray->Modulus);
+	/* make sure Modulus is larger than Generator   */
 	if (keyArray->Generator > keyArray->Modulus)
 	{
 		swap = keyArray->Generator;
 		keyArray->Generator = keyArray->Modulus;
-		keyArray->Generator = swap;
+		keyArray->Modulus = swap;
 	}
 
+	return CreateHostInterKey(keyArray) == 0;
+}
 
-	if(CreateHostInterKey(keyArray)== -1)
-		return 0;
+/* keeps the key pool full   */
+static void* _fill_key_pool(void* arg)
+{
+	SSP_KEYS keys;
+
+	(void)arg;
+	for(;;){
+		pthread_mutex_lock(&keyPoolLock);
+		while(keyPoolCount == SSP_KEY_POOL_SIZE)
+			pthread_cond_wait(&keyPoolTaken, &keyPoolLock);
+		pthread_mutex_unlock(&keyPoolLock);
+
+		if(!_create_host_keys(&keys))
+			continue;
 
+		pthread_mutex_lock(&keyPoolLock);
+		keyPool[keyPoolCount++] = keys;
+		pthread_mutex_unlock(&keyPoolLock);
+	}
+	return NULL;
+}
+
+static void _start_key_pool(void)
+{
+	pthread_t thread;
+
+	if(pthread_create(&thread, NULL, _fill_key_pool, NULL) == 0)
+		pthread_detach(thread);
+}
+
+/*
+Name: PrepareSSPKeys
+Notes:
+    Starts the thread making host keys in the background, so that the key
+    negotiations do not have to. Called by the first negotiation otherwise.
+*/
+void PrepareSSPKeys(void)
+{
+	pthread_once(&keyPoolOnce, _start_key_pool);
+}
+
+/* host keys from the pool, or made now if it is empty. Return 2 for keys
+   from the pool, 1 for new ones, 0 on failure   */
+static int _take_host_keys(SSP_KEYS* keyArray)
+{
+	int taken = 0;
+
+	PrepareSSPKeys();
+	pthread_mutex_lock(&keyPoolLock);
+	if(keyPoolCount > 0){
+		*keyArray = keyPool[--keyPoolCount];
+		taken = 1;
+		pthread_cond_signal(&keyPoolTaken);
+	}
+	pthread_mutex_unlock(&keyPoolLock);
+	if(taken)
+		return 2;
+	return _create_host_keys(keyArray);
+}
+
+static int _initiate_host_keys(SSP_KEYS* keyArray, const SSP_PORT port, const unsigned char ssp_address)
+{
+	SSP_LINK* link;
+	int made;
+
+	made = _take_host_keys(keyArray);
+	if(made == 0)
+		return 0;
 
 	/* reset the apcket counter here for a successful key neg  */
-	encPktCount[ssp_address] = 0;
+	link = GetSSPLink(port);
+	if(link == NULL)
+		return 0;
+	/* not while a command to the port uses the counter   */
+	pthread_mutex_lock(&link->lock);
+	link->encPktCount[ssp_address] = 0;
+	pthread_mutex_unlock(&link->lock);
 
-	return 1;
+	return made;
+}
+
+/*    DLL function call to generate host intermediate numbers to send to slave  */
+int InitiateSSPHostKeys(SSP_KEYS *  keyArray, const SSP_PORT port, const unsigned char ssp_address)
+{
+	return _initiate_host_keys(keyArray, port, ssp_address) != 0;
+}
+
+/* count a negotiation with the device at ssp_address, that took elapsed
+   microseconds   */
+static void _record_negotiation(const SSP_PORT port, const unsigned char ssp_address,
+		const unsigned long long elapsed, const int ok, const int precomputed)
+{
+	SSP_LINK* link;
+	SSP_STATS* stats;
+
+	link = GetSSPLink(port);
+	if(link == NULL)
+		return;
+	pthread_mutex_lock(&link->lock);
+	stats = GetSSPLinkStats(link, ssp_address);
+	if(stats != NULL){
+		stats->negotiations++;
+		if(!ok)
+			stats->negotiation_failures++;
+		if(precomputed)
+			stats->precomputed_keys++;
+		stats->negotiation_last_us = elapsed > 0xFFFFFFFFULL ? 0xFFFFFFFF : (unsigned int)elapsed;
+		if(stats->negotiation_last_us > stats->negotiation_max_us)
+			stats->negotiation_max_us = stats->negotiation_last_us;
+		stats->negotiation_total_us += elapsed;
+	}
+	pthread_mutex_unlock(&link->lock);
+}
+
+static int _negotiate(SSP_PORT port, const char ssp_address, SSP_FULL_KEY * key, int* made);
+
+static unsigned long long _clock_us(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (unsigned long long)ts.tv_sec * 1000000ULL + ts.tv_nsec / 1000;
 }
 
 
@@ -93,7 +330,7 @@ int CreateSSPHostEncryptionKey(SSP_KEYS* keyArray)
 }
 
 
- int EncryptSSPPacket(unsigned char ptNum,unsigned char* dataIn, unsigned char* dataOut, unsigned char* lengthIn,unsigned char* lengthOut, unsigned long long* key)
+ int EncryptSSPPacket(unsigned int* pktCount,unsigned char* dataIn, unsigned char* dataOut, unsigned char* lengthIn,unsigned char* lengthOut, unsigned long long* key)
 {
 	#define FIXED_PACKET_LENGTH   7
 	unsigned char pkLength,i,packLength = 0;
@@ -113,7 +350,7 @@ int CreateSSPHostEncryptionKey(SSP_KEYS* keyArray)
 
 	/* add in the encrypted packet count   */
 	for(i = 0; i < 4; i++)
-		tmpData[1 + i] = (unsigned char)((encPktCount[ptNum] >> (8*i) & 0xFF));
+		tmpData[1 + i] = (unsigned char)((*pktCount >> (8*i) & 0xFF));
 
 
 	for(i = 0; i < *lengthIn; i++)
@@ -137,7 +374,7 @@ int CreateSSPHostEncryptionKey(SSP_KEYS* keyArray)
 	*lengthOut = pkLength;
 	dataOut[0] = SSP_STEX;
 
-	encPktCount[ptNum]++;  /* incremnet the counter after a successful encrypted packet   */
+	(*pktCount)++;  /* incremnet the counter after a successful encrypted packet   */
 
 	return 1;
 }
@@ -178,9 +415,9 @@ int CreateHostInterKey(SSP_KEYS * keyArray)
 void __attribute__ ((constructor)) my_init(void)
 {
     int i;
-    for(i = 0; i < MAX_SSP_PORT; i++){
-		encPktCount[i] = 0;
-		sspSeq[i] = 0x80;
+    for(i = 0; i < MAX_SSP_LINKS; i++){
+		sspLinks[i].port = -1;
+		pthread_mutex_init(&sspLinks[i].lock, NULL);
 	}
     srand((int)GetSeed());
     download_in_progress = 0;
@@ -206,14 +443,30 @@ Return:
     0 on failure
 Notes:
     Only the EncryptKey iin SSP_FULL_KEY will be set. The FixedKey needs to be set by the user
+    The host keys come from the key pool (see PrepareSSPKeys) when it has
+    some, the time taken is counted in the statistics of the device.
 */
 int NegotiateSSPEncryption(SSP_PORT port, const char ssp_address, SSP_FULL_KEY * key)
+{
+    const unsigned long long start = _clock_us();
+    int made = 0;
+    int ok;
+
+    ok = _negotiate(port, ssp_address, key, &made);
+    _record_negotiation(port, (unsigned char)ssp_address, _clock_us() - start, ok, made == 2);
+    return ok;
+}
+
+/* the key exchange of NegotiateSSPEncryption, made tells how the host keys
+   were made (see _take_host_keys)   */
+static int _negotiate(SSP_PORT port, const char ssp_address, SSP_FULL_KEY * key, int* made)
 {
     SSP_KEYS temp_keys;
     SSP_COMMAND sspc;
     unsigned char i;
     //setup the intial host keys
-    if (InitiateSSPHostKeys(&temp_keys,ssp_address) == 0)
+    *made = _initiate_host_keys(&temp_keys,port,ssp_address);
+    if (*made == 0)
         return 0;
     sspc.EncryptionStatus = 0;
     sspc.RetryLevel = 2;
@@ -265,6 +518,8 @@ int NegotiateSSPEncryption(SSP_PORT port, const char ssp_address, SSP_FULL_KEY *
 
     if (CreateSSPHostEncryptionKey(&temp_keys) == 0)
         return 0;
+    //the old key will not be used again, drop its expanded copy
+    aes_forget_key((unsigned char*)key);
     key->EncryptKey = temp_keys.KeyHost;
     return 1;
 }
@@ -4,6 +4,7 @@
 #include "../inc/SSPComs.h"
 #include "../inc/itl_types.h"
 #include <time.h>
+#include <pthread.h>
 
 typedef enum{
     LEVEL_CHECK_OFF = 254,
@@ -68,14 +69,30 @@ typedef struct{
 void  DownloadITLTarget(void * itl_file_pointer);
 int TestSplit(PAY* py,UINT32 valueToFind);
 
+#define MAX_SSP_LINKS 32
+
+/* the protocol state of one open port: the sequence bit, the packet
+   counter and the link statistics of every address on it, and the lock
+   held by SSPSendCommand   */
+typedef struct{
+	SSP_PORT port;
+	unsigned int encPktCount[MAX_SSP_PORT];
+	unsigned char sspSeq[MAX_SSP_PORT];
+	SSP_STATS* stats[MAX_SSP_PORT];	/* allocated on the first command */
+	pthread_mutex_t lock;
+}SSP_LINK;
+
 void __attribute__ ((constructor)) my_init(void);
 void __attribute__ ((destructor)) my_fini(void);
 
 //private
 clock_t GetClockMs();
 void SSPDataIn(unsigned char RxChar, SSP_TX_RX_PACKET* ss);
-int EncryptSSPPacket(unsigned char ptNum,unsigned char* dataIn, unsigned char* dataOut, unsigned char* lengthIn,unsigned char* lengthOut, unsigned long long* key);
+SSP_LINK* GetSSPLink(const SSP_PORT port);
+SSP_STATS* GetSSPLinkStats(SSP_LINK* link, const unsigned char address);
+void ReleaseSSPLink(const SSP_PORT port);
+int EncryptSSPPacket(unsigned int* pktCount,unsigned char* dataIn, unsigned char* dataOut, unsigned char* lengthIn,unsigned char* lengthOut, unsigned long long* key);
 int DecryptSSPPacket(unsigned char* dataIn, unsigned char* dataOut, unsigned char* lengthIn,unsigned char* lengthOut, unsigned long long* key);
-int InitiateSSPHostKeys(SSP_KEYS*  keyArray,const unsigned char ssp_address);
+int InitiateSSPHostKeys(SSP_KEYS*  keyArray,const SSP_PORT port,const unsigned char ssp_address);
 int CreateHostInterKey(SSP_KEYS* keyArray);
 int CreateSSPHostEncryptionKey(SSP_KEYS* keyArray);
@@ -5,6 +5,7 @@
 #include <stdio.h>
 #include "Random.h"
 #include <sys/time.h>
+#include <sys/random.h>
 
 
 /*	Generates a large prime number by
@@ -17,7 +18,9 @@ unsigned long long GeneratePrime(void)
 	unsigned long long tmp = 0;
 
 	tmp	=  GenerateRandomNumber();
-	tmp	%= MAX_PRIME_NUMBER;
+	/*  in the upper half of the range, never a tiny prime  */
+	tmp	%= MAX_PRIME_NUMBER / 2;
+	tmp	+= MAX_PRIME_NUMBER / 2;
 
 	/*  ensure it is an odd number	*/
 	if ((tmp & 1)==0)
@@ -35,77 +38,104 @@ unsigned long long GeneratePrime(void)
 }
 
 
-/*	Performs the miller-rabin primality test on a guessed prime n.
-|	trials is the number of attempts to verify this, because the function
-|	is not 100% accurate it may be a composite.  However setting the trial
-|	value to around 5 should guarantee success even with very large primes		*/
+/*	Performs the miller-rabin primality test on a guessed prime n, with
+|	the first trials primes as witnesses. Five witnesses make the test
+|	exact below 2152302898747, far above MAX_PRIME_NUMBER, so no random
+|	witness is needed		*/
+
+static const long long WITNESSES[] = {2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37};
 
 unsigned char MillerRabin (long long n, long long trials)
 {
-	long long a = 0;
-    long long i;
-	for (i=0; i<trials; i++)
-	{
-		a = (rand() % (n-3))+2;/* gets random value in [2..n-1] */
+	long long i;
 
-		if (IsItPrime (n,a)==0)
-		{
+	if (n < 2)
+		return 0;
+	for (i = 0; i < trials && i < (long long)(sizeof(WITNESSES) / sizeof(WITNESSES[0])); i++)
+	{
+		if (n == WITNESSES[i])
+			return 1;
+		if (n % WITNESSES[i] == 0)
 			return 0;
-			/*n composite, return false */
-		}
-	} return 1; /* n probably prime */
+		if (IsItPrime (n,WITNESSES[i])==0)
+			return 0;	/* n composite */
+	}
+	return 1; /* n prime */
 }
 
 
-/* Checks the integer n for primality		*/
+/* Checks that a is not a witness of n being composite, n odd		*/
 
 unsigned char IsItPrime (long long n, long long a)
 {
-	long long d = XpowYmodN(a, n-1, n);
-	if (d==1)
-		return 1;
-	else
-		return 0;
+	long long d = n - 1;
+	long long x;
+	int s = 0;
 
+	/* n - 1 = d * 2^s with d odd  */
+	while ((d & 1) == 0)
+	{
+		d >>= 1;
+		s++;
+	}
+	x = XpowYmodN(a, d, n);
+	if (x == 1 || x == n - 1)
+		return 1;
+	while (--s > 0)
+	{
+		x = MulModN(x, x, n);
+		if (x == n - 1)
+			return 1;
+	}
+	return 0;
 }
 
 
-/*		Raises X to the power Y in modulus N
-		the values of X, Y, and N can be massive, and this can be
-		acheived by first calculating X to the power of 2 then
-		using power chaining over modulus N				*/
+/*		x * y mod N, the product taken on 128 bits so that it never
+		overflows			*/
 
-long long XpowYmodN(long long x, long long y, long long N)
+long long MulModN(long long x, long long y, long long N)
 {
-    int i;
-	long long result = 1;
+	return (long long)((unsigned __int128)(unsigned long long)x
+			* (unsigned long long)y % (unsigned long long)N);
+}
 
-	const long long oneShift63 = (( long long) 1) << 63;
 
-    if (y==1) return (x % N);
+/*		Raises X to the power Y in modulus N, by squaring and
+		multiplying over the bits of Y, X and Y taken as unsigned		*/
 
-	for (i = 0; i < 64; y <<= 1, i++){
-		result = result * result % N;
-		if (y & oneShift63)
-			result = result * x % N;
-	}
+long long XpowYmodN(long long x, long long y, long long N)
+{
+	unsigned long long base = (unsigned long long)x % (unsigned long long)N;
+	unsigned long long exponent = (unsigned long long)y;
+	long long result = 1 % N;
 
+	while (exponent)
+	{
+		if (exponent & 1)
+			result = MulModN(result, (long long)base, N);
+		base = (unsigned long long)MulModN((long long)base, (long long)base, N);
+		exponent >>= 1;
+	}
 	return result;
-
 }
 
 
-/*	Generates a random number by first getting the RTSC of the CPU, then
+/*	Generates a random number from the kernel random source. If it cannot
+|	be read, falls back to the RTSC of the CPU, then
 |	thanks to Ilya O. Levin uses a Linear feedback shift register.
 |	The RTSC is then added to fill the 64-bits					*/
 
 unsigned long long GenerateRandomNumber(void)
 {
+	unsigned long long random;
 	unsigned long rnd = 0x41594c49;
 	unsigned long x   = 0x94c49514;
 	long long  n;
 	unsigned long long ret;
 
+	if (getrandom(&random, sizeof(random), 0) == (ssize_t)sizeof(random))
+		return random;
 
 	LFSR(x);
 
@@ -16,6 +16,7 @@ unsigned long long GeneratePrime(void);
 unsigned char MillerRabin (long long n, long long trials);
 unsigned char IsItPrime (long long n, long long a);
 long long XpowYmodN(long long x, long long y, long long N);
+long long MulModN(long long x, long long y, long long N);
 unsigned long long GenerateRandomNumber(void);
 long long GetSeed( void ); //NIX dependant
 
@@ -1,78 +1,216 @@
 
 #include <sys/time.h>
 #include <time.h>
+#include <stdio.h>
+#include <string.h>
+#include <pthread.h>
 #include "../inc/SSPComs.h"
 #include "../inc/ssp_defines.h"
 #include "Encryption.h"
 #include "serialfunc.h"
 #include "ITLSSPProc.h"
 
+static int SSPSendLinkCommand(SSP_LINK* link, const SSP_PORT port, SSP_COMMAND* cmd);
 
+const unsigned long SSP_STATS_BUCKET_US[SSP_STATS_BUCKETS - 1] = {
+	1000, 2000, 5000, 10000, 20000, 50000,
+	100000, 200000, 500000, 1000000, 2000000,
+};
 
-extern unsigned int encPktCount[MAX_SSP_PORT];
-extern unsigned char sspSeq[MAX_SSP_PORT];
+static unsigned long long _clock_us(void)
+{
+	struct timespec ts;
+
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (unsigned long long)ts.tv_sec * 1000000ULL + ts.tv_nsec / 1000;
+}
+
+/* the capture file, NULL when not capturing   */
+static FILE* captureFile = NULL;
+static unsigned int captureFlags = 0;
+static pthread_mutex_t captureLock = PTHREAD_MUTEX_INITIALIZER;
+#define CAPTURE_BUFFER_SIZE 65536
 
-int CompileSSPCommand(SSP_COMMAND* cmd,SSP_TX_RX_PACKET* ss)
+/* append a record to the capture, if one is running   */
+static void _capture(const unsigned char kind, const SSP_PORT port,
+		const unsigned char address, const unsigned char* data,
+		unsigned int length)
 {
+	unsigned char header[SSP_CAPTURE_RECORD_HEADER];
+	unsigned long long timestamp;
+	struct timespec ts;
+	unsigned int chunk;
+	int i;
 
-	int i,j;
-	unsigned short crc;
-	unsigned char tBuffer[255];
+	if (__atomic_load_n(&captureFile, __ATOMIC_ACQUIRE) == NULL)
+		return;
+	if ((kind == SSP_CAPTURE_COMMAND || kind == SSP_CAPTURE_RESPONSE)
+			&& !(captureFlags & SSP_CAPTURE_PLAIN))
+		return;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	timestamp = (unsigned long long)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+	/* little endian: timestamp (8), kind, address, port (2), length (2)   */
+	for (i = 0; i < 8; i++)
+		header[i] = (unsigned char)(timestamp >> (i * 8));
+	header[8] = kind;
+	header[9] = address;
+	header[10] = (unsigned char)(port & 0xFF);
+	header[11] = (unsigned char)((port >> 8) & 0xFF);
+
+	pthread_mutex_lock(&captureLock);
+	/* longer data is split into records of the same kind   */
+	do {
+		chunk = length > 0xFFFF ? 0xFFFF : length;
+		header[12] = (unsigned char)(chunk & 0xFF);
+		header[13] = (unsigned char)((chunk >> 8) & 0xFF);
+		if (captureFile != NULL){
+			fwrite(header, 1, sizeof(header), captureFile);
+			fwrite(data, 1, chunk, captureFile);
+		}
+		data += chunk;
+		length -= chunk;
+	} while (length > 0);
+	pthread_mutex_unlock(&captureLock);
+}
 
-	ss->rxPtr = 0;
-	for(i = 0; i < 255; i++)
-		ss->rxData[i] = 0x00;
+/*
+Name: StartSSPCapture
+Inputs:
+    char* path: The file to write, replaced if it exists
+    unsigned int flags: SSP_CAPTURE_PLAIN to also write the commands before
+        encryption and the replies after decryption
+Return:
+    1 on success
+    0 if the file cannot be opened or a capture is running
+Notes:
+    Every frame sent or read on any port is written with its CLOCK_MONOTONIC
+    timestamp, through a 64 KB buffer: the file is complete after
+    StopSSPCapture.
+*/
+int StartSSPCapture(const char* path, const unsigned int flags)
+{
+	FILE* file;
+	unsigned char header[SSP_CAPTURE_FILE_HEADER];
+	int i;
 
+	pthread_mutex_lock(&captureLock);
+	if (captureFile != NULL){
+		pthread_mutex_unlock(&captureLock);
+		return 0;
+	}
+	file = fopen(path, "wb");
+	if (file == NULL){
+		pthread_mutex_unlock(&captureLock);
+		return 0;
+	}
+	setvbuf(file, NULL, _IOFBF, CAPTURE_BUFFER_SIZE);
+	memcpy(header, SSP_CAPTURE_MAGIC, 8);
+	for (i = 0; i < 4; i++)
+		header[8 + i] = (unsigned char)(flags >> (i * 8));
+	fwrite(header, 1, sizeof(header), file);
+	captureFlags = flags;
+	__atomic_store_n(&captureFile, file, __ATOMIC_RELEASE);
+	pthread_mutex_unlock(&captureLock);
+	return 1;
+}
 
+void StopSSPCapture(void)
+{
+	FILE* file;
+
+	pthread_mutex_lock(&captureLock);
+	file = captureFile;
+	__atomic_store_n(&captureFile, NULL, __ATOMIC_RELEASE);
+	pthread_mutex_unlock(&captureLock);
+	if (file != NULL)
+		fclose(file);
+}
 
+/* count a command sent attempts times, answered or not   */
+static void _record_command(SSP_STATS* stats, const unsigned char code,
+		const unsigned long long start_us, const unsigned char attempts,
+		const int timeout)
+{
+	SSP_COMMAND_STATS* command;
+	unsigned long long elapsed;
+	int bucket;
+
+	if (stats == NULL)
+		return;
+	command = &stats->commands[code];
+	elapsed = _clock_us() - start_us;
+	command->count++;
+	if (attempts > 1)
+		command->retries += attempts - 1;
+	if (timeout)
+		command->timeouts++;
+	command->total_us += elapsed;
+	if (elapsed > command->max_us)
+		command->max_us = elapsed > 0xFFFFFFFFULL ? 0xFFFFFFFF : (unsigned int)elapsed;
+	for (bucket = 0; bucket < SSP_STATS_BUCKETS - 1; bucket++)
+		if (elapsed <= SSP_STATS_BUCKET_US[bucket])
+			break;
+	command->buckets[bucket]++;
+}
 
+/* append one byte to the tx frame, doubling any SSP_STX   */
+#define TX_STUFF(ss, byte) \
+	do { \
+		if ((ss)->txBufferLength >= sizeof((ss)->txData) - 1) \
+			return 0; \
+		(ss)->txData[(ss)->txBufferLength++] = (byte); \
+		if ((byte) == SSP_STX) \
+			(ss)->txData[(ss)->txBufferLength++] = SSP_STX; \
+	} while (0)
+
+int CompileSSPCommand(SSP_LINK* link,SSP_COMMAND* cmd,SSP_TX_RX_PACKET* ss)
+{
 
+	int i;
+	unsigned short crc;
+	unsigned char byte;
 
 	/* for sync commands reset the deq bit   */
 	if(cmd->CommandData[0] == SSP_CMD_SYNC)
-		sspSeq[cmd->SSPAddress] = 0x80;
+		link->sspSeq[cmd->SSPAddress] = 0x80;
 
 
 
 	/* is this a encrypted packet  */
 	if(cmd->EncryptionStatus){
 
-		if(!EncryptSSPPacket(cmd->SSPAddress ,cmd->CommandData,cmd->CommandData,&cmd->CommandDataLength,&cmd->CommandDataLength,(unsigned long long*)&cmd->Key))
+		if(!EncryptSSPPacket(&link->encPktCount[cmd->SSPAddress],cmd->CommandData,cmd->CommandData,&cmd->CommandDataLength,&cmd->CommandDataLength,(unsigned long long*)&cmd->Key))
 			return 0;
 
 	}
 
 	/* create the packet from this data   */
 	ss->CheckStuff = 0;
+	ss->crcErrors = 0;
 	ss->SSPAddress = cmd->SSPAddress;
 	ss->rxPtr = 0;
 	ss->txPtr = 0;
 	ss->rxBufferLength = 3;
-	ss->txBufferLength = cmd->CommandDataLength + 5;  /* the full ssp packet length   */
 	ss->txData[0] = SSP_STX;					/* ssp packet start   */
-	ss->txData[1] = cmd->SSPAddress | sspSeq[cmd->SSPAddress];  /* the address/seq bit */
-	ss->txData[2] = cmd->CommandDataLength;    /* the data length only (always > 0)  */
-	for(i = 0; i < cmd->CommandDataLength; i++)  /* add the command data  */
-		ss->txData[3 + i] = cmd->CommandData[i];
-	/* calc the packet CRC  (all bytes except STX)   */
-	crc = cal_crc_loop_CCITT_A(ss->txBufferLength - 3,&ss->txData[1] ,CRC_SSP_SEED,CRC_SSP_POLY);
-	ss->txData[3 + cmd->CommandDataLength] = (unsigned char)(crc & 0xFF);
-	ss->txData[4 + cmd->CommandDataLength] = (unsigned char)((crc >> 8) & 0xFF);
-
-
-	/* we now need to 'byte stuff' this buffered data   */
-	j = 0;
-	tBuffer[j++] = ss->txData[0];
-	for(i = 1; i < ss->txBufferLength; i++){
-		tBuffer[j] = ss->txData[i];
-		if (ss->txData[i] ==	SSP_STX){
-			tBuffer[++j] = SSP_STX;   /* SSP_STX found in data so add another to 'stuff it'  */
-		}
-		j++;
+	ss->txBufferLength = 1;
+
+	/* the CRC covers all bytes except STX, it is computed while the
+	   bytes are 'byte stuffed' into the tx buffer   */
+	byte = cmd->SSPAddress | link->sspSeq[cmd->SSPAddress];  /* the address/seq bit */
+	crc = CRC_SSP_UPDATE(CRC_SSP_SEED, byte);
+	TX_STUFF(ss, byte);
+	byte = cmd->CommandDataLength;    /* the data length only (always > 0)  */
+	crc = CRC_SSP_UPDATE(crc, byte);
+	TX_STUFF(ss, byte);
+	for(i = 0; i < cmd->CommandDataLength; i++){  /* add the command data  */
+		byte = cmd->CommandData[i];
+		crc = CRC_SSP_UPDATE(crc, byte);
+		TX_STUFF(ss, byte);
 	}
-	for(i = 0; i < j; i++)
-		ss->txData[i] = tBuffer[i];
-	ss->txBufferLength  = j;
+	byte = (unsigned char)(crc & 0xFF);
+	TX_STUFF(ss, byte);
+	byte = (unsigned char)((crc >> 8) & 0xFF);
+	TX_STUFF(ss, byte);
 
 	return 1;
 }
@@ -89,34 +227,68 @@ Notes:
     In the ssp_command structure:
     EncryptionStatus,SSPAddress,Timeout,RetryLevel,CommandData,CommandDataLength (and Key if using encrpytion) must be set before calling this function
     ResponseStatus,ResponseData,ResponseDataLength will be altered by this function call.
+    Commands to different ports run in parallel, commands to the same port
+    are sent one at a time.
 */
 int  SSPSendCommand(const SSP_PORT port, SSP_COMMAND* cmd)
+{
+    SSP_LINK* link;
+    int ret;
+
+    link = GetSSPLink(port);
+    if(link == NULL){
+        cmd->ResponseStatus = PORT_ERROR;
+        return 0;
+    }
+    pthread_mutex_lock(&link->lock);
+    ret = SSPSendLinkCommand(link, port, cmd);
+    pthread_mutex_unlock(&link->lock);
+    return ret;
+}
+
+static int SSPSendLinkCommand(SSP_LINK* link, const SSP_PORT port, SSP_COMMAND* cmd)
 {
     SSP_TX_RX_PACKET ssp;
 	clock_t txTime,currentTime,rxTime;
 	int i;
 	unsigned char encryptLength;
 	unsigned short crcR;
-	unsigned char buffer;
-	unsigned char tData[255];
+	/* a whole reply, stuffed to up to twice its size, is read at once   */
+	unsigned char buffer[512];
+	int bytesRead;
+	long remaining;
 	unsigned char retry;
 	unsigned int slaveCount;
+	/* the command code, before it is encrypted   */
+	const unsigned char code = cmd->CommandData[0];
+	SSP_STATS* stats = GetSSPLinkStats(link, cmd->SSPAddress);
+	unsigned long long startTime;
+	unsigned char attempts = 0;
+    _capture(SSP_CAPTURE_COMMAND, port, cmd->SSPAddress, cmd->CommandData, cmd->CommandDataLength);
     /* complie the SSP packet and check for errors  */
-    if(!CompileSSPCommand(cmd,&ssp )){
+    if(!CompileSSPCommand(link,cmd,&ssp )){
         cmd->ResponseStatus = SSP_PACKET_ERROR;
         return 0;
     }
 
     retry = cmd->RetryLevel;
+    startTime = _clock_us();
     /* transmit the packet    */
     do{
         ssp.NewResponse = 0;  /* set flag to wait for a new reply from slave   */
+        attempts++;
         if (WriteData(ssp.txData,ssp.txBufferLength,port) == 0)
         {
         //if(WritePort(&ssp) != TRUE){
             cmd->ResponseStatus = PORT_ERROR;
+            if (stats != NULL)
+                stats->port_errors++;
+            _record_command(stats, code, startTime, attempts, 0);
             return 0;
         }
+        if (stats != NULL)
+            stats->bytes_sent += ssp.txBufferLength;
+        _capture(attempts > 1 ? SSP_CAPTURE_RETRY : SSP_CAPTURE_TX, port, cmd->SSPAddress, ssp.txData, ssp.txBufferLength);
 
         /* wait for out reply   */
         cmd->ResponseStatus = SSP_REPLY_OK;
@@ -124,15 +296,26 @@ int  SSPSendCommand(const SSP_PORT port, SSP_COMMAND* cmd)
         while(!ssp.NewResponse){
             /* check for reply timeout   */
             currentTime = GetClockMs();
-            if(currentTime - txTime > cmd->Timeout){
+            remaining = (long)cmd->Timeout - (long)(currentTime - txTime);
+            if(remaining <= 0){
                 cmd->ResponseStatus = SSP_CMD_TIMEOUT;
                 break;
             }
-            while (BytesInBuffer(port) > 0)
-            {
-                ReadData(port,&buffer,1);
-                SSPDataIn(buffer,&ssp);
+            /* sleep until some bytes arrive or the deadline passes   */
+            bytesRead = WaitForData(port,remaining);
+            if (bytesRead < 0){
+                cmd->ResponseStatus = SSP_CMD_TIMEOUT;
+                break;
             }
+            if (bytesRead == 0)
+                continue;
+            bytesRead = ReadData(port,buffer,sizeof(buffer));
+            if (stats != NULL && bytesRead > 0)
+                stats->bytes_received += bytesRead;
+            if (bytesRead > 0)
+                _capture(SSP_CAPTURE_RX, port, cmd->SSPAddress, buffer, bytesRead);
+            for (i = 0; i < bytesRead && !ssp.NewResponse; i++)
+                SSPDataIn(buffer[i],&ssp);
         }
 
         if(cmd->ResponseStatus == SSP_REPLY_OK)
@@ -143,6 +326,10 @@ int  SSPSendCommand(const SSP_PORT port, SSP_COMMAND* cmd)
 
 
     rxTime = GetClockMs();
+    if (stats != NULL)
+        stats->crc_errors += ssp.crcErrors;
+    _record_command(stats, code, startTime, attempts,
+            cmd->ResponseStatus == SSP_CMD_TIMEOUT);
 
     if(cmd->ResponseStatus == SSP_CMD_TIMEOUT){
             cmd->ResponseData[0] = SSP_RESPONSE_TIMEOUT;
@@ -155,10 +342,13 @@ int  SSPSendCommand(const SSP_PORT port, SSP_COMMAND* cmd)
     if(ssp.rxData[3] == SSP_STEX){   /* check for encrpted packet    */
         encryptLength = ssp.rxData[2] - 1;
         DecryptSSPPacket(&ssp.rxData[4],&ssp.rxData[4],&encryptLength,&encryptLength,(unsigned long long*)&cmd->Key);
-        /* check the checsum    */
+        /* check the checsum and the inner length   */
         crcR = cal_crc_loop_CCITT_A(encryptLength - 2,&ssp.rxData[4] ,CRC_SSP_SEED,CRC_SSP_POLY);
-        if((unsigned char)(crcR & 0xFF) != ssp.rxData[ssp.rxData[2] + 1] || (unsigned char)((crcR >> 8) & 0xFF) != ssp.rxData[ssp.rxData[2] + 2]){
+        if((unsigned char)(crcR & 0xFF) != ssp.rxData[ssp.rxData[2] + 1] || (unsigned char)((crcR >> 8) & 0xFF) != ssp.rxData[ssp.rxData[2] + 2]
+                || ssp.rxData[4] + 7 > encryptLength){
             cmd->ResponseStatus = SSP_PACKET_ERROR;
+            if (stats != NULL)
+                stats->packet_errors++;
             return 0;
         }
         /* check the slave count against the host count  */
@@ -166,48 +356,40 @@ int  SSPSendCommand(const SSP_PORT port, SSP_COMMAND* cmd)
         for(i = 0; i < 4; i++)
             slaveCount += (unsigned int)(ssp.rxData[5 + i]) << (i*8);
         /* no match then we discard this packet and do not act on it's info  */
-        if(slaveCount != encPktCount[cmd->SSPAddress] ){
+        if(slaveCount != link->encPktCount[cmd->SSPAddress] ){
             cmd->ResponseStatus = SSP_PACKET_ERROR;
+            if (stats != NULL)
+                stats->counter_mismatches++;
             return 0;
         }
 
-        /* restore data for correct decode  */
-        ssp.rxBufferLength = ssp.rxData[4] + 5;
-        tData[0] = ssp.rxData[0];
-        tData[1] = ssp.rxData[1];
-        tData[2] = ssp.rxData[4];
-        for(i = 0; i < ssp.rxData[4]; i++)
-            tData[3 + i] = ssp.rxData[9 + i];
-        crcR = cal_crc_loop_CCITT_A(ssp.rxBufferLength - 3,&tData[1] ,CRC_SSP_SEED,CRC_SSP_POLY);
-        tData[3 + ssp.rxData[4]] = (unsigned char)(crcR & 0xFF);
-        tData[4 + ssp.rxData[4]] = (unsigned char)((crcR >> 8) & 0xFF);
-        for(i = 0; i < ssp.rxBufferLength; i++)
-            ssp.rxData[i] = tData[i];
+        /* the decrypted data goes straight to the response   */
+        cmd->ResponseDataLength = ssp.rxData[4];
+        memcpy(cmd->ResponseData,&ssp.rxData[9],cmd->ResponseDataLength);
 
         /* for decrypted resonse with encrypted command, increment the counter here  */
     //	if(!cmd->EncryptionStatus)
           //encPktCount[cmd->SSPAddress]++;
 
-
+    }else{
+        /*for(i = 0; i < ssp.rxBufferLength; i++)
+                printf("%x ", ssp.rxData[i]);
+            printf("\n");*/
+        cmd->ResponseDataLength = ssp.rxData[2];
+        memcpy(cmd->ResponseData,&ssp.rxData[3],cmd->ResponseDataLength);
     }
 
-    /*for(i = 0; i < ssp.rxBufferLength; i++)
-            printf("%x ", ssp.rxData[i]);
-        printf("\n");*/
-    cmd->ResponseDataLength = ssp.rxData[2];
-    for(i = 0; i < cmd->ResponseDataLength; i++)
-        cmd->ResponseData[i] = ssp.rxData[i + 3];
-
 
     /* alternate the seq bit   */
-    if(sspSeq[cmd->SSPAddress] == 0x80)
-        sspSeq[cmd->SSPAddress] = 0;
+    if(link->sspSeq[cmd->SSPAddress] == 0x80)
+        link->sspSeq[cmd->SSPAddress] = 0;
     else
-        sspSeq[cmd->SSPAddress] = 0x80;
+        link->sspSeq[cmd->SSPAddress] = 0x80;
 
 
 	/* terminate the thread function   */
 	cmd->ResponseStatus = SSP_REPLY_OK;
+	_capture(SSP_CAPTURE_RESPONSE, port, cmd->SSPAddress, cmd->ResponseData, cmd->ResponseDataLength);
 
 	return 1;
 }
@@ -215,18 +397,50 @@ int  SSPSendCommand(const SSP_PORT port, SSP_COMMAND* cmd)
 clock_t GetClockMs()
 {
     clock_t test;
-    struct timeval tv;
-    gettimeofday(&tv, 0);
-    test = tv.tv_sec * 1000;
-    test += (tv.tv_usec)/1000;
+    struct timespec ts;
+    /* monotonic, so the reply deadlines survive a change of the wall clock  */
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    test = ts.tv_sec * 1000;
+    test += (ts.tv_nsec)/1000000;
     return test;
 }
 
 
-void SSPDataIn(unsigned char RxChar, SSP_TX_RX_PACKET* ss)
+/* store a received (unstuffed) byte, adding it to the running crc   */
+static void _rx_add(unsigned char RxChar, SSP_TX_RX_PACKET* ss)
 {
-	unsigned short crc;
+	/* all bytes but STX and the two crc bytes are covered by the crc   */
+	if (ss->rxPtr == 1)
+		ss->rxCrc = CRC_SSP_UPDATE(CRC_SSP_SEED, RxChar);
+	else if (ss->rxPtr < 3 || ss->rxPtr < ss->rxBufferLength - 2)
+		ss->rxCrc = CRC_SSP_UPDATE(ss->rxCrc, RxChar);
+	ss->rxData[ss->rxPtr++] = RxChar;
+	// get the packet length
+	if (ss->rxPtr == 3)
+		ss->rxBufferLength = ss->rxData[2] + 5;
+}
+
+void SSPResetRx(SSP_TX_RX_PACKET* ss, const unsigned char address)
+{
+	ss->SSPAddress = address;
+	ss->rxPtr = 0;
+	ss->rxBufferLength = 3;
+	ss->CheckStuff = 0;
+	ss->NewResponse = 0;
+	ss->crcErrors = 0;
+}
+
+int SSPFeedData(SSP_TX_RX_PACKET* ss, const unsigned char* data, const int length)
+{
+	int i;
+
+	for (i = 0; i < length && !ss->NewResponse; i++)
+		SSPDataIn(data[i], ss);
+	return i;
+}
 
+void SSPDataIn(unsigned char RxChar, SSP_TX_RX_PACKET* ss)
+{
     //printf("REC:%d\n",RxChar);
 	if (RxChar == SSP_STX && ss->rxPtr == 0){
 		// packet start
@@ -237,32 +451,28 @@ void SSPDataIn(unsigned char RxChar, SSP_TX_RX_PACKET* ss)
 		if (ss->CheckStuff == 1){
 			if (RxChar != SSP_STX){
 				ss->rxData[0] = SSP_STX;
-				ss->rxData[1] = RxChar;
-				ss->rxPtr = 2;
-			}else
-				ss->rxData[ss->rxPtr++] = RxChar;
+				ss->rxPtr = 1;
+			}
+			_rx_add(RxChar,ss);
 			// reset stuff check flag
 			ss->CheckStuff = 0;
 		}else{
 			// set flag for stuffed byte check
 			if (RxChar == SSP_STX)
 				ss->CheckStuff = 1;
-			else{
+			else
 				// add data to packet
-				ss->rxData[ss->rxPtr++] = RxChar;
-				// get the packet length
-				if (ss->rxPtr == 	3)
-					ss->rxBufferLength = ss->rxData[2] + 5;
-			}
+				_rx_add(RxChar,ss);
 		}
 		// are we at the end of the packet
 		if (ss->rxPtr  == ss->rxBufferLength ){
 			// is this packet for us ??
 			if ((ss->rxData[1] & SSP_STX) == ss->SSPAddress){
 				// is the checksum correct
-				crc = cal_crc_loop_CCITT_A(ss->rxBufferLength - 3,&ss->rxData[1] ,CRC_SSP_SEED,CRC_SSP_POLY);
-				if ((unsigned char)(crc & 0xFF) == ss->rxData[ss->rxBufferLength - 2] && (unsigned char)((crc >> 8) & 0xFF) == ss->rxData[ss->rxBufferLength - 1])
+				if ((unsigned char)(ss->rxCrc & 0xFF) == ss->rxData[ss->rxBufferLength - 2] && (unsigned char)((ss->rxCrc >> 8) & 0xFF) == ss->rxData[ss->rxBufferLength - 1])
 					ss->NewResponse = 1;  /* we have a new response so set flag  */
+				else if (ss->crcErrors < 0xFF)
+					ss->crcErrors++;
 			}
 			// reset packet
 			ss->rxPtr  = 0;
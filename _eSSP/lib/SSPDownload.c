@@ -191,13 +191,12 @@ unsigned short _read_single_byte_reply(ITL_FILE_DOWNLOAD * itlFile, const unsign
     unsigned char buffer;
     clock_t start = GetClockMs();
 
-    while(BytesInBuffer(itlFile->port) == 0)
+    while(ReadData(itlFile->port,&buffer,1) != 1)
     {
-        usleep(1000);
-        if (GetClockMs()-start > timeout)
+        long remaining = (long)timeout - (long)(GetClockMs()-start);
+        if (remaining <= 0 || WaitForData(itlFile->port,remaining) < 0)
             return -1;
     }
-    ReadData(itlFile->port,&buffer,1);
     return buffer;
 }
 
@@ -217,13 +216,11 @@ unsigned char _send_download_command(const unsigned char * data, const unsigned
     return 0;
 }
 
-#define RAM_DWNL_BLOCK_SIZE				128
 unsigned long _download_ram_file(ITL_FILE_DOWNLOAD * itlFile, SSP_COMMAND * sspC)
 {
     unsigned long i;
     unsigned long baud;
     unsigned char buffer;
-    int numRamBlocks;
     //initiate communication
 	sspC->CommandDataLength = 2;
 	sspC->CommandData[0] = SSP_CMD_PROGRAM;
@@ -261,20 +258,8 @@ unsigned long _download_ram_file(ITL_FILE_DOWNLOAD * itlFile, SSP_COMMAND * sspC
 
     usleep(500000);
 
-    numRamBlocks = itlFile->NumberOfRamBytes/RAM_DWNL_BLOCK_SIZE;
-
-    for (i = 0; i < numRamBlocks; i++){
-		WriteData(&itlFile->fData[128+(i*RAM_DWNL_BLOCK_SIZE)],RAM_DWNL_BLOCK_SIZE,itlFile->port);
-		while (TransmitComplete(itlFile->port) == 0)
-                    usleep(1000);
-
-		//ramStatus.currentRamBlocks = i;
-	}
-
-    if ((itlFile->NumberOfRamBytes % RAM_DWNL_BLOCK_SIZE) != 0)
-    {
-        WriteData(&itlFile->fData[128+(i*RAM_DWNL_BLOCK_SIZE)],itlFile->NumberOfRamBytes % RAM_DWNL_BLOCK_SIZE,itlFile->port);
-    }
+    /* WriteData drains the port itself, send the whole ram file at once   */
+    WriteData(&itlFile->fData[128],itlFile->NumberOfRamBytes,itlFile->port);
     buffer = _read_single_byte_reply(itlFile,500);
     //check checksum
     if (itlFile->fData[0x10] != buffer)
@@ -316,8 +301,6 @@ unsigned long _download_main_file(ITL_FILE_DOWNLOAD * itlFile)
 
         }*/
         WriteData(&itlFile->fData[block_offset ],itlFile->dwnlBlockSize,itlFile->port);
-        while (TransmitComplete(itlFile->port) == 0)
-            usleep(1000);
         if (_send_download_command(&chk,1,chk,itlFile) ==0)
             return DATA_TRANSFER_FAIL;
 
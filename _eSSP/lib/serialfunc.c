@@ -6,8 +6,11 @@
 #include <errno.h>   /* Error number definitions */
 #include <termios.h> /* POSIX terminal control definitions */
 #include <sys/ioctl.h>
+#include <poll.h>
+#include <pthread.h>
 #include "../inc/itl_types.h"
 #include "serialfunc.h"
+#include "ITLSSPProc.h"
 //#include <asm/termios.h>
 #define FIONREAD 0x541B
 //port is the device name ( eg /dev/ttyUSB0 )
@@ -43,15 +46,100 @@ Inputs:
 Return:
     void
 Notes:
+    Also forgets the protocol state (sequence bits, packet counters) of the port.
 */
 void CloseSSPPort(const SSP_PORT port)
 {
 	if (port >= 0)
 	{
+		SetWritePacing(port, 0);
+		ReleaseSSPLink(port);
 		close(port);
 	}
 }
 
+#define MAX_PACED_PORTS 16
+#define WRITE_TIMEOUT_MS 1000
+
+static struct {
+	SSP_PORT port;
+	unsigned long pacing;
+} pacedPorts[MAX_PACED_PORTS];
+static int numPacedPorts = 0;
+static pthread_mutex_t pacedPortsLock = PTHREAD_MUTEX_INITIALIZER;
+
+/*
+Name: SetWritePacing
+Inputs:
+    SSP_PORT port: The port to configure
+    unsigned long pacing: Pause after every transmitted frame (in microseconds), 0 to disable
+Return:
+    1 on success
+    0 if too many ports are paced
+Notes:
+    Only needed for devices that cannot take back to back frames.
+*/
+int SetWritePacing(const SSP_PORT port, const unsigned long pacing)
+{
+	int i;
+	int ret = 1;
+	pthread_mutex_lock(&pacedPortsLock);
+	for (i = 0; i < numPacedPorts; i++)
+	{
+		if (pacedPorts[i].port == port)
+			break;
+	}
+	if (pacing == 0)
+	{
+		if (i < numPacedPorts)
+			pacedPorts[i] = pacedPorts[--numPacedPorts];
+	}
+	else if (i == numPacedPorts && numPacedPorts == MAX_PACED_PORTS)
+	{
+		ret = 0;
+	}
+	else
+	{
+		if (i == numPacedPorts)
+			numPacedPorts++;
+		pacedPorts[i].port = port;
+		pacedPorts[i].pacing = pacing;
+	}
+	pthread_mutex_unlock(&pacedPortsLock);
+	return ret;
+}
+
+unsigned long GetWritePacing(const SSP_PORT port)
+{
+	int i;
+	unsigned long pacing = 0;
+	pthread_mutex_lock(&pacedPortsLock);
+	for (i = 0; i < numPacedPorts; i++)
+	{
+		if (pacedPorts[i].port == port)
+		{
+			pacing = pacedPorts[i].pacing;
+			break;
+		}
+	}
+	pthread_mutex_unlock(&pacedPortsLock);
+	return pacing;
+}
+
+/*
+Name: WriteData
+Inputs:
+    unsigned char * data: The bytes to send
+    unsigned long length: The number of bytes to send
+    SSP_PORT port: The port to use
+Return:
+    1 on success
+    0 on failure
+Notes:
+    Hands the whole buffer to the driver, sleeping in poll() whenever the
+    output queue is full, then waits in tcdrain() until the last byte has
+    left the port. The pause set with SetWritePacing is applied after that.
+*/
 int WriteData(const unsigned char * data, unsigned long length, const SSP_PORT port)
 {
 	long n;
@@ -61,21 +149,39 @@ int WriteData(const unsigned char * data, unsigned long length, const SSP_PORT p
     printf("\n");*/
 	long offset;
 	long bytes_left = length;
+	struct pollfd pfd;
+	unsigned long pacing;
 	offset = 0;
 	while (bytes_left > 0)
 	{
-		while (TransmitComplete(port) == 0)
-			usleep(100);
 		n = write(port,&data[offset],bytes_left);
-		usleep(500);
 		if (n < 0)
 		{
-			perror("Write Port Failed");
-			return 0;
+			if (errno == EINTR)
+				continue;
+			if (errno != EAGAIN && errno != EWOULDBLOCK)
+			{
+				perror("Write Port Failed");
+				return 0;
+			}
+			/* the output queue is full, wait for some room   */
+			pfd.fd = port;
+			pfd.events = POLLOUT;
+			pfd.revents = 0;
+			if (poll(&pfd, 1, WRITE_TIMEOUT_MS) <= 0 || !(pfd.revents & POLLOUT))
+			{
+				perror("Write Port Failed");
+				return 0;
+			}
+			continue;
 		}
 		offset += n;
 		bytes_left -= n;
 	}
+	tcdrain(port);
+	pacing = GetWritePacing(port);
+	if (pacing > 0)
+		usleep(pacing);
 	return 1;
 }
 
@@ -132,29 +238,76 @@ int ReadData(const SSP_PORT port, unsigned char * buffer, unsigned long bytes_to
 	return read(port,buffer,bytes_to_read);
 }
 
-void SetBaud(const SSP_PORT port, const unsigned long baud)
+/*
+Name: WaitForData
+Inputs:
+    SSP_PORT port: The port to wait on
+    long timeout: The maximum time to wait (in milliseconds)
+Return:
+    1 when data can be read
+    0 on timeout (or when interrupted by a signal)
+    -1 on error
+Notes:
+    Sleeps in poll() instead of spinning on BytesInBuffer.
+*/
+int WaitForData(const SSP_PORT port, const long timeout)
+{
+	struct pollfd pfd;
+	int ret;
+
+	pfd.fd = port;
+	pfd.events = POLLIN;
+	pfd.revents = 0;
+	ret = poll(&pfd, 1, timeout < 0 ? 0 : timeout);
+	if (ret < 0)
+		return (errno == EINTR) ? 0 : -1;
+	if (ret > 0 && !(pfd.revents & POLLIN))
+		return -1;
+	return ret;
+}
+
+/*
+Name: SetBaud
+Inputs:
+    SSP_PORT port: The port to configure
+    unsigned long baud: 9600, 19200, 38400, 57600 or 115200
+Return:
+    1 on success
+    0 if the rate is not supported or the port refused it
+Notes:
+    Sets the input and output speeds together and drops the bytes
+    received at the old rate.
+*/
+int SetBaud(const SSP_PORT port, const unsigned long baud)
 {
 	struct termios options;
-	tcgetattr(port,&options);
-	//9600 baud
+	speed_t speed;
 	switch(baud)
 	{
     case 9600:
-        cfsetispeed(&options,B9600);
+        speed = B9600;
         break;
     case 19200:
-        cfsetispeed(&options,B19200);
+        speed = B19200;
         break;
     case 38400:
-        cfsetispeed(&options,B38400);
+        speed = B38400;
         break;
     case 57600:
-        cfsetispeed(&options,B57600);
+        speed = B57600;
         break;
     case 115200:
-        cfsetispeed(&options,B115200);
+        speed = B115200;
         break;
+    default:
+        return 0;
 	}
-	tcsetattr( port,TCSANOW,&options);
-	tcgetattr(port,&options);
+	if (tcgetattr(port,&options) != 0)
+		return 0;
+	cfsetispeed(&options,speed);
+	cfsetospeed(&options,speed);
+	if (tcsetattr(port,TCSADRAIN,&options) != 0)
+		return 0;
+	tcflush(port,TCIFLUSH);
+	return 1;
 }
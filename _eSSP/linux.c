@@ -1,12 +1,11 @@
 #include "port_linux.h"
+#include "poller.h"
 
 #include <termios.h>
 #include <unistd.h>
 #include <sys/types.h>
 #include <sys/time.h>
 
-static int open_port = 0;
-
 /* Some helper funtions for detecting keyboard input */
 void changemode(int dir)
 {
@@ -50,29 +49,65 @@ int kbhit(void)
 
 }
 
-int open_ssp_port(const char* port)
+int open_ssp_port(SSP_COMMAND* sspC, const char* port)
 {
-    open_port = OpenSSPPort(port);
-    return (open_port != -1);
+    sspC->Port = OpenSSPPort(port);
+    return (sspC->Port != -1);
 }
 
-void close_ssp_port()
+void close_ssp_port(SSP_COMMAND* sspC)
 {
-    CloseSSPPort(open_port);
+    CloseSSPPort(sspC->Port);
+    sspC->Port = -1;
 }
 
-int send_ssp_command(SSP_COMMAND* sspC)
+int set_ssp_write_pacing(SSP_COMMAND* sspC, unsigned long pacing)
+{
+    return SetWritePacing(sspC->Port, pacing);
+}
+
+int set_ssp_port_baud(SSP_COMMAND* sspC, unsigned long baud)
 {
+    return SetBaud(sspC->Port, baud);
+}
 
-    return SSPSendCommand(open_port, sspC);
+int ssp_get_stats(SSP_COMMAND* sspC, SSP_STATS* stats)
+{
+    return GetSSPStats(sspC->Port, sspC->SSPAddress, stats);
 }
 
-int negotiate_ssp_encryption(SSP_COMMAND* sspC, SSP_FULL_KEY* hostKey)
+int ssp_capture_start(const char* path, unsigned int flags)
 {
-    return NegotiateSSPEncryption(open_port, sspC->SSPAddress, hostKey);
+    return StartSSPCapture(path, flags);
 }
 
-int get_open_port()
+void ssp_capture_stop(void)
+{
+    StopSSPCapture();
+}
+
+// While a poller owns the port, it sends the commands of the other threads
+// between its polls
+int send_ssp_command(SSP_COMMAND* sspC)
+{
+    SSP_POLLER* poller = ssp_poller_acquire(sspC);
+    int result;
+
+    if (poller == NULL)
+        return SSPSendCommand(sspC->Port, sspC);
+    result = ssp_poller_send(poller, sspC);
+    ssp_poller_release(poller);
+    return result;
+}
+
+int negotiate_ssp_encryption(SSP_COMMAND* sspC, SSP_FULL_KEY* hostKey)
 {
-    return open_port;
+    SSP_POLLER* poller = ssp_poller_acquire(sspC);
+    int result;
+
+    if (poller == NULL)
+        return NegotiateSSPEncryption(sspC->Port, sspC->SSPAddress, hostKey);
+    result = ssp_poller_negotiate(poller, sspC, hostKey);
+    ssp_poller_release(poller);
+    return result;
 }
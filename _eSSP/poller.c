@@ -0,0 +1,398 @@
+#include "poller.h"
+
+#include <errno.h>
+#include <pthread.h>
+#include <stdlib.h>
+#include <time.h>
+
+// A command run by the poller thread for another thread
+typedef struct
+{
+    int (*run)(SSP_COMMAND*, SSP_FULL_KEY*);
+    SSP_COMMAND* sspC;
+    SSP_FULL_KEY* key;
+    int result;
+    int done;
+} SSP_POLLER_JOB;
+
+struct SSP_POLLER
+{
+    SSP_COMMAND* sspC;      // the command of the owner, run for other threads
+    SSP_COMMAND pollC;      // the poller's own command, for the polls
+    pthread_t thread;
+
+    // Single producer (the poller thread), single consumer ring. head is
+    // only written by the producer and tail by the consumer.
+    SSP_POLL_RECORD ring[SSP_POLLER_RING_SIZE];
+    unsigned int head;
+    unsigned int tail;
+
+    // Guards the fields below, never held during a poll or a command
+    pthread_mutex_t lock;
+    pthread_cond_t wake;        // the poller thread waits on it
+    pthread_cond_t done;        // the command callers wait on it
+    pthread_cond_t ready;       // the ring reader waits on it
+    int stop;
+    int woken;
+    unsigned long long interval_ns;
+    unsigned long long next_poll_ns;
+
+    // The command waiting to be run by the poller thread, and the number
+    // of threads that took the poller with ssp_poller_acquire: it is not
+    // freed until they release it
+    SSP_POLLER_JOB* job;
+    int callers;
+
+    SSP_POLLER_STATS stats;
+};
+
+// Held while sspC->Poller is taken by a sender or cleared by
+// ssp_poller_stop, so a poller is never taken once its stop began
+static pthread_mutex_t _publish_lock = PTHREAD_MUTEX_INITIALIZER;
+
+static unsigned long long _now_ns(void)
+{
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (unsigned long long)now.tv_sec * 1000000000ULL + now.tv_nsec;
+}
+
+static void _deadline(struct timespec* deadline, unsigned long long ns)
+{
+    deadline->tv_sec = ns / 1000000000ULL;
+    deadline->tv_nsec = ns % 1000000000ULL;
+}
+
+static int _is_poller_thread(const SSP_POLLER* poller)
+{
+    return pthread_equal(pthread_self(), poller->thread);
+}
+
+static int _send_job(SSP_COMMAND* sspC, SSP_FULL_KEY* key)
+{
+    (void)key;
+    return SSPSendCommand(sspC->Port, sspC);
+}
+
+static int _negotiate_job(SSP_COMMAND* sspC, SSP_FULL_KEY* key)
+{
+    return NegotiateSSPEncryption(sspC->Port, sspC->SSPAddress, key);
+}
+
+// Return 0 if the ring is full
+static int _push(SSP_POLLER* poller, const SSP_POLL_RECORD* record)
+{
+    const unsigned int head = __atomic_load_n(&poller->head, __ATOMIC_RELAXED);
+    const unsigned int tail = __atomic_load_n(&poller->tail, __ATOMIC_ACQUIRE);
+
+    if (head - tail == SSP_POLLER_RING_SIZE)
+        return 0;
+    poller->ring[head % SSP_POLLER_RING_SIZE] = *record;
+    __atomic_store_n(&poller->head, head + 1, __ATOMIC_RELEASE);
+    return 1;
+}
+
+static void _poll(SSP_POLLER* poller, unsigned long long due_ns)
+{
+    SSP_POLL_RECORD record;
+    unsigned long long late_ns;
+    int pushed;
+
+    // The owner may have negotiated a new key since the last poll
+    poller->pollC.Key = poller->sspC->Key;
+    poller->pollC.EncryptionStatus = poller->sspC->EncryptionStatus;
+
+    record.timestamp_ns = _now_ns();
+    record.sequence = poller->stats.polls;
+    record.poll.event_count = 0;
+    record.response = ssp6_poll(&poller->pollC, &record.poll);
+
+    pushed = _push(poller, &record);
+
+    late_ns = record.timestamp_ns > due_ns ? record.timestamp_ns - due_ns : 0;
+    pthread_mutex_lock(&poller->lock);
+    poller->stats.polls++;
+    if (late_ns > SSP_POLLER_LATE_NS)
+        poller->stats.late_polls++;
+    if (late_ns > poller->stats.max_late_ns)
+        poller->stats.max_late_ns = late_ns;
+    if (!pushed)
+        poller->stats.dropped++;
+    pthread_cond_broadcast(&poller->ready);
+    pthread_mutex_unlock(&poller->lock);
+}
+
+static void* _run(void* arg)
+{
+    SSP_POLLER* poller = arg;
+
+    pthread_mutex_lock(&poller->lock);
+    while (!poller->stop)
+    {
+        unsigned long long now = _now_ns();
+
+        if (poller->job != NULL)
+        {
+            // Run the queued command, the caller waits for it
+            SSP_POLLER_JOB* job = poller->job;
+            int result;
+
+            poller->job = NULL;
+            pthread_mutex_unlock(&poller->lock);
+            result = job->run(job->sspC, job->key);
+            pthread_mutex_lock(&poller->lock);
+            job->result = result;
+            job->done = 1;
+            poller->stats.commands++;
+            pthread_cond_broadcast(&poller->done);
+        }
+        else if (now >= poller->next_poll_ns)
+        {
+            const unsigned long long due_ns = poller->next_poll_ns;
+
+            pthread_mutex_unlock(&poller->lock);
+            _poll(poller, due_ns);
+            pthread_mutex_lock(&poller->lock);
+            // Keep the cadence, unless the poll is so late that catching up
+            // would send polls back to back
+            poller->next_poll_ns = due_ns + poller->interval_ns;
+            now = _now_ns();
+            if (poller->next_poll_ns < now)
+                poller->next_poll_ns = now + poller->interval_ns;
+        }
+        else
+        {
+            struct timespec deadline;
+
+            _deadline(&deadline, poller->next_poll_ns);
+            pthread_cond_timedwait(&poller->wake, &poller->lock, &deadline);
+        }
+    }
+    pthread_mutex_unlock(&poller->lock);
+    return NULL;
+}
+
+SSP_POLLER* ssp_poller_start(SSP_COMMAND* sspC, unsigned long interval_us)
+{
+    SSP_POLLER* poller;
+    pthread_condattr_t attr;
+
+    if (__atomic_load_n(&sspC->Poller, __ATOMIC_ACQUIRE) != NULL)
+        return NULL;
+
+    poller = calloc(1, sizeof(SSP_POLLER));
+    if (poller == NULL)
+        return NULL;
+
+    poller->sspC = sspC;
+    poller->pollC = *sspC;
+    poller->pollC.Poller = NULL;
+    poller->interval_ns = (unsigned long long)interval_us * 1000ULL;
+    poller->next_poll_ns = _now_ns();
+
+    pthread_mutex_init(&poller->lock, NULL);
+    // The waits take CLOCK_MONOTONIC deadlines
+    pthread_condattr_init(&attr);
+    pthread_condattr_setclock(&attr, CLOCK_MONOTONIC);
+    pthread_cond_init(&poller->wake, &attr);
+    pthread_cond_init(&poller->done, &attr);
+    pthread_cond_init(&poller->ready, &attr);
+    pthread_condattr_destroy(&attr);
+
+    if (pthread_create(&poller->thread, NULL, _run, poller) != 0)
+    {
+        pthread_cond_destroy(&poller->wake);
+        pthread_cond_destroy(&poller->done);
+        pthread_cond_destroy(&poller->ready);
+        pthread_mutex_destroy(&poller->lock);
+        free(poller);
+        return NULL;
+    }
+    // Published once the thread runs, ssp_poller_acquire takes it
+    __atomic_store_n(&sspC->Poller, poller, __ATOMIC_RELEASE);
+    return poller;
+}
+
+void ssp_poller_stop(SSP_POLLER* poller)
+{
+    // New commands are sent directly, those which took the poller
+    // already are counted in callers
+    pthread_mutex_lock(&_publish_lock);
+    __atomic_store_n(&poller->sspC->Poller, NULL, __ATOMIC_RELEASE);
+    pthread_mutex_unlock(&_publish_lock);
+
+    pthread_mutex_lock(&poller->lock);
+    poller->stop = 1;
+    pthread_cond_broadcast(&poller->wake);
+    pthread_cond_broadcast(&poller->ready);
+    pthread_cond_broadcast(&poller->done);
+    pthread_mutex_unlock(&poller->lock);
+    pthread_join(poller->thread, NULL);
+
+    // Let the threads still waiting for a command see it was not run, and
+    // those which took the poller release it
+    pthread_mutex_lock(&poller->lock);
+    while (poller->callers > 0)
+        pthread_cond_wait(&poller->done, &poller->lock);
+    pthread_mutex_unlock(&poller->lock);
+
+    pthread_cond_destroy(&poller->wake);
+    pthread_cond_destroy(&poller->done);
+    pthread_cond_destroy(&poller->ready);
+    pthread_mutex_destroy(&poller->lock);
+    free(poller);
+}
+
+void ssp_poller_set_interval(SSP_POLLER* poller, unsigned long interval_us)
+{
+    const unsigned long long interval_ns =
+            (unsigned long long)interval_us * 1000ULL;
+
+    pthread_mutex_lock(&poller->lock);
+    if (interval_ns != poller->interval_ns)
+    {
+        // The next poll comes one new interval after the last one, or now
+        // if that is already past
+        const unsigned long long now = _now_ns();
+
+        poller->next_poll_ns =
+                poller->next_poll_ns - poller->interval_ns + interval_ns;
+        if (poller->next_poll_ns < now)
+            poller->next_poll_ns = now;
+        poller->interval_ns = interval_ns;
+        pthread_cond_broadcast(&poller->wake);
+    }
+    pthread_mutex_unlock(&poller->lock);
+}
+
+int ssp_poller_read(SSP_POLLER* poller, SSP_POLL_RECORD* records, int max)
+{
+    const unsigned int head = __atomic_load_n(&poller->head, __ATOMIC_ACQUIRE);
+    unsigned int tail = __atomic_load_n(&poller->tail, __ATOMIC_RELAXED);
+    int count = 0;
+
+    while (tail != head && count < max)
+    {
+        records[count++] = poller->ring[tail % SSP_POLLER_RING_SIZE];
+        tail++;
+    }
+    __atomic_store_n(&poller->tail, tail, __ATOMIC_RELEASE);
+    return count;
+}
+
+static int _ring_size(SSP_POLLER* poller)
+{
+    return __atomic_load_n(&poller->head, __ATOMIC_ACQUIRE)
+            - __atomic_load_n(&poller->tail, __ATOMIC_RELAXED);
+}
+
+int ssp_poller_wait(SSP_POLLER* poller, unsigned long timeout_ms)
+{
+    struct timespec deadline;
+    int size;
+
+    _deadline(&deadline, _now_ns() + (unsigned long long)timeout_ms * 1000000ULL);
+    pthread_mutex_lock(&poller->lock);
+    while ((size = _ring_size(poller)) == 0 && !poller->woken && !poller->stop)
+    {
+        if (pthread_cond_timedwait(&poller->ready, &poller->lock, &deadline)
+                == ETIMEDOUT)
+            break;
+    }
+    poller->woken = 0;
+    pthread_mutex_unlock(&poller->lock);
+    return size;
+}
+
+void ssp_poller_wake(SSP_POLLER* poller)
+{
+    pthread_mutex_lock(&poller->lock);
+    poller->woken = 1;
+    pthread_cond_broadcast(&poller->ready);
+    pthread_mutex_unlock(&poller->lock);
+}
+
+void ssp_poller_stats(SSP_POLLER* poller, SSP_POLLER_STATS* stats)
+{
+    pthread_mutex_lock(&poller->lock);
+    *stats = poller->stats;
+    pthread_mutex_unlock(&poller->lock);
+}
+
+static int _run_job(
+        SSP_POLLER* poller,
+        int (*run)(SSP_COMMAND*, SSP_FULL_KEY*),
+        SSP_COMMAND* sspC,
+        SSP_FULL_KEY* key)
+{
+    SSP_POLLER_JOB job;
+
+    if (_is_poller_thread(poller))
+        return run(sspC, key);
+
+    job.run = run;
+    job.sspC = sspC;
+    job.key = key;
+    job.result = 0;
+    job.done = 0;
+
+    pthread_mutex_lock(&poller->lock);
+    // One command at a time
+    while (poller->job != NULL && !poller->stop)
+        pthread_cond_wait(&poller->done, &poller->lock);
+    if (!poller->stop)
+    {
+        poller->job = &job;
+        pthread_cond_broadcast(&poller->wake);
+        while (!job.done)
+        {
+            if (poller->stop && poller->job == &job)
+            {
+                // The poller stopped before taking it
+                poller->job = NULL;
+                break;
+            }
+            pthread_cond_wait(&poller->done, &poller->lock);
+        }
+    }
+    pthread_mutex_unlock(&poller->lock);
+    return job.result;
+}
+
+SSP_POLLER* ssp_poller_acquire(SSP_COMMAND* sspC)
+{
+    SSP_POLLER* poller;
+
+    pthread_mutex_lock(&_publish_lock);
+    poller = __atomic_load_n(&sspC->Poller, __ATOMIC_ACQUIRE);
+    if (poller != NULL)
+    {
+        pthread_mutex_lock(&poller->lock);
+        poller->callers++;
+        pthread_mutex_unlock(&poller->lock);
+    }
+    pthread_mutex_unlock(&_publish_lock);
+    return poller;
+}
+
+void ssp_poller_release(SSP_POLLER* poller)
+{
+    pthread_mutex_lock(&poller->lock);
+    poller->callers--;
+    pthread_cond_broadcast(&poller->done);
+    pthread_mutex_unlock(&poller->lock);
+}
+
+int ssp_poller_send(SSP_POLLER* poller, SSP_COMMAND* sspC)
+{
+    return _run_job(poller, _send_job, sspC, NULL);
+}
+
+int ssp_poller_negotiate(
+        SSP_POLLER* poller,
+        SSP_COMMAND* sspC,
+        SSP_FULL_KEY* hostKey)
+{
+    return _run_job(poller, _negotiate_job, sspC, hostKey);
+}
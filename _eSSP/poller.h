@@ -0,0 +1,60 @@
+#ifndef ESSP_POLLER_H
+#define ESSP_POLLER_H
+
+#include "ssp_helpers.h"
+
+// Number of polls the ring holds, a power of two
+#define SSP_POLLER_RING_SIZE 256
+// A poll sent later than this after its due time counts as late
+#define SSP_POLLER_LATE_NS 5000000ULL
+
+typedef struct
+{
+    unsigned long long sequence;      // number of the poll, from 0
+    unsigned long long timestamp_ns;  // CLOCK_MONOTONIC, when it was sent
+    unsigned char response;           // SSP_RESPONSE_ENUM of the poll
+    SSP_POLL_DATA6 poll;              // its events if response is OK
+} SSP_POLL_RECORD;
+
+typedef struct
+{
+    unsigned long long polls;
+    unsigned long long late_polls;
+    unsigned long long max_late_ns;
+    unsigned long long dropped;       // polls lost because the ring was full
+    unsigned long long commands;      // commands run for other threads
+} SSP_POLLER_STATS;
+
+typedef struct SSP_POLLER SSP_POLLER;
+
+// Start a thread polling the device of sspC every interval_us microseconds.
+// Until ssp_poller_stop, every command sent with sspC (from any thread) is
+// run by that thread between two polls, so the polls never wait for the
+// caller. The polls are decoded into a ring read with ssp_poller_read.
+SSP_POLLER* ssp_poller_start(SSP_COMMAND* sspC, unsigned long interval_us);
+// Stop and free the poller, sspC sends its commands itself again
+void ssp_poller_stop(SSP_POLLER* poller);
+void ssp_poller_set_interval(SSP_POLLER* poller, unsigned long interval_us);
+// Copy up to max polls out of the ring, oldest first, return their number
+int ssp_poller_read(SSP_POLLER* poller, SSP_POLL_RECORD* records, int max);
+// Wait up to timeout_ms for a poll in the ring or ssp_poller_wake, return
+// the number of polls in the ring
+int ssp_poller_wait(SSP_POLLER* poller, unsigned long timeout_ms);
+void ssp_poller_wake(SSP_POLLER* poller);
+void ssp_poller_stats(SSP_POLLER* poller, SSP_POLLER_STATS* stats);
+
+// The poller of sspC, NULL if none, kept until ssp_poller_release even if
+// ssp_poller_stop is called meanwhile
+SSP_POLLER* ssp_poller_acquire(SSP_COMMAND* sspC);
+void ssp_poller_release(SSP_POLLER* poller);
+
+// Used by send_ssp_command and negotiate_ssp_encryption, with the poller
+// acquired: run the command of sspC on the poller thread, or directly if
+// called from it. Return 0 without running it if the poller stopped.
+int ssp_poller_send(SSP_POLLER* poller, SSP_COMMAND* sspC);
+int ssp_poller_negotiate(
+        SSP_POLLER* poller,
+        SSP_COMMAND* sspC,
+        SSP_FULL_KEY* hostKey);
+
+#endif
@@ -14,13 +14,25 @@
 void changemode(int dir);
 int kbhit(void);
 
-int open_ssp_port(const char* port);
-void close_ssp_port();
+// The port is kept in sspC->Port, so every SSP_COMMAND drives its own
+// device and several devices can be used from different threads.
+int open_ssp_port(SSP_COMMAND* sspC, const char* port);
+void close_ssp_port(SSP_COMMAND* sspC);
+// set_ssp_write_pacing sets a pause (in microseconds) after every frame sent
+// to the port of sspC, for devices that cannot keep up with back to back
+// frames.
+int set_ssp_write_pacing(SSP_COMMAND* sspC, unsigned long pacing);
+// ssp_get_stats copies the link statistics of the device of sspC (round
+// trips by command code, retries, timeouts, bad frames, bytes), 0 if none.
+int ssp_get_stats(SSP_COMMAND* sspC, SSP_STATS* stats);
+// ssp_capture_start writes the frames of every port to a capture file until
+// ssp_capture_stop, see StartSSPCapture.
+int ssp_capture_start(const char* path, unsigned int flags);
+void ssp_capture_stop(void);
+// set_ssp_port_baud switches the port of sspC to <baud> at once, 0 if the
+// rate is not supported. ssp6_set_baud_rate waits for the device first.
+int set_ssp_port_baud(SSP_COMMAND* sspC, unsigned long baud);
 int send_ssp_command(SSP_COMMAND* sspC);
 int negotiate_ssp_encryption(SSP_COMMAND* sspC, SSP_FULL_KEY* hostKey);
 
-// get_open_port returns the static variable open_port to be used by
-// the download process.
-int get_open_port();
-
 #endif
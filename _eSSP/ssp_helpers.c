@@ -4,6 +4,7 @@
 #include "port_win32.h"
 #include "port_win32_ssp.h"
 #else
+#include <unistd.h>
 #include "inc/SSPComs.h"
 #endif
 
@@ -69,6 +70,55 @@ SSP_RESPONSE_ENUM ssp6_get_note_amount(
     return resp;
 }
 
+// Send an SSP get all levels command (0x22): the number of notes or coins
+// stored of every denomination
+SSP_RESPONSE_ENUM ssp6_get_all_levels(
+        SSP_COMMAND* sspC,
+        SSP6_ALL_LEVELS* all_levels)
+{
+    SSP_RESPONSE_ENUM resp;
+    unsigned int i, count;
+    int offset;
+
+    sspC->CommandDataLength = 1;
+    sspC->CommandData[0] = SSP_CMD_GET_ALL_LEVELS;
+    resp = _ssp_return_values(sspC);
+
+    all_levels->NumberOfLevels = 0;
+    if (resp != SSP_RESPONSE_OK || sspC->ResponseDataLength < 2)
+        return resp;
+
+    // 9 bytes per denomination: level (2), value (4), country code (3)
+    count = sspC->ResponseData[1];
+    if (count > 20)
+        count = 20;
+    if (count > (unsigned int)(sspC->ResponseDataLength - 2) / 9)
+        count = (sspC->ResponseDataLength - 2) / 9;
+
+    offset = 2;
+    for (i = 0; i < count; i++)
+    {
+        int j;
+        SSP6_LEVEL* level = &all_levels->Levels[i];
+
+        level->level = sspC->ResponseData[offset]
+                | sspC->ResponseData[offset + 1] << 8;
+        offset += 2;
+
+        level->value = 0;
+        for (j = 0; j < 4; j++)
+            level->value |=
+                    (unsigned int)sspC->ResponseData[offset++] << (j * 8);
+
+        for (j = 0; j < 3; j++)
+            level->cc[j] = sspC->ResponseData[offset++];
+        level->cc[j] = '\0'; // NULL TERMINATOR
+    }
+    all_levels->NumberOfLevels = count;
+
+    return resp;
+}
+
 SSP_RESPONSE_ENUM ssp6_set_route(
         SSP_COMMAND* sspC,
         const int value,
@@ -283,6 +333,63 @@ SSP_RESPONSE_ENUM ssp6_reject(SSP_COMMAND* sspC)
     resp = _ssp_return_values(sspC);
     return resp;
 }
+// Syncs sent at the new rate before going back to 9600 baud
+#define SSP_BAUD_SYNC_TRIES 2
+// The device changes its rate after its reply to the set baud rate command
+#define SSP_BAUD_SWITCH_US 20000
+
+// Send an SSP set baud rate (0x4D) for 9600, 38400 or 115200 baud, switch
+// the port to the same rate and check the link with a sync. If the device
+// is not heard at the new rate the port goes back to 9600 baud and
+// SSP_RESPONSE_TIMEOUT is returned. With <persist> the device keeps the
+// rate after a reset. Not while a poller owns the port.
+SSP_RESPONSE_ENUM ssp6_set_baud_rate(
+        SSP_COMMAND* sspC,
+        const unsigned long baud,
+        const unsigned char persist)
+{
+    SSP_RESPONSE_ENUM resp;
+    unsigned char code;
+    int i;
+
+    switch (baud)
+    {
+    case 9600:
+        code = 0;
+        break;
+    case 38400:
+        code = 1;
+        break;
+    case 115200:
+        code = 2;
+        break;
+    default:
+        return SSP_RESPONSE_INCORRECT_PARAMETERS;
+    }
+    if (__atomic_load_n(&sspC->Poller, __ATOMIC_ACQUIRE) != NULL)
+        return SSP_RESPONSE_COMMAND_NOT_PROCESSED;
+
+    sspC->CommandDataLength = 3;
+    sspC->CommandData[0] = SSP_CMD_SET_BAUD_RATE;
+    sspC->CommandData[1] = code;
+    sspC->CommandData[2] = persist ? 1 : 0;
+    resp = _ssp_return_values(sspC);
+    if (resp != SSP_RESPONSE_OK)
+        return resp;
+
+    usleep(SSP_BAUD_SWITCH_US);
+    if (set_ssp_port_baud(sspC, baud))
+    {
+        for (i = 0; i < SSP_BAUD_SYNC_TRIES; i++)
+        {
+            if (ssp6_sync(sspC) == SSP_RESPONSE_OK)
+                return SSP_RESPONSE_OK;
+        }
+    }
+    set_ssp_port_baud(sspC, 9600);
+    return SSP_RESPONSE_TIMEOUT;
+}
+
 // send an enable payout command
 SSP_RESPONSE_ENUM ssp6_enable_payout(SSP_COMMAND* sspC, const char type)
 {
@@ -334,34 +441,66 @@ SSP_RESPONSE_ENUM ssp6_set_inhibits(
     return resp;
 }
 
+// poll the validator without decoding the answer, the events are left in
+// sspC->ResponseData
+SSP_RESPONSE_ENUM ssp6_poll_raw(SSP_COMMAND* sspC)
+{
+    sspC->CommandDataLength = 1;
+    sspC->CommandData[0] = SSP_CMD_POLL;
+    return _ssp_return_values(sspC);
+}
+
 // poll the validator, and extract the responses.
 SSP_RESPONSE_ENUM ssp6_poll(SSP_COMMAND* sspC, SSP_POLL_DATA6* poll_response)
 {
     SSP_RESPONSE_ENUM resp;
-    unsigned char i, j;
 
     // send the poll command
-    sspC->CommandDataLength = 1;
-    sspC->CommandData[0] = SSP_CMD_POLL;
-    resp = _ssp_return_values(sspC);
+    resp = ssp6_poll_raw(sspC);
 
     if (resp != SSP_RESPONSE_OK)
         return resp;
 
-    // if the poll was successful, iterate over all of the response
+    ssp6_decode_poll(sspC, poll_response);
+    return resp;
+}
+
+static unsigned long _read_le32(const unsigned char* data)
+{
+    return (unsigned long)data[0]
+            | (unsigned long)data[1] << 8
+            | (unsigned long)data[2] << 16
+            | (unsigned long)data[3] << 24;
+}
+
+// extract the events of a poll response (ResponseData[0] is the status).
+// Decoding stops at an event truncated by the end of the response, or when
+// the SSP_POLL_DATA6 is full.
+void ssp6_decode_poll(const SSP_COMMAND* sspC, SSP_POLL_DATA6* poll_response)
+{
+    const unsigned char* data = sspC->ResponseData;
+    const int length = sspC->ResponseDataLength;
+    const int max_events =
+            sizeof(poll_response->events) / sizeof(poll_response->events[0]);
+    int i = 1;
+
     poll_response->event_count = 0;
 
-    for (i = 1; i < sspC->ResponseDataLength; ++i)
+    while (i < length && poll_response->event_count < max_events)
     {
+        const unsigned char event = data[i++];
+        SSP_POLL_EVENT6* slot =
+                &poll_response->events[poll_response->event_count];
+        int size;
+
         // initialise the event structure
-        poll_response->events[poll_response->event_count].event =
-                sspC->ResponseData[i];
-        poll_response->events[poll_response->event_count].data1 = 0;
-        poll_response->events[poll_response->event_count].data2 = 0;
-        poll_response->events[poll_response->event_count].cc[0] = 0;
-        poll_response->events[poll_response->event_count].cc[3] = 0;
-
-        switch (sspC->ResponseData[i])
+        slot->event = event;
+        slot->data1 = 0;
+        slot->data2 = 0;
+        slot->cc[0] = '\0';
+        slot->cc[3] = '\0';
+
+        switch (event)
         {
         //all these commands have one data byte
         case SSP_POLL_CREDIT:
@@ -369,10 +508,11 @@ SSP_RESPONSE_ENUM ssp6_poll(SSP_COMMAND* sspC, SSP_POLL_DATA6* poll_response)
         case SSP_POLL_CLEARED_FROM_FRONT:
         case SSP_POLL_CLEARED_INTO_CASHBOX:
         case SSP_POLL_CALIBRATION_FAIL:
-            i++; //move onto the data
-            poll_response->events[poll_response->event_count].data1 =
-                    sspC->ResponseData[i];
-            break;
+            if (i >= length)
+                return;
+            slot->data1 = data[i++];
+            poll_response->event_count++;
+            continue;
 
         //all these commands have 7 data bytes per country;
         case SSP_POLL_DISPENSING:
@@ -387,99 +527,63 @@ SSP_RESPONSE_ENUM ssp6_poll(SSP_COMMAND* sspC, SSP_POLL_DATA6* poll_response)
         case SSP_POLL_SMART_EMPTYING:
         case SSP_POLL_SMART_EMPTIED:
         case SSP_POLL_FRAUD_ATTEMPT:
-        {
-            unsigned char event = sspC->ResponseData[i];
-            unsigned int countries;
-            i++; // move onto the country count;
-            countries = (unsigned int)sspC->ResponseData[i];
-
-            // for every country in the response, make a new event structure and store into it
-            for (j = 0; j < countries; ++j)
-            {
-                int k;
-                poll_response->events[poll_response->event_count].event = event;
-                poll_response->events[poll_response->event_count].data1 = 0;
-                poll_response->events[poll_response->event_count].data2 = 0;
-                poll_response->events[poll_response->event_count].cc[3] = '\0';
-
-                for (k = 0; k < 4; ++k)
-                {
-                    i++; //move through the 4 bytes of data
-                    poll_response->events[poll_response->event_count].data1 +=
-                            (((unsigned long)sspC->ResponseData[i]) << (8 * i));
-                }
-
-                for (k = 0; k < 4; ++k)
-                {
-                    i++; //move through the 3 bytes of country code
-                    poll_response->events[poll_response->event_count].cc[k] +=
-                            sspC->ResponseData[i];
-                }
-
-                if (j != countries - 1) // the last time through event_count will be updated elsewhere.
-                    poll_response->event_count++;
-            }
-
-        }
-        break;
+            size = 7;
+            break;
 
         //all these commands have 11 data bytes per country;
         case SSP_POLL_INCOMPLETE_PAYOUT:
         case SSP_POLL_INCOMPLETE_FLOAT:
+            size = 11;
+            break;
+
+        default: //every other command has no data bytes
+            poll_response->event_count++;
+            continue;
+        }
+
         {
-            unsigned int countries;
-            unsigned char event = sspC->ResponseData[i];
-            i++; // move onto the country count;
-            countries = (unsigned int)sspC->ResponseData[i];
+            int countries, j;
 
-            // for every country in the response, make a new event structure and store into it
-            for (j = 0; j < countries; ++j)
-            {
-                int k;
-                poll_response->events[poll_response->event_count].event = event;
-                poll_response->events[poll_response->event_count].data1 = 0;
-                poll_response->events[poll_response->event_count].data2 = 0;
-                poll_response->events[poll_response->event_count].cc[3] = '\0';
+            if (i >= length)
+                return;
+            countries = data[i++];
 
-                for (k = 0; k < 4; ++k)
-                {
-                    i++; //move through the 4 bytes of data
-                    poll_response->events[poll_response->event_count].data1 +=
-                            (((unsigned long)sspC->ResponseData[i]) << (8 * i));
-                }
+            // an event without any country is kept, without data
+            if (countries == 0)
+            {
+                poll_response->event_count++;
+                continue;
+            }
 
-                for (k = 0; k < 4; ++k)
+            // for every country in the response, make a new event structure
+            // and store into it
+            for (j = 0; j < countries; ++j)
+            {
+                if (i + size > length
+                        || poll_response->event_count >= max_events)
+                    return;
+
+                slot = &poll_response->events[poll_response->event_count];
+                slot->event = event;
+                slot->data1 = _read_le32(&data[i]);
+                i += 4;
+                slot->data2 = 0;
+                if (size == 11)
                 {
-                    i++; //move through the 4 bytes of data
-                    poll_response->events[poll_response->event_count].data2 +=
-                            (((unsigned long)sspC->ResponseData[i]) << (8 * i));
+                    slot->data2 = _read_le32(&data[i]);
+                    i += 4;
                 }
 
-                for (k = 0; k < 3; ++k)
-                {
-                    i++; //move through the 3 bytes of country code
-                    poll_response->events[poll_response->event_count].cc[k] +=
-                            sspC->ResponseData[i];
-                }
+                // 3 bytes of country code
+                slot->cc[0] = data[i++];
+                slot->cc[1] = data[i++];
+                slot->cc[2] = data[i++];
+                slot->cc[3] = '\0';
 
-                if (j != countries - 1) // the last time through event_count will be updated elsewhere.
-                    poll_response->event_count++;
+                poll_response->event_count++;
             }
-
-        }
-        break;
-
-        default: //every other command has no data bytes
-            poll_response->events[poll_response->event_count].data1 = 0;
-            poll_response->events[poll_response->event_count].data2 = 0;
-            poll_response->events[poll_response->event_count].cc[0] = '\0';
-            break;
         }
-
-        poll_response->event_count++;
     }
-
-    return resp;
 }
 
 // reset the validator
@@ -81,6 +81,19 @@ typedef struct
     unsigned char ProtocolVersion;
 } SSP6_SETUP_REQUEST_DATA;
 
+typedef struct
+{
+    unsigned short level;
+    unsigned int value;
+    char cc[4];
+} SSP6_LEVEL;
+
+typedef struct
+{
+    unsigned char NumberOfLevels;
+    SSP6_LEVEL Levels[20];
+} SSP6_ALL_LEVELS;
+
 enum calibration_failures
 {
     NO_FAILURE = 0x00,
@@ -126,6 +139,8 @@ SSP_RESPONSE_ENUM ssp6_set_inhibits(
         const unsigned char lowchannels,
         const unsigned char highchannels);
 SSP_RESPONSE_ENUM ssp6_poll(SSP_COMMAND* sspC, SSP_POLL_DATA6* poll_response);
+SSP_RESPONSE_ENUM ssp6_poll_raw(SSP_COMMAND* sspC);
+void ssp6_decode_poll(const SSP_COMMAND* sspC, SSP_POLL_DATA6* poll_response);
 SSP_RESPONSE_ENUM ssp6_reset(SSP_COMMAND* sspC);
 SSP_RESPONSE_ENUM ssp6_disable_payout(SSP_COMMAND* sspC);
 SSP_RESPONSE_ENUM ssp6_disable(SSP_COMMAND* sspC);
@@ -142,7 +157,14 @@ SSP_RESPONSE_ENUM ssp6_get_note_amount(
         SSP_COMMAND* sspC,
         const int value,
         const char* cc);
+SSP_RESPONSE_ENUM ssp6_get_all_levels(
+        SSP_COMMAND* sspC,
+        SSP6_ALL_LEVELS* all_levels);
 SSP_RESPONSE_ENUM ssp6_reject(SSP_COMMAND* sspC);
+SSP_RESPONSE_ENUM ssp6_set_baud_rate(
+        SSP_COMMAND* sspC,
+        const unsigned long baud,
+        const unsigned char persist);
 
 SSP_RESPONSE_ENUM _ssp_return_values(SSP_COMMAND *sspC);
 
@@ -1,7 +1,14 @@
 #include "update.h"
+#include <errno.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include <termios.h>
+#include <time.h>
 #include <unistd.h>
 #include <stdlib.h>
 #include "ssp_helpers.h"
@@ -18,8 +25,9 @@
 
 #define ACK 0x32
 #define HEADER_SIZE 128
-#define RAM_BLOCK_SIZE 128
 #define SECTIONS_SIZE 128
+// Time the device may take to sync again after the transfer
+#define RESTART_TIMEOUT_MS 120000
 
 #define SSP_CMD_PROGRAM_DEVICE 0x0B
 #define SSP_CMD_RAM_FILE 0x03
@@ -29,6 +37,88 @@
  * From page 123 to 131.
  */
 
+struct ESSP_UPDATE
+{
+    pthread_t thread;
+    int started;                // the thread was created
+    char* port;
+    char* address;
+    ESSP_UPDATE_PROGRESS progress;
+    void* user;
+
+    // The file, mapped read only
+    int fd;
+    const unsigned char* data;
+    unsigned long length;
+
+    unsigned long long start_us;
+    // Guards status
+    pthread_mutex_t lock;
+    pthread_cond_t finished;
+    ESSP_UPDATE_STATUS status;
+};
+
+// Loads that may alias the bytes of the file
+typedef uint64_t __attribute__((__may_alias__)) _word;
+
+static unsigned long long _now_us(void)
+{
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (unsigned long long)now.tv_sec * 1000000ULL + now.tv_nsec / 1000;
+}
+
+// XOR of the <length> bytes of <data>, a 64 bits word at a time once
+// <data> is aligned
+static unsigned char _xor_checksum(
+        const unsigned char* data,
+        unsigned long length)
+{
+    unsigned char checksum = 0;
+    uint64_t word = 0;
+    const _word* words;
+    unsigned long count;
+    unsigned long i;
+
+    while (length > 0 && ((uintptr_t)data & (sizeof(_word) - 1)) != 0)
+    {
+        checksum ^= *data++;
+        length--;
+    }
+    words = (const _word*)data;
+    count = length / sizeof(_word);
+    for (i = 0; i < count; i++)
+        word ^= words[i];
+    data += count * sizeof(_word);
+    length -= count * sizeof(_word);
+    while (length-- > 0)
+        checksum ^= *data++;
+
+    word ^= word >> 32;
+    word ^= word >> 16;
+    word ^= word >> 8;
+    return checksum ^ (unsigned char)word;
+}
+
+// Update the status, under the lock, and pass a copy to the callback
+static void _report(
+        ESSP_UPDATE* update,
+        const int stage,
+        const unsigned long long bytes_sent)
+{
+    ESSP_UPDATE_STATUS status;
+
+    pthread_mutex_lock(&update->lock);
+    update->status.stage = stage;
+    update->status.bytes_sent = bytes_sent;
+    update->status.elapsed_us = _now_us() - update->start_us;
+    status = update->status;
+    pthread_mutex_unlock(&update->lock);
+    if (update->progress != NULL)
+        update->progress(&status, update->user);
+}
+
 ESSP_UPDATE_DEVICE_RESPONSE _compare_byte_in_buffer(
         const unsigned char expected_byte,
         const SSP_PORT port,
@@ -38,14 +128,13 @@ ESSP_UPDATE_DEVICE_RESPONSE _compare_byte_in_buffer(
     unsigned char buffer_byte;
     clock_t start = GetClockMs();
 
-    while(!BytesInBuffer(port))
+    while (ReadData(port, &buffer_byte, 1) != 1)
     {
-        usleep(1000);
-        if (GetClockMs() - start > timeout)
+        long remaining = (long)timeout - (long)(GetClockMs() - start);
+        if (remaining <= 0 || WaitForData(port, remaining) < 0)
             return ESSP_UDR_TIMEOUT;
     }
 
-    ReadData(port, &buffer_byte, 1);
     *result = expected_byte == buffer_byte;
     return ESSP_UDR_OK;
 }
@@ -87,15 +176,28 @@ void _send_header_directly(
     WriteData(data, HEADER_SIZE, port);
 }
 
+ESSP_UPDATE_DEVICE_RESPONSE _send_block(
+        const unsigned char* const data,
+        const unsigned long length,
+        const SSP_PORT port)
+{
+    const unsigned char checksum = _xor_checksum(data, length);
+
+    // Straight from the mapped file, WriteData returns once it left
+    WriteData(data, length, port);
+    WriteData(&checksum, 1, port);
+    return _compare_checksum(checksum, port);
+}
+
 ESSP_UPDATE_DEVICE_RESPONSE _send_ram_file(
+        ESSP_UPDATE* const update,
         SSP_COMMAND* const sspC,
-        const unsigned char* const data,
-        const unsigned long data_length,
-        const SSP_PORT port,
         const unsigned long baud,
-        int* const ram_file_size,
+        unsigned long* const ram_file_size,
         unsigned short int* const block_size)
 {
+    const unsigned char* const data = update->data;
+    ESSP_UPDATE_DEVICE_RESPONSE response;
 
     sspC->CommandDataLength = 2;
     sspC->CommandData[0] = SSP_CMD_PROGRAM_DEVICE;
@@ -107,65 +209,53 @@ ESSP_UPDATE_DEVICE_RESPONSE _send_ram_file(
     *block_size =
         sspC->ResponseData[1]
         | (unsigned short int)sspC->ResponseData[2] << 8;
+    if (*block_size == 0)
+        return ESSP_UDR_SEND_PROGRAM_CMD_ERROR;
 
-    _send_header_via_command(sspC, data, port);
-    SetBaud(port, baud);
     *ram_file_size =
         data[10]
-        | (int)data[9] << 8
-        | (int)data[8] << 16
-        | (int)data[7] << 24;
-
-    const int blocks_to_send = *ram_file_size / RAM_BLOCK_SIZE;
-
-    unsigned char checksum = 0;
-    for (int i = 0; i < blocks_to_send; i++)
-    {
-        WriteData(
-            data + HEADER_SIZE + i * RAM_BLOCK_SIZE,
-            RAM_BLOCK_SIZE,
-            port);
-        for (int j = 0; j < RAM_BLOCK_SIZE; j++)
-            checksum ^= data[HEADER_SIZE + i * RAM_BLOCK_SIZE + j];
-    }
-
-    const int remaining_bytes = *ram_file_size % RAM_BLOCK_SIZE;
-    if (remaining_bytes > 0)
-    {
-        WriteData(
-            data + HEADER_SIZE + *ram_file_size - remaining_bytes,
-            remaining_bytes,
-            port);
-        for (int j = 0; j < remaining_bytes; j++)
-            checksum ^= data[HEADER_SIZE + *ram_file_size - remaining_bytes + j];
-    }
+        | (unsigned long)data[9] << 8
+        | (unsigned long)data[8] << 16
+        | (unsigned long)data[7] << 24;
+    if (*ram_file_size > update->length - HEADER_SIZE)
+        return ESSP_UDR_FILE_ERROR;
 
-    ESSP_UPDATE_DEVICE_RESPONSE response = _compare_checksum(checksum, port);
+    response = _send_header_via_command(sspC, data, sspC->Port);
     if (response != ESSP_UDR_OK)
         return response;
-
+    SetBaud(sspC->Port, baud);
+    _report(update, ESSP_UPDATE_RAM_FILE, HEADER_SIZE);
+
+    // The device answers the checksum of the RAM file without being sent it
+    WriteData(data + HEADER_SIZE, *ram_file_size, sspC->Port);
+    response = _compare_checksum(
+        _xor_checksum(data + HEADER_SIZE, *ram_file_size),
+        sspC->Port);
+    if (response != ESSP_UDR_OK)
+        return response;
+    _report(update, ESSP_UPDATE_RAM_FILE, HEADER_SIZE + *ram_file_size);
     return ESSP_UDR_OK;
 }
 
 ESSP_UPDATE_DEVICE_RESPONSE _send_main_file(
-        const unsigned char* const data,
-        const unsigned long data_length,
-        const char* const port_c,
-        SSP_PORT port,
+        ESSP_UPDATE* const update,
+        SSP_COMMAND* const sspC,
         const unsigned long baud,
-        const int ram_file_size,
+        const unsigned long ram_file_size,
         const unsigned short int block_size)
 {
+    const unsigned char* const data = update->data;
     ESSP_UPDATE_DEVICE_RESPONSE response;
-    unsigned char checksum;
     int ok;
 
-    close_ssp_port();
+    const unsigned long pacing = GetWritePacing(sspC->Port);
+    close_ssp_port(sspC);
     sleep(3);
-    if (!open_ssp_port(port_c))
+    if (!open_ssp_port(sspC, update->port))
         return ESSP_UDR_PORT_ERROR;
-    port = get_open_port();
+    const SSP_PORT port = sspC->Port;
     SetBaud(port, baud);
+    SetWritePacing(port, pacing);
 
     WriteData(data + 6, 1, port);
     response = _compare_byte_in_buffer(ACK, port, 1000, &ok);
@@ -181,70 +271,48 @@ ESSP_UPDATE_DEVICE_RESPONSE _send_main_file(
     if (!ok)
         return ESSP_UDR_DEVICE_DID_NOT_ACK;
 
-    const int start_position = HEADER_SIZE + ram_file_size;
-    const int main_file_size = data_length - start_position;
-    const int blocks_to_send = main_file_size / block_size;
-    const int sections_to_send = block_size / SECTIONS_SIZE;
+    unsigned long position = HEADER_SIZE + ram_file_size;
+    const unsigned long main_file_size = update->length - position;
 
-    for (int b = 0; b < blocks_to_send; b++)
-    {
-        checksum = 0;
-        int position = start_position + block_size * b;
-        WriteData(
-            data + position,
-            block_size,
-            port);
-        for (int i = 0; i < block_size; i++)
-            checksum ^= data[position + i];
-
-        WriteData(&checksum, 1, port);
-        response = _compare_checksum(checksum, port);
-        if (response != ESSP_UDR_OK)
-            return response;
-    }
+    pthread_mutex_lock(&update->lock);
+    update->status.blocks_total =
+        (main_file_size + block_size - 1) / block_size;
+    pthread_mutex_unlock(&update->lock);
+    _report(update, ESSP_UPDATE_MAIN_FILE, position);
 
-    const int remaining_bytes = main_file_size % block_size;
-    if (remaining_bytes > 0)
+    // The last block is shorter, the remaining bytes of the file
+    while (position < update->length)
     {
-        checksum = 0;
-        for (int s = 0; s < sections_to_send; s++)
-        {
-            int position = start_position + block_size * blocks_to_send + SECTIONS_SIZE * s;
-            WriteData(
-                data + position,
-                SECTIONS_SIZE,
-                port);
-            for (int i = 0; i < SECTIONS_SIZE; i++)
-                checksum ^= data[position + i];
-        }
-        response = _compare_checksum(checksum, port);
+        unsigned long length = update->length - position;
+        if (length > block_size)
+            length = block_size;
+        response = _send_block(data + position, length, port);
         if (response != ESSP_UDR_OK)
             return response;
+        position += length;
+        pthread_mutex_lock(&update->lock);
+        update->status.blocks_sent++;
+        pthread_mutex_unlock(&update->lock);
+        _report(update, ESSP_UPDATE_MAIN_FILE, position);
     }
 
     return ESSP_UDR_OK;
 }
 
 ESSP_UPDATE_DEVICE_RESPONSE _update_device(
-        const unsigned char* const data,
-        const unsigned long data_length,
-        const char* const port_c,
-        const char* const addr_c)
+        ESSP_UPDATE* const update,
+        SSP_COMMAND* const sspC)
 {
-    if (data[0] != 'I' && data[1] != 'T' && data[2] != 'L')
+    const unsigned char* const data = update->data;
+
+    if (update->length <= HEADER_SIZE
+            || data[0] != 'I' || data[1] != 'T' || data[2] != 'L')
         return ESSP_UDR_INVALID_FILE_TYPE;
 
-    SSP_COMMAND sspC;
-    sspC.Timeout = 1000;
-    sspC.BaudRate = 9600;
-    sspC.RetryLevel = 3;
-    sspC.SSPAddress = (int)(strtod(addr_c, NULL));
-    sspC.EncryptionStatus = NO_ENCRYPTION;
-    if (!open_ssp_port(port_c))
+    if (!open_ssp_port(sspC, update->port))
         return ESSP_UDR_PORT_ERROR;
-    SSP_PORT port = get_open_port();
 
-    if (ssp6_sync(&sspC) != SSP_RESPONSE_OK)
+    if (ssp6_sync(sspC) != SSP_RESPONSE_OK)
         return ESSP_UDR_NO_VALIDATOR;
 
     unsigned long baud = 38400;
@@ -260,65 +328,228 @@ ESSP_UPDATE_DEVICE_RESPONSE _update_device(
             baud = 38400;
     }
 
-    int ram_file_size;
+    unsigned long ram_file_size;
     unsigned short int block_size;
     ESSP_UPDATE_DEVICE_RESPONSE response = _send_ram_file(
-        &sspC,
-        data,
-        data_length,
-        port,
+        update,
+        sspC,
         baud,
         &ram_file_size,
         &block_size);
     if (response != ESSP_UDR_OK)
         return response;
     response = _send_main_file(
-        data,
-        data_length,
-        port_c,
-        port,
+        update,
+        sspC,
         baud,
         ram_file_size,
         block_size);
     if (response != ESSP_UDR_OK)
         return response;
 
-    close_ssp_port(port);
-    SetBaud(port, 9600);
-    port = OpenSSPPort(port_c);
+    // back to 9600 baud, the speed the device restarts at
+    _report(update, ESSP_UPDATE_RESTARTING, update->length);
+    close_ssp_port(sspC);
+    if (!open_ssp_port(sspC, update->port))
+        return ESSP_UDR_PORT_ERROR;
+
+    const unsigned long long deadline =
+        _now_us() + RESTART_TIMEOUT_MS * 1000ULL;
+    while (ssp6_sync(sspC) != SSP_RESPONSE_OK)
+    {
+        if (_now_us() >= deadline)
+            return ESSP_UDR_TIMEOUT;
+    }
+    return ESSP_UDR_OK;
+}
+
+static void _finish(
+        ESSP_UPDATE* update,
+        const ESSP_UPDATE_DEVICE_RESPONSE response)
+{
+    ESSP_UPDATE_STATUS status;
+
+    pthread_mutex_lock(&update->lock);
+    update->status.stage = ESSP_UPDATE_DONE;
+    update->status.response = response;
+    update->status.elapsed_us = _now_us() - update->start_us;
+    status = update->status;
+    pthread_cond_broadcast(&update->finished);
+    pthread_mutex_unlock(&update->lock);
+    if (update->progress != NULL)
+        update->progress(&status, update->user);
+}
 
-    int ok = 0;
-    do {
-        if (ssp6_sync(&sspC) == SSP_RESPONSE_OK)
-            ok = 1;
-    } while (!ok);
+static void* _run(void* argument)
+{
+    ESSP_UPDATE* update = argument;
+    SSP_COMMAND sspC;
 
+    memset(&sspC, 0, sizeof(sspC));
+    sspC.Timeout = 1000;
+    sspC.BaudRate = 9600;
+    sspC.RetryLevel = 3;
+    sspC.SSPAddress = (int)(strtod(update->address, NULL));
+    sspC.EncryptionStatus = NO_ENCRYPTION;
+    sspC.Poller = NULL;
+    sspC.Port = -1;
+
+    ESSP_UPDATE_DEVICE_RESPONSE response = _update_device(update, &sspC);
+    if (sspC.Port != -1)
+        close_ssp_port(&sspC);
+
+    munmap((void*)update->data, update->length);
+    update->data = NULL;
+    _finish(update, response);
+    return NULL;
+}
+
+// Map the file, return ESSP_UDR_OK or the error of the file
+static ESSP_UPDATE_DEVICE_RESPONSE _map_file(
+        ESSP_UPDATE* update,
+        const char* const file_name)
+{
+    struct stat file_stat;
+    void* data;
+
+    update->fd = open(file_name, O_RDONLY);
+    if (update->fd == -1)
+        return errno == ENOENT
+            ? ESSP_UDR_FILE_NOT_FOUND
+            : ESSP_UDR_FILE_ERROR;
+    if (fstat(update->fd, &file_stat) != 0 || file_stat.st_size <= 0)
+        return ESSP_UDR_FILE_ERROR;
+    data = mmap(NULL, file_stat.st_size, PROT_READ, MAP_PRIVATE, update->fd, 0);
+    if (data == MAP_FAILED)
+        return ESSP_UDR_FILE_ERROR;
+    // Read once, front to back
+    madvise(data, file_stat.st_size, MADV_SEQUENTIAL);
+    update->data = data;
+    update->length = file_stat.st_size;
     return ESSP_UDR_OK;
 }
 
-ESSP_UPDATE_DEVICE_RESPONSE update_device(
+ESSP_UPDATE* update_device_start(
         const char* const file_name,
         const char* const port_c,
-        const char* const addr_c)
+        const char* const addr_c,
+        ESSP_UPDATE_PROGRESS progress,
+        void* user)
 {
-    FILE* file = fopen(file_name,"r");
-    if (file == NULL)
-        return ESSP_UDR_FILE_NOT_FOUND;
+    ESSP_UPDATE* update = calloc(1, sizeof(ESSP_UPDATE));
+    pthread_condattr_t attr;
+
+    if (update == NULL)
+        return NULL;
+    update->port = strdup(port_c);
+    update->address = strdup(addr_c);
+    if (update->port == NULL || update->address == NULL)
+    {
+        free(update->port);
+        free(update->address);
+        free(update);
+        return NULL;
+    }
+    update->progress = progress;
+    update->user = user;
+    update->start_us = _now_us();
+    update->status.stage = ESSP_UPDATE_STARTING;
+    update->status.response = ESSP_UDR_IN_PROGRESS;
+    pthread_mutex_init(&update->lock, NULL);
+    pthread_condattr_init(&attr);
+    pthread_condattr_setclock(&attr, CLOCK_MONOTONIC);
+    pthread_cond_init(&update->finished, &attr);
+    pthread_condattr_destroy(&attr);
+
+    ESSP_UPDATE_DEVICE_RESPONSE response = _map_file(update, file_name);
+    if (update->fd != -1)
+    {
+        // The mapping stays valid once the file is closed
+        close(update->fd);
+        update->fd = -1;
+    }
+    if (response != ESSP_UDR_OK)
+    {
+        _finish(update, response);
+        return update;
+    }
+    update->status.bytes_total = update->length;
 
-    fseek(file, 0 , SEEK_END);
-    unsigned long data_length = ftell(file);
-    rewind(file);
+    if (pthread_create(&update->thread, NULL, _run, update) != 0)
+    {
+        munmap((void*)update->data, update->length);
+        update->data = NULL;
+        update_device_free(update);
+        return NULL;
+    }
+    update->started = 1;
+    return update;
+}
 
-    unsigned char *data;
-    data = malloc(data_length);
-    if (fread(data, 1, data_length, file) != data_length)
-        return ESSP_UDR_FILE_ERROR;
+void update_device_status(ESSP_UPDATE* update, ESSP_UPDATE_STATUS* status)
+{
+    pthread_mutex_lock(&update->lock);
+    *status = update->status;
+    if (status->stage != ESSP_UPDATE_DONE)
+        status->elapsed_us = _now_us() - update->start_us;
+    pthread_mutex_unlock(&update->lock);
+}
 
-    fclose(file);
+int update_device_wait(ESSP_UPDATE* update, long timeout_ms)
+{
+    struct timespec deadline;
+    unsigned long long ns;
+    int done;
+
+    clock_gettime(CLOCK_MONOTONIC, &deadline);
+    ns = (unsigned long long)deadline.tv_sec * 1000000000ULL
+        + deadline.tv_nsec
+        + (timeout_ms > 0 ? (unsigned long long)timeout_ms * 1000000ULL : 0);
+    deadline.tv_sec = ns / 1000000000ULL;
+    deadline.tv_nsec = ns % 1000000000ULL;
+
+    pthread_mutex_lock(&update->lock);
+    while (update->status.stage != ESSP_UPDATE_DONE)
+    {
+        if (timeout_ms < 0)
+            pthread_cond_wait(&update->finished, &update->lock);
+        else if (pthread_cond_timedwait(
+                    &update->finished,
+                    &update->lock,
+                    &deadline) == ETIMEDOUT)
+            break;
+    }
+    done = update->status.stage == ESSP_UPDATE_DONE;
+    pthread_mutex_unlock(&update->lock);
+    return done;
+}
 
-    ESSP_UPDATE_DEVICE_RESPONSE response =
-        _update_device(data, data_length, port_c, addr_c);
+void update_device_free(ESSP_UPDATE* update)
+{
+    if (update == NULL)
+        return;
+    if (update->started)
+        pthread_join(update->thread, NULL);
+    pthread_cond_destroy(&update->finished);
+    pthread_mutex_destroy(&update->lock);
+    free(update->port);
+    free(update->address);
+    free(update);
+}
 
-    free(data);
-    return response;
+ESSP_UPDATE_DEVICE_RESPONSE update_device(
+        const char* const file_name,
+        const char* const port_c,
+        const char* const addr_c)
+{
+    ESSP_UPDATE_STATUS status;
+    ESSP_UPDATE* update =
+        update_device_start(file_name, port_c, addr_c, NULL, NULL);
+
+    if (update == NULL)
+        return ESSP_UDR_FILE_ERROR;
+    update_device_wait(update, -1);
+    update_device_status(update, &status);
+    update_device_free(update);
+    return status.response;
 }
@@ -14,9 +14,56 @@ typedef enum
     ESSP_UDR_SEND_PROGRAM_CMD_ERROR = 0x06,
     ESSP_UDR_TIMEOUT = 0x07,
     ESSP_UDR_BAD_CHECKSUM = 0x08,
-    ESSP_UDR_DEVICE_DID_NOT_ACK = 0x09
+    ESSP_UDR_DEVICE_DID_NOT_ACK = 0x09,
+    ESSP_UDR_IN_PROGRESS = 0x0A
 } ESSP_UPDATE_DEVICE_RESPONSE;
 
+typedef enum
+{
+    ESSP_UPDATE_STARTING = 0x00,
+    ESSP_UPDATE_RAM_FILE = 0x01,    // the loader, sent in one go
+    ESSP_UPDATE_MAIN_FILE = 0x02,   // the firmware, block by block
+    ESSP_UPDATE_RESTARTING = 0x03,  // waiting for the device to sync again
+    ESSP_UPDATE_DONE = 0x04
+} ESSP_UPDATE_STAGE;
+
+typedef struct
+{
+    unsigned char stage;              // ESSP_UPDATE_STAGE
+    unsigned char response;           // ESSP_UDR_IN_PROGRESS until done
+    unsigned int blocks_sent;         // blocks of the main file checked
+    unsigned int blocks_total;
+    unsigned long long bytes_sent;    // of the file, header included
+    unsigned long long bytes_total;
+    unsigned long long elapsed_us;    // since update_device_start
+} ESSP_UPDATE_STATUS;
+
+// Called by the update thread after each block checked by the device and
+// once done, it must not block
+typedef void (*ESSP_UPDATE_PROGRESS)(
+        const ESSP_UPDATE_STATUS* status,
+        void* user);
+
+typedef struct ESSP_UPDATE ESSP_UPDATE;
+
+// Start sending the firmware file to the device at addr_c on port_c from
+// a thread. The file is mapped in memory and streamed from there. Return
+// NULL if the update cannot be started, an error of the file is reported
+// in its status.
+ESSP_UPDATE* update_device_start(
+        const char* const file_name,
+        const char* const port_c,
+        const char* const addr_c,
+        ESSP_UPDATE_PROGRESS progress,
+        void* user);
+void update_device_status(ESSP_UPDATE* update, ESSP_UPDATE_STATUS* status);
+// Wait up to timeout_ms (forever if negative) for the end of the update,
+// return 1 once it is done
+int update_device_wait(ESSP_UPDATE* update, long timeout_ms);
+// Wait for the end of the update and free it
+void update_device_free(ESSP_UPDATE* update);
+
+// Blocking update, update_device_start then wait
 ESSP_UPDATE_DEVICE_RESPONSE update_device(
         const char* const file_name,
         const char* const port_c,
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''Inventory of a simulated payout kept by the asyncio client.
+
+The simulator reports a reset on the first poll, after which the poll task
+of AsyncESSP must read the levels again (a queued get all levels), answer
+get_all_levels and then follow a note stored in the payout.
+
+    python3 benchmarks/aio_inventory.py
+'''
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from eSSP.aio import AsyncESSP  # noqa: E402
+from eSSP.scheduler import PollScheduler  # noqa: E402
+from eSSP.simulator import SimulatedDevice, Simulator  # noqa: E402
+
+LEVELS = {(1000, 'CHF'): 3, (2000, 'CHF'): 1}
+
+
+async def until(condition, timeout=5):
+    '''Seconds until condition() is true, raise TimeoutError after
+    <timeout>
+    '''
+    start = time.monotonic()
+    while not condition():
+        if time.monotonic() - start > timeout:
+            raise TimeoutError
+        await asyncio.sleep(0.01)
+    return time.monotonic() - start
+
+
+async def check(simulator):
+    validator = await AsyncESSP.open(
+        simulator.port,
+        scheduler=PollScheduler(fast_interval=0.05, idle_interval=0.2),
+    )
+    essp = validator.essp
+    try:
+        # Read once by the start, then again after the reset
+        seconds = await until(
+            lambda: essp.inventory.loads == 2 and essp.inventory.synced,
+        )
+        print(f'inventory synced after the reset in {seconds * 1e3:.0f} ms')
+        response, levels = await asyncio.wait_for(
+            asyncio.wrap_future(essp.get_all_levels()),
+            5,
+        )
+        print(f'get_all_levels: {response.name} {levels}')
+        if levels != LEVELS:
+            sys.exit(f'wrong levels {levels}')
+
+        await validator.set_route_storage(10)
+        simulator.insert_note(1)
+        seconds = await until(lambda: essp.inventory.count(1000, 'CHF') == 4)
+        print(
+            f'note stored, seen after {seconds * 1e3:.0f} ms: '
+            f'{essp.inventory.levels()}',
+        )
+        if essp.actions.stats()['depth']:
+            sys.exit('actions left in the queue')
+    finally:
+        await validator.close()
+
+
+def main():
+    simulator = Simulator([SimulatedDevice(levels=LEVELS)]).start()
+    try:
+        asyncio.run(check(simulator))
+    finally:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''Round trip of the polls and setup requests at each baud rate.
+
+The simulator takes the time the frames would take on a serial line at the
+rate it is set to (line_time), the validator is switched to each rate with
+the set baud rate command.
+
+    python3 benchmarks/baud_rate.py --rounds 50
+'''
+import argparse
+import os
+import sys
+import time
+from ctypes import byref
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from eSSP import C_LIBRARY, eSSP  # noqa: E402
+from eSSP.clib import Ssp6SetupRequestData, SspResponseEnum  # noqa: E402
+from eSSP.simulator import BAUD_RATES, Simulator  # noqa: E402
+
+
+def round_trip(function, rounds):
+    '''Mean seconds of <function>(), which must answer OK'''
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if function() != SspResponseEnum.SSP_RESPONSE_OK:
+            raise Exception('Command failed')
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    simulator = Simulator(line_time=True).start()
+    validator = eSSP(simulator.port, start=False)
+    setup_req = Ssp6SetupRequestData()
+    try:
+        for rate in BAUD_RATES:
+            response = validator.set_baud_rate(rate)
+            if response != SspResponseEnum.SSP_RESPONSE_OK:
+                sys.exit(f'Cannot switch to {rate} baud')
+            poll = round_trip(
+                lambda: C_LIBRARY.ssp6_poll_raw(validator.sspC),
+                args.rounds,
+            )
+            setup = round_trip(
+                lambda: C_LIBRARY.ssp6_setup_request(
+                    validator.sspC,
+                    byref(setup_req),
+                ),
+                args.rounds,
+            )
+            print(
+                f'{rate:6} baud: poll {poll * 1e3:.2f} ms, '
+                f'setup request {setup * 1e3:.2f} ms',
+            )
+    finally:
+        validator.close()
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
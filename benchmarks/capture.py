@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+'''Capture of the traffic with a simulated validator, replayed offline.
+
+A get all levels whose reply is stuffed to more than 255 bytes is sent
+first, then the validator is started, a note is credited and the capture stopped. The replay must
+frame every reply, decode the polls and the credit as they were seen live,
+without handler errors.
+
+    python3 benchmarks/capture.py
+'''
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from ctypes import c_int
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from eSSP import C_LIBRARY, eSSP  # noqa: E402
+from eSSP.capture import (  # noqa: E402
+    PLAIN,
+    RX,
+    SSP_CMD_POLL,
+    TX,
+    read_capture,
+    replay,
+    start_capture,
+    stop_capture,
+)
+from eSSP.clib import CommandPointer, define_function  # noqa: E402
+from eSSP.constants import Status  # noqa: E402
+from eSSP.scheduler import PollScheduler  # noqa: E402
+from eSSP.simulator import SimulatedDevice, Simulator  # noqa: E402
+
+define_function('send_ssp_command', c_int, CommandPointer)
+
+SSP_CMD_GET_ALL_LEVELS = 0x22
+# Levels whose value and count are mostly 0x7F bytes, stuffed to 0x7F 0x7F:
+# the reply of a get all levels takes more than 255 bytes on the line
+STUFFED_LEVELS = {
+    (0x7F7F7F00 + channel, 'CHF'): 0x7F7F for channel in range(20)
+}
+
+
+def get_all_levels_plain(port):
+    '''Send a get all levels unencrypted on <port>, return the length of
+    its reply data, 0 if it was not answered
+    '''
+    ssp_c = C_LIBRARY.ssp_init(port.encode(), b'0', False)
+    try:
+        command = ssp_c.contents
+        command.CommandDataLength = 1
+        command.CommandData[0] = SSP_CMD_GET_ALL_LEVELS
+        if not C_LIBRARY.send_ssp_command(ssp_c):
+            return 0
+        return command.ResponseDataLength
+    finally:
+        C_LIBRARY.close_ssp_port(ssp_c)
+
+
+def capture(path, plain):
+    '''Capture a session with the simulator to <path>, return the counts
+    seen live: (polls, events)
+    '''
+    simulator = Simulator([SimulatedDevice(levels=STUFFED_LEVELS)]).start()
+    start_capture(path, plain=plain)
+    try:
+        if not get_all_levels_plain(simulator.port):
+            sys.exit('get all levels not answered')
+        validator = eSSP(
+            simulator.port,
+            scheduler=PollScheduler(fast_interval=0.05, idle_interval=0.05),
+        )
+        simulator.insert_note(1)
+        time.sleep(1)
+        validator.close()
+    finally:
+        stop_capture()
+        simulator.stop()
+    events = validator.drain_events()
+    if not any(event[2] == Status.SSP_POLL_CREDIT for event in events):
+        sys.exit('the note was not credited')
+    return simulator.device.commands.count(SSP_CMD_POLL), len(events)
+
+
+def main():
+    failed = []
+    with tempfile.TemporaryDirectory() as directory:
+        for plain in (False, True):
+            path = os.path.join(directory, 'session.essp')
+            polls, events = capture(path, plain)
+            flags, records = read_capture(path)
+            stats = replay(records, flags)
+            kinds = Counter(record.kind for record in records)
+            longest = max(len(record.data) for record in records)
+            name = 'plain' if plain else 'encrypted'
+            print(
+                f'{name}: {len(records)} records ({kinds[TX]} sent, '
+                f'{kinds[RX]} read, longest {longest} bytes), '
+                f'{polls} polls and {events} events live',
+            )
+            print(
+                '  replay: '
+                + ' '.join(f'{key} {value}' for key, value in stats.items()
+                           if key != 'seconds'),
+            )
+            # Every frame sent is answered, unless sent again
+            if stats['frames'] != kinds[TX]:
+                failed.append(f'{name}: {stats["frames"]} frames replayed')
+            if stats['crc_errors'] or stats['handler_errors']:
+                failed.append(f'{name}: replay errors')
+            if longest <= 0xFF:
+                failed.append(f'{name}: no record over 255 bytes')
+            if bool(flags & PLAIN) != plain:
+                failed.append(f'{name}: flags {flags}')
+            # The polls are decoded from the plain replies only
+            if plain and (stats['polls'], stats['events']) != (polls, events):
+                failed.append(
+                    f'{name}: {stats["polls"]} polls and {stats["events"]} '
+                    'events replayed',
+                )
+    if failed:
+        sys.exit('\n'.join(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+/*
+ * Micro benchmarks of the per command CPU cost of libessp: framing and
+ * stuffing, receiving (unstuffing and CRC check), CRC, packet encryption
+ * and poll decoding. No serial port is opened. Results are printed as a
+ * JSON object on stdout, see run.py.
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "inc/SSPComs.h"
+#include "ssp_helpers.h"
+#include "lib/Encryption.h"
+#include "lib/ITLSSPProc.h"
+
+#define MIN_BENCH_NS 200000000LL
+#define REPEATS 5
+
+int CompileSSPCommand(SSP_LINK* link, SSP_COMMAND* cmd, SSP_TX_RX_PACKET* ss);
+
+static volatile unsigned long sink;
+static int first_result = 1;
+
+static long long now_ns(void)
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+typedef void (*bench_fn)(void* arg);
+
+// Run fn until MIN_BENCH_NS elapsed, keep the best of REPEATS runs
+static void bench(const char* name, const int size, bench_fn fn, void* arg)
+{
+    long long iterations = 1;
+    long long start, elapsed;
+    double best = -1;
+    int r;
+    long long i;
+
+    // find an iteration count that runs for long enough
+    for (;;)
+    {
+        start = now_ns();
+        for (i = 0; i < iterations; i++)
+            fn(arg);
+        elapsed = now_ns() - start;
+        if (elapsed >= MIN_BENCH_NS / 10)
+            break;
+        iterations *= 10;
+    }
+    iterations = iterations * (MIN_BENCH_NS / REPEATS) / (elapsed + 1) + 1;
+
+    for (r = 0; r < REPEATS; r++)
+    {
+        double ns;
+        start = now_ns();
+        for (i = 0; i < iterations; i++)
+            fn(arg);
+        ns = (double)(now_ns() - start) / iterations;
+        if (best < 0 || ns < best)
+            best = ns;
+    }
+
+    printf("%s\n    \"%s[%d]\": {\"ns_per_op\": %.2f, \"size\": %d, "
+           "\"mb_per_s\": %.2f, \"iterations\": %lld}",
+           first_result ? "" : ",", name, size, best, size,
+           size / best * 1e3, iterations);
+    first_result = 0;
+}
+
+static void fill(unsigned char* data, const int length, unsigned int seed)
+{
+    int i;
+    srand(seed);
+    for (i = 0; i < length; i++)
+        data[i] = rand() & 0xFF;
+}
+
+typedef struct
+{
+    unsigned char data[255];
+    short length;
+} CRC_ARG;
+
+static void crc_fn(void* arg)
+{
+    CRC_ARG* a = arg;
+    sink += cal_crc_loop_CCITT_A(a->length, a->data, CRC_SSP_SEED, CRC_SSP_POLY);
+}
+
+typedef struct
+{
+    SSP_LINK link;
+    SSP_COMMAND cmd;
+    SSP_TX_RX_PACKET packet;
+} COMPILE_ARG;
+
+static void compile_fn(void* arg)
+{
+    COMPILE_ARG* a = arg;
+    CompileSSPCommand(&a->link, &a->cmd, &a->packet);
+    sink += a->packet.txBufferLength;
+}
+
+static void data_in_fn(void* arg)
+{
+    COMPILE_ARG* a = arg;
+    unsigned char i;
+    a->packet.NewResponse = 0;
+    for (i = 0; i < a->packet.txBufferLength; i++)
+        SSPDataIn(a->packet.txData[i], &a->packet);
+    sink += a->packet.NewResponse;
+}
+
+typedef struct
+{
+    unsigned char plain[255];
+    unsigned char cipher[255];
+    unsigned char length;
+    unsigned int count;
+    SSP_FULL_KEY key;
+} CRYPT_ARG;
+
+static void encrypt_fn(void* arg)
+{
+    CRYPT_ARG* a = arg;
+    unsigned char length_in = a->length;
+    unsigned char length_out;
+    EncryptSSPPacket(&a->count, a->plain, a->cipher, &length_in, &length_out,
+                     (unsigned long long*)&a->key);
+    sink += length_out;
+}
+
+// a new key for every packet, as right after each key negotiation
+static void encrypt_new_key_fn(void* arg)
+{
+    CRYPT_ARG* a = arg;
+    a->key.EncryptKey++;
+    encrypt_fn(arg);
+}
+
+static void decrypt_fn(void* arg)
+{
+    CRYPT_ARG* a = arg;
+    unsigned char length = a->length;
+    DecryptSSPPacket(a->cipher, a->plain, &length, &length,
+                     (unsigned long long*)&a->key);
+    sink += a->plain[0];
+}
+
+typedef struct
+{
+    SSP_COMMAND cmd;
+    SSP_POLL_DATA6 poll;
+} POLL_ARG;
+
+static void decode_poll_fn(void* arg)
+{
+    POLL_ARG* a = arg;
+    ssp6_decode_poll(&a->cmd, &a->poll);
+    sink += a->poll.event_count;
+}
+
+int main(void)
+{
+    static const short crc_sizes[] = {1, 16, 64, 128, 255};
+    static const unsigned char frame_sizes[] = {1, 9, 32, 64, 128};
+    static const unsigned char crypt_sizes[] = {1, 9, 32, 64};
+    // a busy poll: read, credit, stacked, dispensing and dispensed (1 country)
+    static const unsigned char poll_response[] = {
+        SSP_RESPONSE_OK,
+        SSP_POLL_READ, 0x02,
+        SSP_POLL_CREDIT, 0x02,
+        SSP_POLL_STACKED,
+        SSP_POLL_DISPENSING, 0x01, 0xD0, 0x07, 0x00, 0x00, 'C', 'H', 'F',
+        SSP_POLL_DISPENSED, 0x01, 0xD0, 0x07, 0x00, 0x00, 'C', 'H', 'F',
+        SSP_POLL_DISABLED,
+    };
+    unsigned int i;
+
+    printf("{");
+
+    for (i = 0; i < sizeof(crc_sizes) / sizeof(*crc_sizes); i++)
+    {
+        CRC_ARG arg;
+        arg.length = crc_sizes[i];
+        fill(arg.data, arg.length, i);
+        bench("crc_ccitt", arg.length, crc_fn, &arg);
+    }
+
+    for (i = 0; i < sizeof(frame_sizes) / sizeof(*frame_sizes); i++)
+    {
+        COMPILE_ARG arg;
+        memset(&arg, 0, sizeof(arg));
+        arg.cmd.CommandDataLength = frame_sizes[i];
+        fill(arg.cmd.CommandData, frame_sizes[i], i);
+        // one STX to stuff every 16 bytes
+        for (int j = 0; j < frame_sizes[i]; j += 16)
+            arg.cmd.CommandData[j] = SSP_STX;
+        arg.cmd.CommandData[0] = SSP_CMD_POLL;
+        bench("compile_ssp_command", frame_sizes[i], compile_fn, &arg);
+
+        // receive the frame just compiled, unstuffing and checking its CRC
+        data_in_fn(&arg);
+        if (!arg.packet.NewResponse)
+        {
+            fprintf(stderr, "SSPDataIn rejected a %d byte frame\n",
+                    frame_sizes[i]);
+            return 1;
+        }
+        bench("ssp_data_in", frame_sizes[i], data_in_fn, &arg);
+    }
+
+    for (i = 0; i < sizeof(crypt_sizes) / sizeof(*crypt_sizes); i++)
+    {
+        CRYPT_ARG arg;
+        unsigned char length_in, length_out;
+        memset(&arg, 0, sizeof(arg));
+        arg.key.FixedKey = 0x123456701234567ULL;
+        arg.key.EncryptKey = 0x1122334455667788ULL;
+        arg.length = crypt_sizes[i];
+        fill(arg.plain, arg.length, i);
+        bench("encrypt_ssp_packet", arg.length, encrypt_fn, &arg);
+        if (i == 0)
+            bench("encrypt_ssp_packet_new_key", arg.length,
+                  encrypt_new_key_fn, &arg);
+
+        length_in = crypt_sizes[i];
+        EncryptSSPPacket(&arg.count, arg.plain, arg.cipher, &length_in, &length_out,
+                         (unsigned long long*)&arg.key);
+        // the decrypted part excludes the STEX byte
+        memmove(arg.cipher, arg.cipher + 1, length_out - 1);
+        arg.length = length_out - 1;
+        bench("decrypt_ssp_packet", crypt_sizes[i], decrypt_fn, &arg);
+    }
+
+    {
+        POLL_ARG arg;
+        memset(&arg, 0, sizeof(arg));
+        memcpy(arg.cmd.ResponseData, poll_response, sizeof(poll_response));
+        arg.cmd.ResponseDataLength = sizeof(poll_response);
+        bench("decode_poll", sizeof(poll_response), decode_poll_fn, &arg);
+    }
+
+    printf("\n}\n");
+    return 0;
+}
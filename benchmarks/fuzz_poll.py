@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+'''Differential fuzzing of the poll decoders.
+
+Random poll responses are decoded by ssp6_decode_poll (C) and by
+eSSP.decoder.decode_poll (Python). Well formed responses are also checked
+against the events they were built from, and sent through the pty
+simulator so that they are read back from a real poll.
+
+    python3 benchmarks/fuzz_poll.py --frames 20000 --polls 500
+'''
+import argparse
+import os
+import random
+import sys
+from ctypes import byref
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from eSSP import C_LIBRARY  # noqa: E402
+from eSSP.clib import (  # noqa: E402
+    CommandPointer,
+    PollDataPointer,
+    SspCommand,
+    SspPollData6,
+    SspResponseEnum,
+    define_function,
+)
+from eSSP.decoder import (  # noqa: E402
+    CHANNEL_EVENTS,
+    MAX_EVENTS,
+    TWO_VALUE_EVENTS,
+    VALUE_EVENTS,
+    PollEvent,
+    decode_poll,
+)
+from eSSP.simulator import Simulator  # noqa: E402
+
+RESPONSE_OK = 0xF0
+# Events without data, known or not
+PLAIN_EVENTS = [0xF1, 0xED, 0xEC, 0xCC, 0xEB, 0xE8, 0xDB, 0xC2, 0xC3, 0x42]
+CURRENCIES = [b'CHF', b'EUR', b'GBP', b'USD']
+
+define_function('ssp6_decode_poll', None, CommandPointer, PollDataPointer)
+
+
+def random_events(rng, max_bytes=200):
+    '''A well formed poll response and the PollEvents it holds'''
+    data = bytearray([RESPONSE_OK])
+    events = []
+    while len(events) < MAX_EVENTS:
+        kind = rng.randrange(4)
+        if kind == 0:
+            event = rng.choice(sorted(CHANNEL_EVENTS))
+            channel = rng.randrange(256)
+            chunk = bytes([event, channel])
+            decoded = [PollEvent(event, channel, 0, b'')]
+        elif kind in (1, 2):
+            event = rng.choice(sorted(
+                VALUE_EVENTS if kind == 1 else TWO_VALUE_EVENTS
+            ))
+            countries = rng.randrange(
+                min(3, MAX_EVENTS - len(events)) + 1,
+            )
+            chunk = bytearray([event, countries])
+            decoded = []
+            for _ in range(countries):
+                value = rng.randrange(1 << 32)
+                requested = rng.randrange(1 << 32) if kind == 2 else 0
+                currency = rng.choice(CURRENCIES)
+                chunk += value.to_bytes(4, 'little')
+                if kind == 2:
+                    chunk += requested.to_bytes(4, 'little')
+                chunk += currency
+                decoded.append(PollEvent(event, value, requested, currency))
+            if not countries:
+                decoded = [PollEvent(event, 0, 0, b'')]
+        else:
+            event = rng.choice(PLAIN_EVENTS)
+            chunk = bytes([event])
+            decoded = [PollEvent(event, 0, 0, b'')]
+        if len(data) + len(chunk) > max_bytes:
+            break
+        data += chunk
+        events += decoded
+        if rng.random() < 0.2:
+            break
+    return bytes(data), events
+
+
+def c_decode(data):
+    '''PollEvents decoded by ssp6_decode_poll'''
+    command = SspCommand()
+    command.ResponseDataLength = len(data)
+    command.ResponseData[0:len(data)] = list(data)
+    poll = SspPollData6()
+    C_LIBRARY.ssp6_decode_poll(byref(command), byref(poll))
+    return [
+        PollEvent(event.event, event.data1, event.data2, event.cc)
+        for event in poll.events[:poll.event_count]
+    ]
+
+
+def check(data, expected=None):
+    c_events = c_decode(data)
+    python_events = decode_poll(memoryview(data))
+    if c_events != python_events:
+        raise AssertionError(
+            f'{data.hex()}: C {c_events} != Python {python_events}',
+        )
+    if expected is not None and python_events != expected:
+        raise AssertionError(
+            f'{data.hex()}: decoded {python_events} != {expected}',
+        )
+
+
+def fuzz_frames(rng, frames):
+    for _ in range(frames):
+        data, events = random_events(rng)
+        check(data, events)
+        # Truncated anywhere, the decoders must still agree
+        check(data[:rng.randrange(1, len(data) + 1)])
+        # Random bytes
+        check(bytes([RESPONSE_OK]) + rng.randbytes(rng.randrange(255)))
+
+
+def fuzz_simulator(rng, polls):
+    with Simulator() as simulator:
+        ssp_c = C_LIBRARY.ssp_init(simulator.port.encode(), b'0', 0)
+        command = ssp_c.contents
+        response = memoryview(command.ResponseData).cast('B')
+        try:
+            # The first poll reports the reset
+            C_LIBRARY.ssp6_poll_raw(ssp_c)
+            for _ in range(polls):
+                data, events = random_events(rng)
+                simulator.queue_events(data[1:])
+                if (C_LIBRARY.ssp6_poll_raw(ssp_c)
+                        != SspResponseEnum.SSP_RESPONSE_OK):
+                    raise AssertionError(f'{data.hex()}: poll failed')
+                received = bytes(response[:command.ResponseDataLength])
+                if received != data:
+                    raise AssertionError(
+                        f'sent {data.hex()}, polled {received.hex()}',
+                    )
+                if decode_poll(response, command.ResponseDataLength) \
+                        != events:
+                    raise AssertionError(f'{data.hex()}: decoded in place')
+                check(received, events)
+        finally:
+            C_LIBRARY.close_ssp_port(ssp_c)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--polls', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    print(f'seed {seed}')
+    rng = random.Random(seed)
+    fuzz_frames(rng, args.frames)
+    print(f'{args.frames} frames: C and Python decoders agree')
+    fuzz_simulator(rng, args.polls)
+    print(f'{args.polls} simulator polls: decoded as sent')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''Poll jitter of the Python poll thread and of the native poller.
+
+A validator is polled every --interval seconds while another thread holds
+the GIL for long stretches (sorting a large list). The Python poll thread
+has to wait for the GIL, the native poller does not: its lateness must stay
+under --max-jitter-ms. The simulator runs in its own process so that it
+answers on time.
+
+    python3 benchmarks/poll_jitter.py --seconds 10
+'''
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from eSSP import eSSP  # noqa: E402
+from eSSP.scheduler import PollScheduler  # noqa: E402
+
+
+class TimedESSP(eSSP):
+    '''Records when poll_once is called, for the Python poll thread'''
+
+    def __init__(self, *args, **kwargs):
+        self.poll_times = []
+        super().__init__(*args, **kwargs)
+
+    def poll_once(self):
+        self.poll_times.append(time.monotonic())
+        return super().poll_once()
+
+
+def hog_gil(stop, size):
+    '''Hold the GIL for one sort at a time until <stop> is set'''
+    values = [random.random() for _ in range(size)]
+    while not stop.is_set():
+        sorted(values)
+
+
+def run(port, native, seconds, interval, size):
+    '''Poll for <seconds> with the GIL hogged, return the lateness of the
+    polls in ms: (max, number later than 5 ms, polls)
+    '''
+    validator = TimedESSP(
+        port,
+        scheduler=PollScheduler(
+            fast_interval=interval,
+            idle_interval=interval,
+        ),
+        native_poller=native,
+    )
+    stop = threading.Event()
+    hog = threading.Thread(target=hog_gil, args=(stop, size), daemon=True)
+    hog.start()
+    time.sleep(seconds)
+    if native:
+        stats = validator.poller_stats()
+        result = (stats['max_late_ns'] / 1e6, stats['late_polls'],
+                  stats['polls'])
+    stop.set()
+    hog.join()
+    validator.close()
+    if not native:
+        late = [
+            (after - before - interval) * 1e3
+            for before, after in zip(
+                validator.poll_times,
+                validator.poll_times[1:],
+            )
+        ]
+        result = (max(late), sum(1 for ms in late if ms > 5),
+                  len(validator.poll_times))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=0.1)
+    parser.add_argument('--sort-size', type=int, default=2000000)
+    parser.add_argument('--max-jitter-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    simulator = subprocess.Popen(
+        [sys.executable, '-m', 'eSSP.simulator'],
+        cwd=ROOT,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        port = simulator.stdout.readline().strip()
+        for native in (False, True):
+            late_ms, late, polls = run(
+                port,
+                native,
+                args.seconds,
+                args.interval,
+                args.sort_size,
+            )
+            print(
+                f'{"native" if native else "python"}: {polls} polls, '
+                f'{late} late, max lateness {late_ms:.1f} ms',
+            )
+    finally:
+        simulator.stdin.close()
+        simulator.wait()
+    if late_ms > args.max_jitter_ms:
+        sys.exit(f'native poller late by {late_ms:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
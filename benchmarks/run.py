@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+'''Run the eSSP benchmark suite and print the results as JSON.
+
+The C codec benchmarks (codec_bench.c) time framing, CRC, encryption and
+poll decoding inside libessp. The Python benchmarks time the ctypes
+bindings, the poll event dispatch and command round trips against the pty
+simulator. No hardware is needed.
+
+    python3 benchmarks/run.py --output results.json
+    python3 benchmarks/run.py --compare results.json
+'''
+import argparse
+import json
+import os
+import platform
+import resource
+import select
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import tty
+from ctypes import byref, c_char_p, c_int, c_short, c_ulong, c_ushort
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from eSSP import C_LIBRARY  # noqa: E402
+from eSSP import polls  # noqa: E402
+from eSSP.clib import (  # noqa: E402
+    CommandPointer,
+    PollDataPointer,
+    SspCommand,
+    SspPollData6,
+    SspResponseEnum,
+    define_function,
+)
+from eSSP.constants import Status  # noqa: E402
+from eSSP.decoder import PollEvent, decode_poll  # noqa: E402
+from eSSP.events import EventBuffer  # noqa: E402
+from eSSP.inventory import Inventory  # noqa: E402
+from eSSP.eSSP import eSSP  # noqa: E402
+from eSSP.scheduler import PollScheduler  # noqa: E402
+from eSSP.simulator import SimulatedDevice, Simulator  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(group):
+    def internal(function):
+        BENCHMARKS.setdefault(group, []).append(function)
+        return function
+    return internal
+
+
+def time_per_call(statement, min_time=0.2, repeat=5):
+    '''Best time of <statement> in ns per call'''
+    timer = timeit.Timer(statement)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def thread_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_codec_bench():
+    subprocess.check_call(
+        ['make', '-s', 'codec_bench'],
+        cwd=HERE,
+        stdout=subprocess.DEVNULL,
+    )
+    output = subprocess.check_output([os.path.join(HERE, 'codec_bench')])
+    return json.loads(output)
+
+
+class FakeEssp:
+    '''Minimal stand in for eSSP, enough for polls.handle_event'''
+
+    def __init__(self):
+        self.debug = False
+        self.events = EventBuffer()
+        self.inventory = Inventory()
+        self.profile = None
+
+    def print_debug(self, text):
+        if self.debug:
+            print(text)
+
+
+@benchmark('python')
+def ctypes_call_overhead():
+    define_function(
+        'cal_crc_loop_CCITT_A',
+        c_ushort,
+        c_short,
+        c_char_p,
+        c_ushort,
+        c_ushort,
+    )
+    crc = C_LIBRARY.cal_crc_loop_CCITT_A
+    data = b'\x07'
+    results = {
+        'ctypes_call[int_restype]': time_per_call(
+            lambda: crc(1, data, 0xFFFF, 0x8005),
+        ),
+    }
+    # Every ssp6_* binding converts its int result through this Enum
+    results['ctypes_call[enum_conversion]'] = time_per_call(
+        lambda: SspResponseEnum(0xF0),
+    )
+
+    define_function('ssp6_decode_poll', None, CommandPointer, PollDataPointer)
+    command = SspCommand()
+    command.ResponseDataLength = 4
+    command.ResponseData[0:4] = [0xF0, 0xEF, 0x02, 0xE8]
+    poll = SspPollData6()
+    command_ref, poll_ref = byref(command), byref(poll)
+    results['ctypes_call[decode_poll]'] = time_per_call(
+        lambda: C_LIBRARY.ssp6_decode_poll(command_ref, poll_ref),
+    )
+    return results
+
+
+@benchmark('python')
+def poll_decode():
+    '''Per poll cost of getting the events of a response into Python, through
+    ssp6_decode_poll and an SspPollData6 or decoded in place
+    '''
+    define_function('ssp6_decode_poll', None, CommandPointer, PollDataPointer)
+    frames = {
+        'idle': bytes([0xF0, 0xE8]),
+        'credit': bytes([0xF0, 0xEE, 0x02, 0xCC, 0xDB]),
+        'dispensed': bytes([0xF0, 0xD2, 0x02])
+        + (2000).to_bytes(4, 'little') + b'CHF'
+        + (500).to_bytes(4, 'little') + b'EUR',
+    }
+    results = {}
+    for name, frame in frames.items():
+        command = SspCommand()
+        command.ResponseDataLength = len(frame)
+        command.ResponseData[0:len(frame)] = list(frame)
+        poll = SspPollData6()
+        command_ref, poll_ref = byref(command), byref(poll)
+
+        def struct_decode():
+            C_LIBRARY.ssp6_decode_poll(command_ref, poll_ref)
+            return [
+                (event.event, event.data1, event.data2, event.cc)
+                for event in poll.events[:poll.event_count]
+            ]
+
+        response = memoryview(command.ResponseData).cast('B')
+        results[f'poll_decode[{name}_struct]'] = time_per_call(struct_decode)
+        results[f'poll_decode[{name}_memoryview]'] = time_per_call(
+            lambda: decode_poll(response, command.ResponseDataLength),
+        )
+    return results
+
+
+def dict_handle_event(essp, event):
+    '''polls.handle_event as it was before the dispatch tables: Status
+    lookup and debug text for every event, handlers in a dict
+    '''
+    try:
+        if event.event != Status.DISABLED:
+            essp.print_debug(Status(event.event))
+    except ValueError:
+        essp.print_debug(f'Unknown status: {event.event}')
+
+    try:
+        handler = polls.events[event.event]
+    except KeyError:
+        handler = None
+    recorded = None
+    if handler is not None:
+        recorded = handler(essp, event.data1, event.data2, event.cc.decode())
+
+    recorded = recorded or (0, 0, event.event)
+    essp.events.append(recorded)
+    return recorded
+
+
+@benchmark('python')
+def handle_event_dispatch():
+    '''Per event cost of polls.handle_event, and of the dict based
+    dispatch it replaced (handle_event_dict)
+    '''
+    essp = FakeEssp()
+    results = {}
+    cases = {
+        'disabled': (Status.SSP_POLL_DISABLED.value, 0, b''),
+        'credit': (Status.SSP_POLL_CREDIT.value, 2, b''),
+        'dispensed': (Status.SSP_POLL_DISPENSED.value, 2000, b'CHF'),
+        'unregistered': (Status.SSP_POLL_STACKING.value, 0, b''),
+        'unknown': (0x42, 0, b''),
+    }
+    for name, (status, data1, cc) in cases.items():
+        event = PollEvent(status, data1, 0, cc)
+        for label, handle in (
+                ('handle_event', polls.handle_event),
+                ('handle_event_dict', dict_handle_event),
+        ):
+            def dispatch():
+                handle(essp, event)
+                essp.events.clear()
+
+            results[f'{label}[{name}]'] = time_per_call(dispatch)
+    return results
+
+
+@benchmark('python')
+def event_buffer():
+    '''Cost of recording an event and reading it back'''
+    events = EventBuffer()
+    event = (2, 'CHF', Status.SSP_POLL_CREDIT)
+    results = {}
+
+    def append_get():
+        events.append(event)
+        events.get()
+
+    results['event_buffer[append_get]'] = time_per_call(append_get)
+
+    def append_drain():
+        for _ in range(16):
+            events.append(event)
+        events.drain()
+
+    results['event_buffer[append_drain_16]'] = time_per_call(append_drain) / 16
+    return results
+
+
+@benchmark('simulator')
+def command_round_trip(commands=200):
+    '''Wall and CPU time of one sync and one poll over the pty simulator.
+
+    poll_5ms is answered after 5 ms, about the time a real device takes at
+    9600 baud, and shows how much CPU the host burns while it waits.
+    '''
+    results = {}
+    with Simulator() as simulator:
+        ssp_c = C_LIBRARY.ssp_init(simulator.port.encode(), b'0', 0)
+        poll = SspPollData6()
+        for name, call, delay in (
+                ('sync', lambda: C_LIBRARY.ssp6_sync(ssp_c), 0),
+                (
+                    'poll',
+                    lambda: C_LIBRARY.ssp6_poll(ssp_c, byref(poll)),
+                    0,
+                ),
+                (
+                    'poll_5ms',
+                    lambda: C_LIBRARY.ssp6_poll(ssp_c, byref(poll)),
+                    0.005,
+                ),
+        ):
+            simulator.set_response_delay(delay)
+            call()
+            wall, cpu = time.perf_counter(), thread_cpu_time()
+            for _ in range(commands):
+                if call() != SspResponseEnum.SSP_RESPONSE_OK:
+                    raise RuntimeError(f'{name} failed')
+            wall = time.perf_counter() - wall
+            cpu = thread_cpu_time() - cpu
+            results[f'round_trip[{name}]'] = wall / commands * 1e9
+            results[f'round_trip_cpu[{name}]'] = cpu / commands * 1e9
+        C_LIBRARY.close_ssp_port(ssp_c)
+    return results
+
+
+@benchmark('simulator')
+def action_latency(actions=50):
+    '''Time from get_note_amount to its result, with the poll thread idle'''
+    with Simulator([SimulatedDevice(levels={(1000, 'CHF'): 3})]) as simulator:
+        validator = eSSP(
+            simulator.port,
+            scheduler=PollScheduler(fast_interval=0.1, idle_interval=1.0),
+        )
+        try:
+            latencies = []
+            for _ in range(actions):
+                # let the poll thread go back to its idle wait
+                time.sleep(0.02)
+                start = time.perf_counter()
+                response, count = validator.get_note_amount(10).result(5)
+                latencies.append(time.perf_counter() - start)
+                if response != SspResponseEnum.SSP_RESPONSE_OK or count != 3:
+                    raise RuntimeError(f'get_note_amount: {response} {count}')
+        finally:
+            validator.close()
+    latencies.sort()
+    return {
+        'action_latency[median]': latencies[len(latencies) // 2] * 1e9,
+        'action_latency[max]': latencies[-1] * 1e9,
+    }
+
+
+@benchmark('simulator')
+def multi_device_polls(polls=100, delay=0.005):
+    '''Polls of 1 to 8 devices, each on its own pty and thread.
+
+    Every device answers after <delay>, so while the ports are independent
+    the time per poll divides by the number of devices.
+    '''
+    results = {}
+    for count in (1, 2, 4, 8):
+        simulators = [Simulator().start() for _ in range(count)]
+        ssp_cs = []
+        try:
+            for simulator in simulators:
+                simulator.set_response_delay(delay)
+                ssp_cs.append(C_LIBRARY.ssp_init(
+                    simulator.port.encode(),
+                    b'0',
+                    0,
+                ))
+            failures = []
+
+            def run(ssp_c, simulator):
+                poll = SspPollData6()
+                for _ in range(polls):
+                    if C_LIBRARY.ssp6_poll(ssp_c, byref(poll)) != \
+                            SspResponseEnum.SSP_RESPONSE_OK:
+                        failures.append(simulator.port)
+                        return
+
+            threads = [
+                threading.Thread(target=run, args=arguments)
+                for arguments in zip(ssp_cs, simulators)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if failures:
+                raise RuntimeError(f'polls failed on {failures}')
+            results[f'multi_device_poll[{count}]'] = \
+                elapsed / (count * polls) * 1e9
+        finally:
+            for ssp_c in ssp_cs:
+                C_LIBRARY.close_ssp_port(ssp_c)
+            for simulator in simulators:
+                simulator.stop()
+    return results
+
+
+@benchmark('simulator')
+def write_data(blocks=200):
+    '''Time to hand a frame or a firmware block to WriteData over a pty'''
+    define_function('WriteData', c_int, c_char_p, c_ulong, c_int)
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    reading = True
+
+    def reader():
+        while reading:
+            if select.select([master], [], [], 0.1)[0]:
+                os.read(master, 4096)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    results = {}
+    try:
+        for size in (6, 128):
+            data = bytes(size)
+            start = time.perf_counter()
+            for _ in range(blocks):
+                if not C_LIBRARY.WriteData(data, size, slave):
+                    raise RuntimeError('WriteData failed')
+            elapsed = time.perf_counter() - start
+            results[f'write_data[{size}]'] = elapsed / blocks * 1e9
+    finally:
+        reading = False
+        thread.join()
+        os.close(master)
+        os.close(slave)
+    return results
+
+
+def run(groups):
+    results = {}
+    if 'codec' in groups:
+        for name, result in run_codec_bench().items():
+            results[f'codec.{name}'] = result['ns_per_op']
+    for group in groups:
+        for function in BENCHMARKS.get(group, []):
+            for name, ns in function().items():
+                results[f'{group}.{name}'] = ns
+    return {
+        'unit': 'ns_per_op',
+        'timestamp': time.time(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def compare(current, baseline):
+    '''Print the ratio current / baseline of every common result'''
+    old = baseline['results']
+    for name, ns in sorted(current['results'].items()):
+        if name in old and old[name]:
+            ratio = ns / old[name]
+            print(f'{name:50} {old[name]:12.1f} {ns:12.1f} {ratio:6.2f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--group',
+        action='append',
+        choices=['codec'] + sorted(BENCHMARKS),
+        help='benchmark group to run (default: all)',
+    )
+    parser.add_argument('--output', help='write the JSON results to a file')
+    parser.add_argument(
+        '--compare',
+        help='JSON results of a previous run to compare with',
+    )
+    args = parser.parse_args()
+
+    results = run(args.group or ['codec'] + sorted(BENCHMARKS))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+    elif not args.output:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
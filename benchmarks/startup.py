@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+'''Cold and warm startup time of several validators.
+
+Every validator is a simulator in its own process, answering each command
+after --delay seconds like a real device on its serial line. They are
+opened one after the other without a saved profile (cold), then again with
+the profiles saved by the first start (warm), then warm in parallel with
+open_many. Last, an asyncio warm start follows a firmware change of a
+simulated validator.
+
+    python3 benchmarks/startup.py --devices 4 --delay 0.01
+'''
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from eSSP import eSSP, open_many  # noqa: E402
+from eSSP.aio import AsyncESSP  # noqa: E402
+from eSSP.profile import ProfileStore  # noqa: E402
+from eSSP.simulator import Simulator  # noqa: E402
+
+CMD_SET_INHIBITS = 0x02
+CMD_ENABLE_PAYOUT = 0x5C
+
+
+def start_simulators(count, delay):
+    '''(processes, ports) of <count> simulators'''
+    processes = [
+        subprocess.Popen(
+            [sys.executable, '-m', 'eSSP.simulator', '--delay', str(delay)],
+            cwd=ROOT,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(count)
+    ]
+    return processes, [
+        process.stdout.readline().strip() for process in processes
+    ]
+
+
+def timed(open_validators):
+    '''(seconds, validators) of open_validators(), which are then closed'''
+    start = time.perf_counter()
+    validators = open_validators()
+    seconds = time.perf_counter() - start
+    for validator in validators:
+        validator.close()
+    return seconds, validators
+
+
+async def until(condition, timeout=5):
+    start = time.monotonic()
+    while not condition():
+        if time.monotonic() - start > timeout:
+            raise TimeoutError
+        await asyncio.sleep(0.01)
+
+
+async def firmware_change(path):
+    '''Warm start AsyncESSP on a simulator whose firmware changed, which
+    resets the device: the new profile must be saved and the device
+    configured again. Return the problems found.
+    '''
+    simulator = Simulator().start()
+    device = simulator.device
+    try:
+        validator = await AsyncESSP.open(
+            simulator.port,
+            profile_store=ProfileStore(path),
+        )
+        await validator.set_route_storage(10)
+        await validator.close()
+
+        device.commands.clear()
+        validator = await AsyncESSP.open(
+            simulator.port,
+            profile_store=ProfileStore(path),
+        )
+        await validator.close()
+        skipped = (
+            CMD_SET_INHIBITS not in device.commands
+            and CMD_ENABLE_PAYOUT not in device.commands
+        )
+        device.commands.clear()
+
+        device.firmware = '0460'
+        device.reset()
+        validator = await AsyncESSP.open(
+            simulator.port,
+            profile_store=ProfileStore(path),
+        )
+        essp = validator.essp
+        try:
+            await until(lambda: (
+                device.enabled
+                and device.inhibits
+                and device.payout_enabled
+                and essp.profile_store.get(essp.profile_key)[0]
+                .firmware_version == '0460'
+            ))
+            routes = essp.routes
+        except TimeoutError:
+            routes = None
+        finally:
+            await validator.close()
+    finally:
+        simulator.stop()
+    problems = []
+    if not skipped:
+        problems.append('the warm start sent the saved configuration')
+    if routes is None:
+        problems.append('the firmware change was missed')
+    elif routes:
+        problems.append(f'the routes of the old firmware were kept {routes}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--devices', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0.01)
+    args = parser.parse_args()
+
+    processes, ports = start_simulators(args.devices, args.delay)
+    with tempfile.TemporaryDirectory() as directory:
+        store = ProfileStore(os.path.join(directory, 'profiles.json'))
+        try:
+            runs = (
+                ('cold', lambda: [
+                    eSSP(port, start=False, profile_store=store)
+                    for port in ports
+                ]),
+                ('warm', lambda: [
+                    eSSP(port, start=False, profile_store=store)
+                    for port in ports
+                ]),
+                ('warm parallel', lambda: open_many(
+                    ports,
+                    start=False,
+                    profile_store=store,
+                )),
+            )
+            for name, open_validators in runs:
+                seconds, validators = timed(open_validators)
+                modes = {validator.startup['mode'] for validator in validators}
+                each = max(
+                    validator.startup['seconds'] for validator in validators
+                )
+                print(
+                    f'{name}: {len(validators)} devices in {seconds:.3f} s, '
+                    f'slowest {each:.3f} s ({", ".join(sorted(modes))})',
+                )
+        finally:
+            for process in processes:
+                process.stdin.close()
+            for process in processes:
+                process.wait()
+
+        problems = asyncio.run(
+            firmware_change(os.path.join(directory, 'changed.json')),
+        )
+    if problems:
+        sys.exit(f'asyncio warm start: {", ".join(problems)}')
+    print('asyncio warm start: firmware change followed')
+
+
+if __name__ == '__main__':
+    main()
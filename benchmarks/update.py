@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+'''Firmware update of a simulated device, in the background.
+
+A firmware file of --size bytes is made up and sent to the simulator with
+FirmwareUpdate while this thread keeps ticking every 10 ms: the update must
+succeed, report the progress of every block and leave the ticks on time.
+
+    python3 benchmarks/update.py --size 200000
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from eSSP.clib import UpdateDeviceResponseEnum  # noqa: E402
+from eSSP.simulator import Simulator  # noqa: E402
+from eSSP.update import FirmwareUpdate  # noqa: E402
+
+RAM_FILE_SIZE = 4096
+
+
+def firmware(size, baud=38400):
+    '''A made up firmware file of <size> bytes'''
+    header = bytearray(128)
+    header[0:3] = b'ITL'
+    header[5] = 0x06  # SMART Payout
+    header[6] = 0x01
+    header[7:11] = RAM_FILE_SIZE.to_bytes(4, 'big')
+    header[68:72] = baud.to_bytes(4, 'big')
+    return bytes(header) + os.urandom(size - len(header))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=200000)
+    parser.add_argument('--block-size', type=int, default=512)
+    args = parser.parse_args()
+
+    simulator = Simulator().start()
+    simulator.device.download_block_size = args.block_size
+    progress = []
+    with tempfile.NamedTemporaryFile(suffix='.bv1') as file:
+        file.write(firmware(args.size))
+        file.flush()
+        try:
+            update = FirmwareUpdate(
+                file.name,
+                simulator.port,
+                progress=progress.append,
+            )
+            late = 0.0
+            ticks = 0
+            while not update.done():
+                before = time.monotonic()
+                time.sleep(0.01)
+                late = max(late, time.monotonic() - before - 0.01)
+                ticks += 1
+            response = update.wait()
+            status = update.status()
+        finally:
+            simulator.stop()
+
+    main_file = [
+        entry for entry in progress if entry['blocks_total']
+    ]
+    print(
+        f'{response.name}: {status["bytes_sent"]} bytes in '
+        f'{status["seconds"]:.2f} s (3 s of it waiting for the loader), '
+        f'{len(main_file)} progress reports for '
+        f'{status["blocks_total"]} blocks',
+    )
+    blocks = main_file[-1]['blocks_sent'] - main_file[0]['blocks_sent']
+    seconds = main_file[-1]['seconds'] - main_file[0]['seconds']
+    if seconds:
+        print(
+            f'main file: {blocks / seconds:.0f} blocks/s, '
+            f'{blocks * args.block_size / seconds / 1e3:.0f} kB/s',
+        )
+    print(f'{ticks} ticks, latest by {late * 1e3:.1f} ms')
+    if response != UpdateDeviceResponseEnum.OK:
+        sys.exit(f'update failed: {response}')
+    if simulator.device.updates != 1:
+        sys.exit('the simulator did not restart')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
 # C_LIBRARY must be imported before eSSP as eSSP depends on the lib.
 from .clib import C_LIBRARY
 
-from .eSSP import eSSP
+from .eSSP import eSSP, open_many
@@ -1,19 +1,59 @@
+import heapq
+import threading
+import time
+from concurrent.futures import Future
 from ctypes import byref
 
+from six.moves import queue
+
 from . import C_LIBRARY
-from .clib import (
-    Ssp6SetupRequestData,
-    SspResponseEnum,
-)
-from .constants import Status
+from .clib import Ssp6SetupRequestData, SspResponseEnum
+from .constants import PayoutError, Status
+from .profile import DeviceProfile
+
+
+# Priority classes, lower runs first
+PRIORITY_ESCROW = 0  # a note waits in escrow for its route
+PRIORITY_PAYOUT = 1
+PRIORITY_CONTROL = 2
+PRIORITY_QUERY = 3
 
 
 class Action:
+    '''A command run by the poll thread.
+
+    ``future`` is resolved with the (SspResponseEnum, payload) returned by
+    function once the device answered, payload being None for the commands
+    that return nothing.
+    '''
+    priority = PRIORITY_CONTROL
+    # Actions with the same merge key can be run once for all, None when
+    # every request must run
+    mergeable = False
+    # The device setting the action changes: it is merged only with a
+    # waiting action queued after every other action changing the setting
+    state = None
+
     def __init__(self, **kwargs):
         self.arguments = kwargs
+        self.future = Future()
+        self.queued_at = None
+
+    def merge_key(self):
+        if not self.mergeable:
+            return None
+        return type(self), tuple(sorted(self.arguments.items()))
 
     def __call__(self, essp):
-        self.function(essp, **self.arguments)
+        if not self.future.set_running_or_notify_cancel():
+            return None
+        try:
+            result = self.function(essp, **self.arguments)
+        except Exception as error:
+            self.future.set_exception(error)
+            raise
+        self.future.set_result(result)
+        return result
 
     def __str__(self):
         return self.debug_message()
@@ -28,125 +68,246 @@ class Action:
 
 class RouteToCashbox(Action):
     debug_message = 'Route to cashbox'
+    priority = PRIORITY_ESCROW
 
     def function(self, essp, **kwargs):
-        if C_LIBRARY.ssp6_set_route(
-                    essp.sspC,
-                    kwargs['amount'],
-                    kwargs['currency'].encode(),
-                    Status.ENABLED.value,
-                ) != SspResponseEnum.SSP_RESPONSE_OK:
+        response = C_LIBRARY.ssp6_set_route(
+            essp.sspC,
+            kwargs['amount'],
+            kwargs['currency'].encode(),
+            Status.ENABLED.value,
+        )
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('ERROR: Route to cashbox failed')
+        else:
+            essp.remember_route(
+                kwargs['amount'],
+                kwargs['currency'],
+                'cashbox',
+            )
+        return response, None
 
 
 class RouteToStorage(Action):
     debug_message = 'Route to storage'
+    priority = PRIORITY_ESCROW
 
     def function(self, essp, **kwargs):
-        if C_LIBRARY.ssp6_set_route(
-                    essp.sspC,
-                    kwargs['amount'],
-                    kwargs['currency'].encode(),
-                    Status.DISABLED.value,
-                ) != SspResponseEnum.SSP_RESPONSE_OK:
+        response = C_LIBRARY.ssp6_set_route(
+            essp.sspC,
+            kwargs['amount'],
+            kwargs['currency'].encode(),
+            Status.DISABLED.value,
+        )
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('ERROR: Route to storage failed')
+        else:
+            essp.remember_route(
+                kwargs['amount'],
+                kwargs['currency'],
+                'storage',
+            )
+        return response, None
 
 
 class Payout(Action):
     debug_message = 'Payout'
+    priority = PRIORITY_PAYOUT
 
     def function(self, essp, **kwargs):
-        if C_LIBRARY.ssp6_payout(
-                    essp.sspC,
-                    kwargs['amount'],
-                    kwargs['currency'].encode(),
-                    Status.SSP6_OPTION_BYTE_DO.value,
-                ) != SspResponseEnum.SSP_RESPONSE_OK:
-            essp.print_debug('ERROR: Payout failed')
+        '''The payload is the PayoutError of a refused payout'''
+        response = C_LIBRARY.ssp6_payout(
+            essp.sspC,
+            kwargs['amount'],
+            kwargs['currency'].encode(),
+            Status.SSP6_OPTION_BYTE_DO.value,
+        )
+        if response == SspResponseEnum.SSP_RESPONSE_OK:
+            return response, None
+        essp.print_debug('ERROR: Payout failed')
+        reason = None
+        if response == SspResponseEnum.SSP_RESPONSE_COMMAND_NOT_PROCESSED:
             # Checking the error
-            response_data = essp.sspC.contents.ResponseData
-            if response_data[1] == Status.SMART_PAYOUT_NOT_ENOUGH:
-                essp.print_debug(Status.SMART_PAYOUT_NOT_ENOUGH)
-            elif response_data[1] == Status.SMART_PAYOUT_EXACT_AMOUNT:
-                essp.print_debug(Status.SMART_PAYOUT_EXACT_AMOUNT)
-            elif response_data[1] == Status.SMART_PAYOUT_BUSY:
-                essp.print_debug(Status.SMART_PAYOUT_BUSY)
-            elif response_data[1] == Status.SMART_PAYOUT_DISABLED:
-                essp.print_debug(Status.SMART_PAYOUT_DISABLED)
+            try:
+                reason = PayoutError(essp.sspC.contents.ResponseData[1])
+                essp.print_debug(reason)
+            except ValueError:
+                pass
+        return response, reason
 
 
 class PayoutNextNoteNv11(Action):
     debug_message = 'Payout next note'
+    priority = PRIORITY_ESCROW
 
     def function(self, essp, **kwargs):
         essp.print_debug('Payout next note')
-        setup_req = Ssp6SetupRequestData()
-        if C_LIBRARY.ssp6_setup_request(
-                    essp.sspC,
-                    byref(setup_req),
-                ) != SspResponseEnum.SSP_RESPONSE_OK:
-            essp.print_debug('Setup request failed')
-        # Maybe the version, or something (taken from the SDK C code)
-        if setup_req.UnitType != 0x07:
+        profile = essp.profile
+        if profile is not None and not profile.is_nv11:
             essp.print_debug('Payout next note is only valid for NV11')
-        if C_LIBRARY.ssp6_payout_note(
-                essp.sspC) != SspResponseEnum.SSP_RESPONSE_OK:
+        response = C_LIBRARY.ssp6_payout_note(essp.sspC)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('Payout next note failed')
+        return response, None
 
 
 class StackNextNoteNv11(Action):
     debug_message = 'Stack next note'
+    priority = PRIORITY_ESCROW
 
     def function(self, essp, **kwargs):
-        setup_req = Ssp6SetupRequestData()
-        if C_LIBRARY.ssp6_setup_request(
-                    essp.sspC,
-                    byref(setup_req),
-                ) != SspResponseEnum.SSP_RESPONSE_OK:
-            essp.print_debug('Setup request failed')
-        # Maybe the version, or something (taken from the SDK C code)
-        if setup_req.UnitType != 0x07:
-            essp.print_debug('Payout next note is only valid for NV11')
-        if (C_LIBRARY.ssp6_stack_note(essp.sspC)
-                != SspResponseEnum.SSP_RESPONSE_OK):
+        profile = essp.profile
+        if profile is not None and not profile.is_nv11:
+            essp.print_debug('Stack next note is only valid for NV11')
+        response = C_LIBRARY.ssp6_stack_note(essp.sspC)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('Stack next note failed')
+        return response, None
+
+
+class EnableValidator(Action):
+    debug_message = 'Enable validator'
+    mergeable = True
+    state = 'validator'
+
+    def function(self, essp, **kwargs):
+        response = C_LIBRARY.ssp6_enable(essp.sspC)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
+            essp.print_debug('ERROR: Enable failed')
+            return response, None
+        profile = essp.profile
+        if profile is None:
+            return SspResponseEnum.SSP_RESPONSE_TIMEOUT, None
+        if profile.is_smart_hopper:
+            # SMART Hopper requires different inhibit commands
+            for channel in profile.channels:
+                C_LIBRARY.ssp6_set_coinmech_inhibits(
+                    essp.sspC,
+                    channel.value,
+                    channel.currency.encode(),
+                    Status.ENABLED,
+                )
+        else:
+            # Magic numbers here
+            response = C_LIBRARY.ssp6_set_inhibits(essp.sspC, 0xFF, 0xFF)
+            if response != SspResponseEnum.SSP_RESPONSE_OK:
+                essp.print_debug('Inhibits failed')
+        return response, None
+
+
+class EnablePayout(Action):
+    debug_message = 'Enable payout'
+    mergeable = True
+    state = 'payout'
+
+    def function(self, essp, **kwargs):
+        profile = essp.profile
+        if profile is None:
+            return SspResponseEnum.SSP_RESPONSE_TIMEOUT, None
+        response = C_LIBRARY.ssp6_enable_payout(essp.sspC, profile.unit_type)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
+            essp.print_debug('ERROR: Payout enable failed')
+        return response, None
+
+
+class ValidateProfile(Action):
+    '''Check the profile of a warm start against the device. If it
+    changed, the validator is set up again for the new one.
+    '''
+    debug_message = 'Validate profile'
+    # Before the routes of the notes in escrow
+    priority = PRIORITY_ESCROW
+    mergeable = True
+
+    def function(self, essp, **kwargs):
+        '''The payload is True when the saved profile was right'''
+        # Not essp.profile, which is read again after a reset reported
+        # by the first poll
+        stored = essp.profile_store.get(essp.profile_key)
+        setup_req = Ssp6SetupRequestData()
+        response = C_LIBRARY.ssp6_setup_request(essp.sspC, byref(setup_req))
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
+            essp.print_debug('ERROR: Setup request failed')
+            return response, None
+        profile = DeviceProfile.from_setup_request(setup_req)
+        essp.set_profile(profile)
+        if stored is not None and profile == stored[0]:
+            return response, True
+        essp.print_debug(
+            f'Profile changed, firmware {profile.firmware_version}',
+        )
+        essp.queue_action(EnableValidator())
+        if profile.has_payout:
+            essp.queue_action(EnablePayout())
+        essp.inventory.supported = (
+            profile.has_payout or profile.is_smart_hopper
+        )
+        essp.inventory.invalidate()
+        return response, False
 
 
 class DisableValidator(Action):
     debug_message = 'Disable validator'
+    mergeable = True
+    state = 'validator'
 
     def function(self, essp, **kwargs):
-        if (C_LIBRARY.ssp6_disable(essp.sspC)
-                != SspResponseEnum.SSP_RESPONSE_OK):
+        response = C_LIBRARY.ssp6_disable(essp.sspC)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('ERROR: Disable failed')
+        return response, None
 
 
 class DisablePayout(Action):
     debug_message = 'Disable payout'
+    mergeable = True
+    state = 'payout'
 
     def function(self, essp, **kwargs):
-        if (C_LIBRARY.ssp6_disable_payout(essp.sspC)
-                != SspResponseEnum.SSP_RESPONSE_OK):
+        response = C_LIBRARY.ssp6_disable_payout(essp.sspC)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('ERROR: Disable payout failed')
+        return response, None
 
 
 class GetNoteAmount(Action):
     debug_message = 'Get note amount'
+    priority = PRIORITY_QUERY
+    mergeable = True
 
     def function(self, essp, **kwargs):
-        if C_LIBRARY.ssp6_get_note_amount(
-                    essp.sspC,
-                    kwargs['amount'],
-                    kwargs['currency'].encode(),
-                ) != SspResponseEnum.SSP_RESPONSE_OK:
+        '''The payload is the number of notes, None on error'''
+        response = C_LIBRARY.ssp6_get_note_amount(
+            essp.sspC,
+            kwargs['amount'],
+            kwargs['currency'].encode(),
+        )
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('ERROR: Can''t read the note amount')
             # There can't be 9999 notes
             essp.response_data['getnoteamount_response'] = 9999
-        else:
-            # The number of note
-            essp.response_data['getnoteamount_response'] = (
-                essp.sspC.contents.ResponseData[1]
-            )
+            return response, None
+        # The number of note, 2 bytes little endian
+        response_data = essp.sspC.contents.ResponseData
+        count = response_data[1] | response_data[2] << 8
+        essp.response_data['getnoteamount_response'] = count
+        essp.inventory.set_level(kwargs['amount'], kwargs['currency'], count)
+        return response, count
+
+
+class GetAllLevels(Action):
+    debug_message = 'Get all levels'
+    priority = PRIORITY_QUERY
+    mergeable = True
+
+    def function(self, essp, **kwargs):
+        '''The payload is the {(value, currency): count} levels, None on
+        error
+        '''
+        response = essp.refresh_inventory()
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
+            return response, None
+        return response, essp.inventory.levels()
 
 
 class EmptyStorage(Action):
@@ -158,8 +319,112 @@ class EmptyStorage(Action):
         # mention of this that can be found. Since this function was called with
         # this mysterious argument missing, it was decided to call it with 0x00
         # and avoid adding a command that doesn't seem to exist.
-        if (C_LIBRARY.ssp6_empty(essp.sspC, 0x00)
-                != SspResponseEnum.SSP_RESPONSE_OK):
+        response = C_LIBRARY.ssp6_empty(essp.sspC, 0x00)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
             essp.print_debug('ERROR: Can''t empty the storage')
         else:
             essp.print_debug('Emptying, please wait...')
+        return response, None
+
+
+def _copy_result(source, target):
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class ActionQueue:
+    '''The actions waiting for the poll thread, by priority class then in
+    the order they were queued.
+
+    An action equal to one still waiting (same merge_key) is not queued
+    again, its future gets the result of the waiting one. An action
+    changing a setting (state) of the device is merged only back to back:
+    queuing enable, disable, enable runs the three. do_actions stops
+    starting actions after <budget> seconds, so the next poll stays within
+    the keep-alive timeout, the others run after that poll.
+    '''
+
+    def __init__(self, budget=0.5):
+        self.budget = budget
+        self._heap = []
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._count = 0
+        self.merged = 0
+        self.ran = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.over_budget = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def empty(self):
+        return not self._heap
+
+    def put(self, action):
+        '''Queue <action>, or merge it with the same action already
+        waiting
+        '''
+        key = action.merge_key()
+        with self._lock:
+            waiting = self._waiting.get(key) if key is not None else None
+            if waiting is None and action.state is not None:
+                # Those queued before this action no longer merge with the
+                # next ones, the setting would end up reversed
+                for other_key in [
+                        other_key
+                        for other_key, other in self._waiting.items()
+                        if other.state == action.state
+                ]:
+                    del self._waiting[other_key]
+            if waiting is None:
+                action.queued_at = time.monotonic()
+                heapq.heappush(
+                    self._heap,
+                    (action.priority, self._count, action),
+                )
+                self._count += 1
+                if key is not None:
+                    self._waiting[key] = action
+                self.max_depth = max(self.max_depth, len(self._heap))
+                return
+            self.merged += 1
+        waiting.future.add_done_callback(
+            lambda future: _copy_result(future, action.future),
+        )
+
+    def get(self):
+        '''Remove and return the first action, raise queue.Empty if there
+        is none
+        '''
+        with self._lock:
+            if not self._heap:
+                raise queue.Empty
+            _, _, action = heapq.heappop(self._heap)
+            key = action.merge_key()
+            if key is not None and self._waiting.get(key) is action:
+                del self._waiting[key]
+            wait = time.monotonic() - action.queued_at
+            self.ran += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        return action
+
+    def stats(self):
+        '''Counters, for monitoring'''
+        with self._lock:
+            return {
+                'depth': len(self._heap),
+                'max_depth': self.max_depth,
+                'ran': self.ran,
+                'merged': self.merged,
+                'over_budget': self.over_budget,
+                'wait_mean': self.wait_total / self.ran if self.ran else 0.0,
+                'wait_max': self.wait_max,
+            }
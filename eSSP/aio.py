@@ -0,0 +1,227 @@
+'''asyncio client for eSSP validators.
+
+The blocking C calls of every device run on one shared executor, a lock per
+device keeps them in order, and the poll loop of each device is an asyncio
+task, which also runs the actions queued on the eSSP object. Events are
+read with ``async for``:
+
+    validator = await AsyncESSP.open('/dev/ttyUSB0')
+    await validator.set_route_storage(10)
+    async for (amount, currency, event) in validator:
+        if event == Status.SSP_POLL_CREDIT:
+            ...
+    await validator.close()
+'''
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import actions
+from .eSSP import eSSP
+
+_executor = None
+
+
+def default_executor():
+    '''Executor shared by every AsyncESSP for its serial I/O'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(thread_name_prefix='essp')
+    return _executor
+
+
+class _Closed:
+    '''Marks the end of an event stream, with the error that caused it'''
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+class AsyncESSP:
+    '''asyncio front-end of an eSSP validator
+
+    Create it with AsyncESSP.open, or wrap an eSSP created with start=False.
+    '''
+
+    def __init__(self, essp, executor=None):
+        self.essp = essp
+        self.executor = executor or default_executor()
+        self._lock = asyncio.Lock()
+        self._streams = set()
+        self._poller = None
+        self._closed = None
+
+    @classmethod
+    async def open(
+            cls,
+            com_port,
+            ssp_address='0',
+            nv11=False,
+            debug=False,
+            scheduler=None,
+            executor=None,
+            profile_store=None,
+    ):
+        '''Connect to the validator on <com_port> and start polling it,
+        at the cadence chosen by <scheduler> (a PollScheduler). See eSSP
+        for <profile_store>.
+        '''
+        executor = executor or default_executor()
+        essp = await asyncio.get_event_loop().run_in_executor(
+            executor,
+            functools.partial(
+                eSSP,
+                com_port,
+                ssp_address,
+                nv11=nv11,
+                debug=debug,
+                start=False,
+                scheduler=scheduler,
+                profile_store=profile_store,
+            ),
+        )
+        client = cls(essp, executor)
+        client.start()
+        return client
+
+    def start(self):
+        '''Start the poll task'''
+        if self._poller is None:
+            self._poller = asyncio.ensure_future(self._poll_loop())
+
+    async def close(self):
+        '''Stop polling, reject the bill in escrow and close the port'''
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+        if self._closed is None:
+            self._end_streams(_Closed())
+            await self._call(self.essp.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _call(self, function, *args, **kwargs):
+        '''Run a blocking call on the executor, one at a time per device'''
+        async with self._lock:
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor,
+                functools.partial(function, *args, **kwargs),
+            )
+
+    def _poll(self):
+        '''Poll once, run the queued actions and take the events the poll
+        produced, runs on the executor
+        '''
+        answered = self.essp.poll_once()
+        if answered:
+            self.essp.do_actions()
+        return (
+            answered,
+            self.essp.drain_events(),
+            self.essp.poll_statuses(),
+            not self.essp.actions.empty(),
+        )
+
+    async def _poll_loop(self):
+        try:
+            while True:
+                answered, events, statuses, pending = await self._call(
+                    self._poll,
+                )
+                for event in events:
+                    for stream in self._streams:
+                        stream.put_nowait(event)
+                if not answered:
+                    raise ConnectionError('The validator stopped answering')
+                await asyncio.sleep(
+                    self.essp.scheduler.update(statuses, pending),
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            self.essp.print_debug(f'Poll loop stopped: {error}')
+            self._end_streams(_Closed(error))
+            await self._call(self.essp.close)
+
+    def _end_streams(self, closed):
+        self._closed = closed
+        for stream in self._streams:
+            stream.put_nowait(closed)
+
+    async def events(self):
+        '''Asynchronous iterator over the (amount, currency, event) tuples
+        of the polls that follow. Ends when the client is closed, or raises
+        the error that stopped the poll loop.
+        '''
+        stream = asyncio.Queue()
+        self._streams.add(stream)
+        try:
+            while self._closed is None or not stream.empty():
+                event = await stream.get()
+                if isinstance(event, _Closed):
+                    break
+                yield event
+            closed = self._closed
+            if closed is not None and closed.error is not None:
+                raise closed.error
+        finally:
+            self._streams.discard(stream)
+
+    def __aiter__(self):
+        return self.events()
+
+    async def _run(self, action):
+        return await self._call(action, self.essp)
+
+    async def set_route_cashbox(self, amount, currency='CHF'):
+        '''Route the notes of <amount> to the cashbox, return the
+        (SspResponseEnum, None) result
+        '''
+        return await self._run(actions.RouteToCashbox(
+            amount=amount * 100,
+            currency=currency,
+        ))
+
+    async def set_route_storage(self, amount, currency='CHF'):
+        '''Route the notes of <amount> to the storage, return the
+        (SspResponseEnum, None) result
+        '''
+        return await self._run(actions.RouteToStorage(
+            amount=amount * 100,
+            currency=currency,
+        ))
+
+    async def payout(self, amount, currency='CHF'):
+        '''Payout note(s) for completing <amount>, return the
+        (SspResponseEnum, reason) result, see actions.Payout
+        '''
+        return await self._run(actions.Payout(
+            amount=amount * 100,
+            currency=currency,
+        ))
+
+    async def get_note_amount(self, amount, currency='CHF'):
+        '''Return the number of notes of <amount> in the storage, None if
+        the device could not tell
+        '''
+        _, count = await self._run(actions.GetNoteAmount(
+            amount=amount * 100,
+            currency=currency,
+        ))
+        return count
+
+    async def reject(self):
+        '''Reject the bill if there is one'''
+        await self._call(self.essp.reject)
+
+    async def enable_validator(self):
+        '''Enable the validator'''
+        return await self._run(actions.EnableValidator())
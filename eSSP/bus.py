@@ -0,0 +1,149 @@
+'''Several SSP devices on one serial line.
+
+A validator and a hopper can share an RS-232/TTL bus at different SSP
+addresses. The Bus owns the port and one thread polls every device on it:
+
+    bus = Bus('/dev/ttyUSB0')
+    validator = bus.add('0')
+    hopper = bus.add('16')
+    bus.start()
+
+Each device is an eSSP object, used as usual (its actions are run by the bus
+thread). Every address keeps its own sequence bit and encryption key.
+'''
+import threading
+import time
+
+from . import C_LIBRARY
+from .eSSP import eSSP
+from .scheduler import ACTIVE_EVENTS, PollScheduler
+
+
+class Bus:
+    '''The devices at the SSP addresses of the port <com_port>.
+
+    The next device polled is the one whose poll is due first, its
+    PollScheduler choosing when that is. Devices with queued actions are due
+    at once, and among the devices that are due the ones with a transaction
+    in progress go first. The idle_interval of the schedulers must leave
+    time for one poll of every other device before the keep-alive timeout.
+    '''
+
+    def __init__(self, com_port, debug=False):
+        self.debug = debug
+        self.com_port = com_port
+        self.sspC = C_LIBRARY.ssp_init(com_port.encode(), b'0', debug)
+        if not self.sspC:
+            raise Exception(f'Cannot open {com_port}')
+        self.devices = {}
+        self.missed_polls = {}
+        self._due = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def print_debug(self, text):
+        if self.debug:
+            print(text)
+
+    def add(
+            self,
+            ssp_address='0',
+            nv11=False,
+            scheduler=None,
+            profile_store=None,
+    ):
+        '''Set up the device at <ssp_address> and return its eSSP object.
+        See eSSP for <profile_store>.
+        '''
+        scheduler = scheduler or PollScheduler()
+        scheduler.wake_event = self._wake
+        device = eSSP(
+            None,
+            ssp_address,
+            nv11=nv11,
+            debug=self.debug,
+            start=False,
+            scheduler=scheduler,
+            bus=self,
+            profile_store=profile_store,
+        )
+        address = int(ssp_address)
+        self.devices[address] = device
+        self.missed_polls[address] = 0
+        self._due[address] = time.monotonic()
+        self._wake.set()
+        return device
+
+    def start(self):
+        '''Start the thread polling the devices'''
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        '''Stop polling, reject the bills in escrow and close the port'''
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for device in self.devices.values():
+            device.close()
+        C_LIBRARY.close_ssp_port(self.sspC)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def next_device(self):
+        '''Address of the device to poll next, and when its poll is due'''
+        now = time.monotonic()
+
+        def priority(address):
+            device = self.devices[address]
+            due = now if not device.actions.empty() else self._due[address]
+            active = any(
+                int(status) in ACTIVE_EVENTS
+                for status in device.poll_statuses()
+            )
+            return max(due, now), not active, due
+
+        address = min(list(self.devices), key=priority)
+        return address, priority(address)[0]
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            if not self.devices:
+                self._wake.wait()
+                continue
+            address, due = self.next_device()
+            delay = due - time.monotonic()
+            if delay > 0:
+                # a queued action or a new device sets _wake
+                self._wake.wait(delay)
+                continue
+            self.poll(address)
+
+    def poll(self, address):
+        '''Poll the device at <address>, run its actions and schedule its
+        next poll.
+        '''
+        device = self.devices[address]
+        try:
+            if not device.poll_once():
+                self.missed_polls[address] += 1
+                self.print_debug(f'Device {address} did not answer')
+            device.do_actions()
+        except Exception as error:
+            self.print_debug(f'Device {address}: {error}')
+        interval = device.scheduler.update(
+            device.poll_statuses(),
+            not device.actions.empty(),
+        )
+        self._due[address] = time.monotonic() + interval
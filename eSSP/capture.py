@@ -0,0 +1,233 @@
+'''Capture of the SSP traffic, and its replay offline.
+
+libessp can write every frame sent and every byte read, on all ports, to a
+capture file with its CLOCK_MONOTONIC timestamp:
+
+    start_capture('incident.essp', plain=True)
+    ...
+    stop_capture()
+
+replay feeds a capture back through SSPDataIn and the poll decoding and
+handlers, as fast as it can:
+
+    python -m eSSP.capture incident.essp --repeat 100
+
+The plain records (plain=True) hold the commands before encryption and the
+replies after decryption: without them the encrypted polls cannot be
+decoded, with them the file holds the decrypted traffic.
+'''
+import struct
+import time
+from collections import namedtuple
+from ctypes import byref
+
+from . import C_LIBRARY
+from .clib import SspTxRxPacket
+from .constants import Status
+from .decoder import decode_poll
+from .events import EventBuffer
+from .inventory import Inventory
+from .polls import DEFAULT_RECORDS, handle_event
+
+MAGIC = b'ESSPCAP2'
+# Version 1, records with a one byte length, truncated past 255 bytes
+MAGIC_V1 = b'ESSPCAP1'
+# Flags of the file
+PLAIN = 0x01
+# Kinds of record, as SSP_CAPTURE_* in SSPComs.h
+TX = 0
+RX = 1
+COMMAND = 2
+RESPONSE = 3
+RETRY = 4
+
+_FILE_HEADER = struct.Struct('<8sI')
+_RECORD_HEADER = struct.Struct('<QBBHH')
+_RECORD_HEADER_V1 = struct.Struct('<QBBHB')
+
+SSP_CMD_POLL = 0x07
+SSP_STEX = 0x7E
+
+# The handlers of these events send commands to the device, the replay only
+# records them
+SENDING_EVENTS = frozenset(status.value for status in (
+    Status.SSP_POLL_RESET,
+    Status.SSP_POLL_CALIBRATION_FAIL,
+))
+
+Record = namedtuple('Record', 'timestamp_ns kind address port data')
+
+
+def start_capture(path, plain=False):
+    '''Write the traffic of every port to <path> until stop_capture'''
+    flags = PLAIN if plain else 0
+    if not C_LIBRARY.ssp_capture_start(str(path).encode(), flags):
+        raise Exception(f'Cannot capture to {path}')
+
+
+def stop_capture():
+    '''Flush and close the capture file'''
+    C_LIBRARY.ssp_capture_stop()
+
+
+def read_capture(path):
+    '''(flags, Records) of the capture file <path>. A record truncated by
+    the end of the file (the capture was not stopped) is left out.
+    '''
+    with open(path, 'rb') as capture:
+        data = capture.read()
+    if len(data) < _FILE_HEADER.size:
+        raise ValueError(f'{path} is not an SSP capture')
+    magic, flags = _FILE_HEADER.unpack_from(data)
+    if magic == MAGIC:
+        record_header = _RECORD_HEADER
+    elif magic == MAGIC_V1:
+        record_header = _RECORD_HEADER_V1
+    else:
+        raise ValueError(f'{path} is not an SSP capture')
+
+    records = []
+    view = memoryview(data)
+    i = _FILE_HEADER.size
+    while i + record_header.size <= len(data):
+        timestamp, kind, address, port, length = \
+            record_header.unpack_from(data, i)
+        i += record_header.size
+        if i + length > len(data):
+            break
+        records.append(
+            Record(timestamp, kind, address, port, bytes(view[i:i + length])),
+        )
+        i += length
+    return flags, records
+
+
+def _unstuff(frame):
+    '''The bytes of a sent frame, without its byte stuffing'''
+    return frame[:1] + frame[1:].replace(b'\x7f\x7f', b'\x7f')
+
+
+class ReplayDevice:
+    '''Stands in for the eSSP of a captured device in the poll handlers.
+    There is no device behind it, see SENDING_EVENTS.
+    '''
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.events = EventBuffer()
+        self.inventory = Inventory()
+        self.profile = None
+
+    def print_debug(self, text):
+        if self.debug:
+            print(text)
+
+    def invalidate_profile(self):
+        self.profile = None
+
+
+def replay(records, flags, debug=False):
+    '''Replay the <records> of a capture made with <flags>, return counters
+    and the time it took.
+
+    The bytes read are framed by SSPDataIn as during the capture, then the
+    polls are decoded and handled by the handlers of eSSP.polls, one
+    ReplayDevice for each port and address. The polls come from the plain
+    replies if the capture has them, from the unencrypted frames otherwise.
+    '''
+    plain = bool(flags & PLAIN)
+    packets = {}
+    commands = {}
+    devices = {}
+    stats = {
+        'records': len(records),
+        'frames': 0,
+        'crc_errors': 0,
+        'encrypted_frames': 0,
+        'polls': 0,
+        'events': 0,
+        'handler_errors': 0,
+    }
+
+    def handle_poll(key, data):
+        device = devices.get(key)
+        if device is None:
+            device = devices[key] = ReplayDevice(debug)
+        stats['polls'] += 1
+        for event in decode_poll(data):
+            stats['events'] += 1
+            if event.event in SENDING_EVENTS:
+                device.events.append(DEFAULT_RECORDS[event.event])
+                if event.event == Status.SSP_POLL_RESET.value:
+                    device.inventory.invalidate()
+                continue
+            try:
+                handle_event(device, event)
+            except Exception:
+                stats['handler_errors'] += 1
+
+    start = time.perf_counter()
+    for record in records:
+        key = (record.port, record.address)
+        kind = record.kind
+        if kind == TX:
+            packet = packets.get(key)
+            if packet is None:
+                packet = packets[key] = SspTxRxPacket()
+            else:
+                stats['crc_errors'] += packet.crcErrors
+            C_LIBRARY.SSPResetRx(byref(packet), record.address)
+            if not plain:
+                frame = _unstuff(record.data)
+                commands[key] = frame[3] if len(frame) > 3 else None
+        elif kind == RX:
+            packet = packets.get(key)
+            if packet is None or packet.NewResponse:
+                continue
+            C_LIBRARY.SSPFeedData(byref(packet), record.data, len(record.data))
+            if not packet.NewResponse:
+                continue
+            stats['frames'] += 1
+            length = packet.rxData[2]
+            if packet.rxData[3] == SSP_STEX:
+                stats['encrypted_frames'] += 1
+            elif not plain and commands.get(key) == SSP_CMD_POLL:
+                handle_poll(key, bytes(packet.rxData[3:3 + length]))
+        elif kind == COMMAND:
+            commands[key] = record.data[0] if record.data else None
+        elif kind == RESPONSE:
+            if commands.get(key) == SSP_CMD_POLL:
+                handle_poll(key, record.data)
+    for packet in packets.values():
+        stats['crc_errors'] += packet.crcErrors
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Replay an SSP capture')
+    parser.add_argument('capture')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    flags, records = read_capture(args.capture)
+    if records:
+        duration = (records[-1].timestamp_ns - records[0].timestamp_ns) / 1e9
+        print(f'{len(records)} records over {duration:.1f} s')
+    seconds = 0
+    for _ in range(args.repeat):
+        stats = replay(records, flags, args.debug)
+        seconds += stats.pop('seconds')
+    print(' '.join(f'{name} {value}' for name, value in stats.items()))
+    if seconds:
+        print(
+            f'{args.repeat * len(records) / seconds:.0f} records/s, '
+            f'{args.repeat * stats["events"] / seconds:.0f} events/s',
+        )
+
+
+if __name__ == '__main__':
+    main()
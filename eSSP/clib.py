@@ -4,16 +4,20 @@ access them.
 from aenum import Enum
 
 from ctypes import (
+    CFUNCTYPE,
     cdll,
     Structure,
     c_ubyte,
     c_uint,
+    c_ushort,
     c_char,
     c_ulong,
     c_ulonglong,
     POINTER,
     c_int,
+    c_long,
     c_char_p,
+    c_void_p,
 )
 import os
 
@@ -21,6 +25,8 @@ import faulthandler
 
 faulthandler.enable()
 
+# cdll releases the GIL for the duration of every call, so validators driven
+# from different threads wait for their replies in parallel.
 C_LIBRARY = cdll.LoadLibrary(
     os.path.join(os.path.dirname(__file__), 'libessp.so'),
 )
@@ -45,6 +51,21 @@ class Ssp6SetupRequestData(Structure):
     ]
 
 
+class Ssp6Level(Structure):
+    _fields_ = [
+        ('level', c_ushort),
+        ('value', c_uint),
+        ('cc', c_char * 4),
+    ]
+
+
+class Ssp6AllLevels(Structure):
+    _fields_ = [
+        ('NumberOfLevels', c_ubyte),
+        ('Levels', Ssp6Level * 20),
+    ]
+
+
 class SspPollEvent6(Structure):
     _fields_ = [
         ('event', c_ubyte),
@@ -90,12 +111,21 @@ class UpdateDeviceResponseEnum(Enum):
     TIMEOUT = 0x07
     BAD_CHECKSUM = 0x08
     DEVICE_DID_NOT_ACK = 0x09
+    IN_PROGRESS = 0x0A
 
     @classmethod
     def from_param(cls, obj):
         return int(obj)
 
 
+class UpdateStage(Enum):
+    STARTING = 0x00
+    RAM_FILE = 0x01
+    MAIN_FILE = 0x02
+    RESTARTING = 0x03
+    DONE = 0x04
+
+
 class SspChannelState(Enum):
     DISABLED = 0x00
     ENABLED = 0x01
@@ -130,9 +160,103 @@ class SspCommand(Structure):
         ('ResponseDataLength', c_ubyte),
         ('ResponseData', c_ubyte * 255),
         ('IgnoreError', c_ubyte),
+        ('Port', c_int),
+        ('Poller', c_void_p),
     ]
 
 
+class SspPollRecord(Structure):
+    _fields_ = [
+        ('sequence', c_ulonglong),
+        ('timestamp_ns', c_ulonglong),
+        ('response', c_ubyte),
+        ('poll', SspPollData6),
+    ]
+
+
+class SspTxRxPacket(Structure):
+    _fields_ = [
+        ('txData', c_ubyte * 255),
+        ('txPtr', c_ubyte),
+        ('rxData', c_ubyte * 255),
+        ('rxPtr', c_ubyte),
+        ('txBufferLength', c_ubyte),
+        ('rxBufferLength', c_ubyte),
+        ('SSPAddress', c_ubyte),
+        ('NewResponse', c_ubyte),
+        ('CheckStuff', c_ubyte),
+        ('rxCrc', c_ushort),
+        ('crcErrors', c_ubyte),
+    ]
+
+
+# Number of round trip histogram buckets, the upper bounds in microseconds
+# of all but the last are in SSP_STATS_BUCKET_US
+SSP_STATS_BUCKETS = 12
+
+
+class SspCommandStats(Structure):
+    _fields_ = [
+        ('count', c_uint),
+        ('timeouts', c_uint),
+        ('retries', c_uint),
+        ('max_us', c_uint),
+        ('total_us', c_ulonglong),
+        ('buckets', c_uint * SSP_STATS_BUCKETS),
+    ]
+
+
+class SspStats(Structure):
+    _fields_ = [
+        ('bytes_sent', c_ulonglong),
+        ('bytes_received', c_ulonglong),
+        ('crc_errors', c_uint),
+        ('counter_mismatches', c_uint),
+        ('packet_errors', c_uint),
+        ('port_errors', c_uint),
+        ('negotiations', c_uint),
+        ('negotiation_failures', c_uint),
+        ('precomputed_keys', c_uint),
+        ('negotiation_last_us', c_uint),
+        ('negotiation_max_us', c_uint),
+        ('negotiation_total_us', c_ulonglong),
+        ('commands', SspCommandStats * 256),
+    ]
+
+
+SSP_STATS_BUCKET_US = tuple(
+    (c_ulong * (SSP_STATS_BUCKETS - 1)).in_dll(
+        C_LIBRARY,
+        'SSP_STATS_BUCKET_US',
+    ),
+)
+
+
+class SspPollerStats(Structure):
+    _fields_ = [
+        ('polls', c_ulonglong),
+        ('late_polls', c_ulonglong),
+        ('max_late_ns', c_ulonglong),
+        ('dropped', c_ulonglong),
+        ('commands', c_ulonglong),
+    ]
+
+
+class SspUpdateStatus(Structure):
+    _fields_ = [
+        ('stage', c_ubyte),
+        ('response', c_ubyte),
+        ('blocks_sent', c_uint),
+        ('blocks_total', c_uint),
+        ('bytes_sent', c_ulonglong),
+        ('bytes_total', c_ulonglong),
+        ('elapsed_us', c_ulonglong),
+    ]
+
+
+# Called from the update thread of libessp, ctypes takes the GIL for it
+UpdateProgressCallback = CFUNCTYPE(None, POINTER(SspUpdateStatus), c_void_p)
+
 
 def define_function(name, restype, *argtypes):
     getattr(C_LIBRARY, name).restype = restype
@@ -142,13 +266,47 @@ def define_function(name, restype, *argtypes):
 CommandPointer = POINTER(SspCommand)
 PollDataPointer = POINTER(SspPollData6)
 SetupRequestDataPointer = POINTER(Ssp6SetupRequestData)
+AllLevelsPointer = POINTER(Ssp6AllLevels)
 
-define_function('close_ssp_port', None)
+define_function('close_ssp_port', None, CommandPointer)
+# The SSP_POLLER is opaque, kept as a c_void_p
+define_function('ssp_poller_start', c_void_p, CommandPointer, c_ulong)
+define_function('ssp_poller_stop', None, c_void_p)
+define_function('ssp_poller_set_interval', None, c_void_p, c_ulong)
+define_function(
+    'ssp_poller_read',
+    c_int,
+    c_void_p,
+    POINTER(SspPollRecord),
+    c_int,
+)
+define_function('ssp_poller_wait', c_int, c_void_p, c_ulong)
+define_function('ssp_poller_wake', None, c_void_p)
+define_function('ssp_poller_stats', None, c_void_p, POINTER(SspPollerStats))
+define_function('set_ssp_write_pacing', c_int, CommandPointer, c_ulong)
+define_function('set_ssp_port_baud', c_int, CommandPointer, c_ulong)
+define_function('ssp_get_stats', c_int, CommandPointer, POINTER(SspStats))
+define_function('ssp_capture_start', c_int, c_char_p, c_uint)
+define_function('ssp_capture_stop', None)
+define_function('SSPResetRx', None, POINTER(SspTxRxPacket), c_ubyte)
+define_function(
+    'SSPFeedData',
+    c_int,
+    POINTER(SspTxRxPacket),
+    c_char_p,
+    c_int,
+)
 define_function('ssp6_disable', SspResponseEnum, CommandPointer)
 define_function('ssp6_disable_payout', SspResponseEnum, CommandPointer)
 define_function('ssp6_empty', SspResponseEnum, CommandPointer, c_char)
 define_function('ssp6_enable', SspResponseEnum, CommandPointer)
 define_function('ssp6_enable_payout', SspResponseEnum, CommandPointer, c_char)
+define_function(
+    'ssp6_get_all_levels',
+    SspResponseEnum,
+    CommandPointer,
+    AllLevelsPointer,
+)
 define_function(
     'ssp6_get_note_amount',
     SspResponseEnum,
@@ -177,6 +335,7 @@ define_function(
     CommandPointer,
     PollDataPointer,
 )
+define_function('ssp6_poll_raw', SspResponseEnum, CommandPointer)
 define_function('ssp6_reject', SspResponseEnum, CommandPointer)
 define_function('ssp6_reset', SspResponseEnum, CommandPointer)
 define_function('ssp6_run_calibration', SspResponseEnum, CommandPointer)
@@ -203,6 +362,13 @@ define_function(
     c_char_p,
     c_char,
 )
+define_function(
+    'ssp6_set_baud_rate',
+    SspResponseEnum,
+    CommandPointer,
+    c_ulong,
+    c_ubyte,
+)
 define_function(
     'ssp6_setup_encryption',
     SspResponseEnum,
@@ -218,6 +384,7 @@ define_function(
 define_function('ssp6_stack_note', SspResponseEnum, CommandPointer)
 define_function('ssp6_sync', SspResponseEnum, CommandPointer)
 define_function('ssp_init', CommandPointer, c_char_p, c_char_p, c_int)
+define_function('ssp_init_address', CommandPointer, CommandPointer, c_char_p)
 define_function(
     'update_device',
     UpdateDeviceResponseEnum,
@@ -225,3 +392,21 @@ define_function(
     c_char_p,
     c_char_p,
 )
+# The ESSP_UPDATE is opaque, kept as a c_void_p
+define_function(
+    'update_device_start',
+    c_void_p,
+    c_char_p,
+    c_char_p,
+    c_char_p,
+    UpdateProgressCallback,
+    c_void_p,
+)
+define_function(
+    'update_device_status',
+    None,
+    c_void_p,
+    POINTER(SspUpdateStatus),
+)
+define_function('update_device_wait', c_int, c_void_p, c_long)
+define_function('update_device_free', None, c_void_p)
@@ -93,3 +93,27 @@ class FailureStatus(Enum):
 
     def __ne__(self, other):
         return self.value != other
+
+
+class PayoutError(Enum):
+    '''Reason of a refused payout, the byte following COMMAND_NOT_PROCESSED.
+    The SMART_PAYOUT_* values of Status are aliases of ENABLED and DISABLED.
+    '''
+    _init_ = 'value', 'debug_message'
+
+    NOT_ENOUGH = 0x01, 'Not enough value in smart payout'
+    EXACT_AMOUNT = 0x02, 'Can''t pay exact amount'
+    BUSY = 0x03, 'Smart payout is busy'
+    DISABLED = 0x04, 'Smart payout is disabled'
+
+    def __int__(self):
+        return self.value
+
+    def __str__(self):
+        return self.debug_message
+
+    def __eq__(self, other):
+        return self.value == other
+
+    def __ne__(self, other):
+        return self.value != other
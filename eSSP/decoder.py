@@ -0,0 +1,142 @@
+'''Decoder of the poll responses, reading the response bytes in place.
+
+Same layout and limits as ssp6_decode_poll, without the copy into an
+SspPollData6:
+
+    view = memoryview(essp.sspC.contents.ResponseData).cast('B')
+    events = decode_poll(view, essp.sspC.contents.ResponseDataLength)
+'''
+import struct
+from collections import namedtuple
+
+from .constants import Status
+
+# Same attributes as SspPollEvent6, so the handlers take either
+PollEvent = namedtuple('PollEvent', 'event data1 data2 cc')
+
+# Number of events an SspPollData6 holds
+MAX_EVENTS = 20
+
+# Events followed by one data byte
+CHANNEL_EVENTS = frozenset(status.value for status in (
+    Status.SSP_POLL_CREDIT,
+    Status.SSP_POLL_READ,
+    Status.SSP_POLL_CLEARED_FROM_FRONT,
+    Status.SSP_POLL_CLEARED_INTO_CASHBOX,
+    Status.SSP_POLL_CALIBRATION_FAIL,
+))
+
+# Events followed by a number of countries and, for each, a value (4 bytes
+# LE) and a country code (3 bytes)
+VALUE_EVENTS = frozenset(status.value for status in (
+    Status.SSP_POLL_DISPENSING,
+    Status.SSP_POLL_DISPENSED,
+    Status.SSP_POLL_JAMMED,
+    Status.SSP_POLL_HALTED,
+    Status.SSP_POLL_FLOATING,
+    Status.SSP_POLL_FLOATED,
+    Status.SSP_POLL_TIMEOUT,
+    Status.SSP_POLL_CASHBOX_PAID,
+    Status.SSP_POLL_COIN_CREDIT,
+    Status.SSP_POLL_SMART_EMPTYING,
+    Status.SSP_POLL_SMART_EMPTIED,
+    Status.SSP_POLL_FRAUD_ATTEMPT,
+))
+
+# Same with two values: paid and requested
+TWO_VALUE_EVENTS = frozenset(status.value for status in (
+    Status.SSP_POLL_INCOMPLETE_PAYOUT,
+    Status.SSP_POLL_INCOMPLETE_FLOAT,
+))
+
+_VALUE = struct.Struct('<I3s')
+_TWO_VALUES = struct.Struct('<II3s')
+_VALUE_SIZE = _VALUE.size
+
+# Kinds of event, by event code, the others are a single byte
+_CHANNEL_KIND = 1
+_VALUE_KIND = 2
+_TWO_VALUES_KIND = 3
+_KINDS = dict(
+    [(event, _CHANNEL_KIND) for event in CHANNEL_EVENTS]
+    + [(event, _VALUE_KIND) for event in VALUE_EVENTS]
+    + [(event, _TWO_VALUES_KIND) for event in TWO_VALUE_EVENTS]
+)
+
+# The PollEvents are immutable: those of the single byte and channel events
+# are made once, by code and by code << 8 | channel
+_SINGLE_EVENTS = tuple(PollEvent(event, 0, 0, b'') for event in range(256))
+_CHANNEL_EVENTS = {
+    event << 8 | channel: PollEvent(event, channel, 0, b'')
+    for event in CHANNEL_EVENTS
+    for channel in range(256)
+}
+# The PollEvents of the one value events seen lately, by (event, the 7
+# bytes of the value): a dispensing is reported with the same value by
+# every poll of a payout
+_VALUE_EVENTS = {}
+_VALUE_EVENTS_SIZE = 1024
+
+
+def decode_poll(data, length=None, max_events=MAX_EVENTS):
+    '''PollEvents of the poll response <data> (bytes, or a memoryview of
+    format 'B'), ResponseData[0] being the status. Only the first
+    <length> bytes are read.
+
+    An event followed by several countries gives one PollEvent per country.
+    Decoding stops at an event truncated by the end of the response, or
+    after <max_events> events.
+    '''
+    if length is None:
+        length = len(data)
+    events = []
+    append = events.append
+    kinds = _KINDS
+    value_events = _VALUE_EVENTS
+    i = 1
+    while i < length and len(events) < max_events:
+        event = data[i]
+        i += 1
+        kind = kinds.get(event)
+        if kind is None:
+            append(_SINGLE_EVENTS[event])
+            continue
+        if i >= length:
+            break
+        if kind == _CHANNEL_KIND:
+            append(_CHANNEL_EVENTS[event << 8 | data[i]])
+            i += 1
+            continue
+
+        countries = data[i]
+        i += 1
+        if not countries:
+            append(_SINGLE_EVENTS[event])
+            continue
+        if kind == _VALUE_KIND:
+            for _ in range(countries):
+                if i + _VALUE_SIZE > length or len(events) >= max_events:
+                    return events
+                key = event, bytes(data[i:i + _VALUE_SIZE])
+                decoded = value_events.get(key)
+                if decoded is None:
+                    data1, cc = _VALUE.unpack(key[1])
+                    decoded = PollEvent(
+                        event,
+                        data1,
+                        0,
+                        cc.partition(b'\0')[0],
+                    )
+                    if len(value_events) >= _VALUE_EVENTS_SIZE:
+                        value_events.clear()
+                    value_events[key] = decoded
+                append(decoded)
+                i += _VALUE_SIZE
+            continue
+        for _ in range(countries):
+            if i + _TWO_VALUES.size > length or len(events) >= max_events:
+                return events
+            data1, data2, cc = _TWO_VALUES.unpack_from(data, i)
+            append(PollEvent(event, data1, data2, cc.partition(b'\0')[0]))
+            i += _TWO_VALUES.size
+    return events
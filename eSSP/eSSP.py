@@ -1,57 +1,139 @@
 # !/usr/bin/env python3
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from ctypes import (
     cdll,
     c_ulonglong,
     byref,
 )
-from time import sleep
 
 from six.moves import queue
 
 from . import C_LIBRARY
 from . import actions
 from .clib import (
+    Ssp6AllLevels,
     Ssp6ChannelData,
     Ssp6SetupRequestData,
-    SspPollEvent6,
-    SspPollData6,
-    SspResponseEnum
+    SspPollerStats,
+    SspPollRecord,
+    SspResponseEnum,
+    SspStats,
 )
 from .constants import Status, FailureStatus
+from .decoder import PollEvent, decode_poll
+from .events import EventBuffer, Subscription
+from .inventory import Inventory
 from .polls import handle_event
+from .profile import DeviceProfile, ProfileStore
+from .scheduler import PollScheduler
+from .update import FirmwareUpdate
 
 
 class eSSP:
     '''Encrypted Smiley Secure Protocol Class'''
 
-    def __init__(self, com_port, ssp_address='0', nv11=False, debug=False):
+    def __init__(
+            self,
+            com_port,
+            ssp_address='0',
+            nv11=False,
+            debug=False,
+            write_pacing=0,
+            start=True,
+            scheduler=None,
+            bus=None,
+            event_capacity=1024,
+            action_budget=0.5,
+            native_poller=False,
+            profile_store=None,
+            baud_rate=None,
+    ):
+        '''<write_pacing> is a pause in microseconds after every frame sent,
+        only needed by devices that cannot take back to back frames.
+        With <start> False the poll thread is not started, the owner must
+        then call poll_once regularly (see eSSP.aio).
+        <scheduler> is the PollScheduler setting the poll cadence.
+        <bus> is the eSSP.bus.Bus the validator shares its port with,
+        com_port is then ignored; use Bus.add rather than passing it here.
+        The <event_capacity> newest events are kept until they are read.
+        Queued actions stop being started <action_budget> seconds after the
+        poll, the others wait for the next poll.
+        With <native_poller> the polls are sent by a C thread of libessp,
+        on time even while Python holds the GIL; the Python thread only
+        handles their events and runs the actions (see poller_stats).
+        <profile_store> is a ProfileStore (see eSSP.profile) for a warm
+        start: the saved profile of the device is used instead of sending
+        the setup request and reading the levels before the validator is
+        enabled. Both are then done from the poll thread, a firmware other
+        than the saved one replaces the saved profile. The inhibits and the
+        payout enable are not sent again while the device was not reset
+        since they were saved. The start is timed in self.startup.
+        With <baud_rate> (38400 or 115200) the device and the port are
+        switched to that rate after the sync, see set_baud_rate. Not on a
+        bus.
+        '''
+        started = time.perf_counter()
         self.debug = debug
+        self.scheduler = scheduler or PollScheduler()
         self.nv11 = nv11
-        self.actions = queue.Queue()
+        self.actions = actions.ActionQueue(action_budget)
         self.response_data = {}
-        self.events = []
+        self.events = EventBuffer(event_capacity)
+        self.subscriptions = []
+        self.inventory = Inventory()
+        self.bus = bus
+        self.closed = False
+        self.native_poller = native_poller
+        # The SSP_POLLER while the native poller runs, freed under the lock
+        self.poller = None
+        self._poller_lock = threading.Lock()
+        self._loop_thread = None
 
         # There can't be 9999 notes in the storage
         self.response_data['getnoteamount_response'] = 9999
-        self.sspC = C_LIBRARY.ssp_init(
-            com_port.encode(),
-            ssp_address.encode(),
-            debug,
-        )
+        if bus is None:
+            self.sspC = C_LIBRARY.ssp_init(
+                com_port.encode(),
+                ssp_address.encode(),
+                debug,
+            )
+        else:
+            self.sspC = C_LIBRARY.ssp_init_address(
+                bus.sspC,
+                ssp_address.encode(),
+            )
         if not self.sspC:
             exit(-1)
-
-        self.poll = SspPollData6()
-        setup_req = Ssp6SetupRequestData()
+        if write_pacing:
+            C_LIBRARY.set_ssp_write_pacing(self.sspC, write_pacing)
+
+        # The poll responses are decoded in place
+        self._command = self.sspC.contents
+        self._response = memoryview(self._command.ResponseData).cast('B')
+        self.poll_events = []
+        self._profile = None
+        self.profile_store = profile_store
+        if bus is not None:
+            com_port = bus.com_port
+        self.profile_key = ProfileStore.key(com_port, ssp_address)
+        stored = profile_store.get(self.profile_key) if profile_store else None
+        self.baud_rate = 9600
+        # The saved configuration the warm start did not send again, and
+        # whether the first poll is handled
+        self.skipped_configuration = None
+        self.polled = False
 
         # Check if the validator is present
-        if C_LIBRARY.ssp6_sync(self.sspC) != SspResponseEnum.SSP_RESPONSE_OK:
+        if not self._sync():
             self.print_debug('No validator found')
             self.close()
             raise Exception('No validator found')
         else:
             self.print_debug('Validator found!')
+        if baud_rate is not None and bus is None:
+            self.set_baud_rate(baud_rate)
 
         # Try to setup encryption
         if C_LIBRARY.ssp6_setup_encryption(
@@ -63,29 +145,32 @@ class eSSP:
             self.print_debug('Encryption failed')
 
         # Checking the version, make sure we are using ssp version 6
-        if (C_LIBRARY.ssp6_host_protocol(self.sspC, 0x06)
-                != SspResponseEnum.SSP_RESPONSE_OK):
-            self.print_debug(
-                C_LIBRARY.ssp6_host_protocol(self.sspC, 0x06),
-            )
+        response = C_LIBRARY.ssp6_host_protocol(self.sspC, 0x06)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
+            self.print_debug(response)
             self.print_debug('Host protocol failed')
             self.close()
             raise Exception('Host protocol failed')
 
-        # Get some information about the validator
-        if (C_LIBRARY.ssp6_setup_request(self.sspC, byref(setup_req))
-                != SspResponseEnum.SSP_RESPONSE_OK):
-            self.print_debug('Setup request failed')
-            self.close()
-            raise Exception('Setup request failed')
+        if stored is None:
+            # Get some information about the validator
+            profile = self.refresh_profile()
+            if profile is None:
+                self.close()
+                raise Exception('Setup request failed')
+            if profile_store is not None:
+                profile_store.put(self.profile_key, profile)
+        else:
+            profile, _entry = stored
+            self._profile = profile
+            # Sent first by the poll thread, before any other action
+            self.queue_action(actions.ValidateProfile())
 
-        self.print_debug(
-            f'Firmware {setup_req.FirmwareVersion.decode("utf8")}',
-        )
+        self.print_debug(f'Firmware {profile.firmware_version}')
         self.print_debug('Channels:')
-        for i, channel in enumerate(setup_req.ChannelData):
+        for i, channel in enumerate(profile.channels):
             self.print_debug(
-                f'Channel {i + 1}: {channel.value} {channel.cc.decode()}',
+                f'Channel {i + 1}: {channel.value} {channel.currency}',
             )
 
         # Enable the validator
@@ -95,22 +180,30 @@ class eSSP:
             self.close()
             raise Exception('Enable failed')
 
-        if setup_req.UnitType == 0x03:  # magic number
-            for channel in enumerate(setup_req.ChannelData):
+        configuration = _configuration(profile)
+        if (stored is not None
+                and stored[1].get('configuration') == configuration):
+            # The device keeps the inhibits and the payout enabled until it
+            # is reset, a reset reported by the first poll sends them again
+            self.print_debug('Configuration unchanged')
+            self.skipped_configuration = configuration
+        elif profile.is_smart_hopper:
+            for channel in profile.channels:
                 C_LIBRARY.ssp6_set_coinmech_inhibits(
                     self.sspC,
                     channel.value,
-                    channel.cc,
+                    channel.currency.encode(),
                     Status.ENABLED,
                 )
         else:
-            if setup_req.UnitType in {0x06, 0x07}:
+            if profile.has_payout:
                 # Enable the payout unit
                 if C_LIBRARY.ssp6_enable_payout(
                             self.sspC,
-                            setup_req.UnitType,
+                            profile.unit_type,
                         ) != SspResponseEnum.SSP_RESPONSE_OK:
                     self.print_debug('Payout enable failed')
+                    configuration = None
 
             # Set the inhibits (enable all note acceptance)
             if (C_LIBRARY.ssp6_set_inhibits(self.sspC, 0xFF, 0xFF)
@@ -118,15 +211,139 @@ class eSSP:
                 self.print_debug('Inhibits failed')
                 self.close()
                 raise Exception('Inhibits failed')
-
-        system_loop_thread = threading.Thread(target=self.system_loop)
+        if profile_store is not None and self.skipped_configuration is None:
+            profile_store.set_configuration(self.profile_key, configuration)
+
+        if not (profile.has_payout or profile.is_smart_hopper):
+            self.inventory.supported = False
+        elif stored is None:
+            self.refresh_inventory()
+        # else read by the poll thread, as inventory.synced is False
+
+        self.startup = {
+            'mode': 'cold' if stored is None else 'warm',
+            'seconds': time.perf_counter() - started,
+        }
+
+        if start:
+            self.start()
+
+    def start(self):
+        '''Start the thread polling the validator'''
+        target = self.system_loop
+        if self.native_poller:
+            self.poller = C_LIBRARY.ssp_poller_start(
+                self.sspC,
+                int(self.scheduler.interval * 1e6),
+            )
+            if not self.poller:
+                raise Exception('Poller start failed')
+            target = self.native_loop
+        system_loop_thread = threading.Thread(target=target)
         system_loop_thread.setDaemon(True)
+        self._loop_thread = system_loop_thread
         system_loop_thread.start()
 
     def close(self):
-        '''Close the connection'''
+        '''Close the connection, the port of a bus is closed by the bus.
+        The actions still queued are cancelled.
+        '''
+        self.closed = True
+        while not self.actions.empty():
+            self.actions.get().future.cancel()
+        if self.poller:
+            self._stop_poller()
         self.reject()
-        C_LIBRARY.close_ssp_port()
+        if self.bus is None:
+            C_LIBRARY.close_ssp_port(self.sspC)
+
+    def _stop_poller(self):
+        '''Stop the native poller once native_loop no longer waits on it'''
+        with self._poller_lock:
+            if self.poller:
+                C_LIBRARY.ssp_poller_wake(self.poller)
+        loop = self._loop_thread
+        if loop is not None and loop is not threading.current_thread():
+            loop.join()
+        with self._poller_lock:
+            poller, self.poller = self.poller, None
+            if poller:
+                C_LIBRARY.ssp_poller_stop(poller)
+
+    def _sync(self):
+        '''Send a sync, first at the rate the profile_store last set the
+        device to (it may not have been reset since), then at 9600 baud.
+        Return True once it answered.
+        '''
+        rate = 9600
+        if self.profile_store is not None and self.bus is None:
+            rate, _failed = self.profile_store.baud_rate(self.profile_key)
+        if rate != 9600 and C_LIBRARY.set_ssp_port_baud(self.sspC, rate):
+            if (C_LIBRARY.ssp6_sync(self.sspC)
+                    == SspResponseEnum.SSP_RESPONSE_OK):
+                self.baud_rate = rate
+                return True
+            C_LIBRARY.set_ssp_port_baud(self.sspC, 9600)
+            self.profile_store.set_baud_rate(self.profile_key, 9600)
+        return (C_LIBRARY.ssp6_sync(self.sspC)
+                == SspResponseEnum.SSP_RESPONSE_OK)
+
+    def set_baud_rate(self, rate, persist=False):
+        '''Switch the device and the port to <rate> baud (9600, 38400 or
+        115200) and check the link with a sync, before the poll thread is
+        started. The port goes back to 9600 baud if the device is not heard
+        at the new rate. With <persist> the device keeps the rate after a
+        reset. The rate is saved in the profile_store, a rate that failed
+        is not tried again. Return the SspResponseEnum.
+        '''
+        if rate == self.baud_rate:
+            return SspResponseEnum.SSP_RESPONSE_OK
+        if self.profile_store is not None:
+            _current, failed = self.profile_store.baud_rate(self.profile_key)
+            if rate in failed:
+                self.print_debug(f'{rate} baud failed before, not tried')
+                return SspResponseEnum.SSP_RESPONSE_COMMAND_NOT_PROCESSED
+        response = C_LIBRARY.ssp6_set_baud_rate(
+            self.sspC,
+            rate,
+            int(persist),
+        )
+        if response == SspResponseEnum.SSP_RESPONSE_OK:
+            self.print_debug(f'Baud rate {rate}')
+            self.baud_rate = rate
+            failed = None
+        else:
+            self.print_debug(f'Baud rate {rate} failed: {response}')
+            if response == SspResponseEnum.SSP_RESPONSE_TIMEOUT:
+                # The port is back at 9600 baud
+                self.baud_rate = 9600
+            failed = rate
+        if self.profile_store is not None:
+            self.profile_store.set_baud_rate(
+                self.profile_key,
+                self.baud_rate,
+                failed,
+            )
+        return response
+
+    def fall_back_baud_rate(self):
+        '''After a timeout at a higher rate: a reset may have taken the
+        device back to 9600 baud. Return True if it answers at 9600 baud,
+        the port then stays at that rate.
+        '''
+        if self.baud_rate == 9600 or self.bus is not None:
+            return False
+        C_LIBRARY.set_ssp_port_baud(self.sspC, 9600)
+        # An encrypted sync is answered with key not set
+        if (C_LIBRARY.ssp6_sync(self.sspC)
+                == SspResponseEnum.SSP_RESPONSE_TIMEOUT):
+            C_LIBRARY.set_ssp_port_baud(self.sspC, self.baud_rate)
+            return False
+        self.print_debug('Back to 9600 baud')
+        self.baud_rate = 9600
+        if self.profile_store is not None:
+            self.profile_store.set_baud_rate(self.profile_key, 9600)
+        return True
 
     def reject(self):
         '''Reject the bill if there is one'''
@@ -134,87 +351,304 @@ class eSSP:
             self.print_debug('Error to reject bill OR nothing to reject')
 
     def do_actions(self):
+        '''Run the queued actions, by priority, until the budget of the
+        queue is spent (at least one runs)
+        '''
+        deadline = time.monotonic() + self.actions.budget
         while not self.actions.empty():
             action = self.actions.get()
             self.print_debug(action.debug_message)
             action(self)
+            if time.monotonic() >= deadline and not self.actions.empty():
+                self.actions.over_budget += 1
+                break
 
     def print_debug(self, text):
         if self.debug:
             print(text)
 
-    def enable_validator(self):
-        '''Enable the validator'''
+    @property
+    def profile(self):
+        '''The DeviceProfile from the setup request, sent again only after
+        a reset or refresh_profile. None if the device did not answer it.
+        '''
+        if self._profile is None:
+            return self.refresh_profile()
+        return self._profile
+
+    def refresh_profile(self):
+        '''Send a setup request and cache the DeviceProfile it returns'''
         setup_req = Ssp6SetupRequestData()
-        if C_LIBRARY.ssp6_enable(self.sspC) != SspResponseEnum.SSP_RESPONSE_OK:
-            self.print_debug('ERROR: Enable failed')
-            return
-        # SMART Hopper requires different inhibit commands, so use setup
-        # request to see if it is an SH
         if (C_LIBRARY.ssp6_setup_request(self.sspC, byref(setup_req))
                 != SspResponseEnum.SSP_RESPONSE_OK):
             self.print_debug('Setup request failed')
-            return
-        if setup_req.UnitType == 0x03:  # Magic number
-            # SMART Hopper requires different inhibit commands
-            for channel in setup_req.ChannelData:
-                C_LIBRARY.ssp6_set_coinmech_inhibits(
-                    self.sspC,
-                    channel.value,
-                    channel.cc,
-                    Status.ENABLED,
-                )
+            return None
+        self._profile = DeviceProfile.from_setup_request(setup_req)
+        return self._profile
+
+    def set_profile(self, profile):
+        '''Replace the profile, and the saved one if it differs. For the
+        poll thread.
+        '''
+        self._profile = profile
+        if self.profile_store is not None:
+            stored = self.profile_store.get(self.profile_key)
+            if stored is None or stored[0] != profile:
+                self.profile_store.put(self.profile_key, profile)
+
+    @property
+    def routes(self):
+        '''{'<amount in cents> <currency>': 'storage' or 'cashbox'} of the
+        routes set through this library on the current firmware, as saved
+        in the profile_store. The device keeps them, there is no need to
+        set them again. Empty without a profile_store.
+        '''
+        if self.profile_store is None:
+            return {}
+        stored = self.profile_store.get(self.profile_key)
+        if stored is None:
+            return {}
+        return dict(stored[1].get('routes', {}))
+
+    def remember_route(self, amount, currency, route):
+        '''Save the <route> set for <amount> (in cents) <currency>'''
+        if self.profile_store is not None:
+            self.profile_store.set_route(
+                self.profile_key,
+                amount,
+                currency,
+                route,
+            )
+
+    def invalidate_profile(self):
+        '''Forget the profile, the next use sends a setup request'''
+        self._profile = None
+
+    def refresh_inventory(self):
+        '''Send a get all levels and load its answer in self.inventory.
+        Only for the poll thread, get_all_levels queues it.
+        '''
+        all_levels = Ssp6AllLevels()
+        response = C_LIBRARY.ssp6_get_all_levels(self.sspC, byref(all_levels))
+        if response == SspResponseEnum.SSP_RESPONSE_OK:
+            self.inventory.load(all_levels)
+        elif response in (
+                SspResponseEnum.SSP_RESPONSE_UNKNOWN_COMMAND,
+                SspResponseEnum.SSP_RESPONSE_COMMAND_NOT_PROCESSED,
+        ):
+            self.print_debug('Get all levels not supported')
+            self.inventory.supported = False
         else:
-            if (C_LIBRARY.ssp6_set_inhibits(self.sspC, 0xFF, 0xFF)
-                    != SspResponseEnum.SSP_RESPONSE_OK):  # Magic numbers here
-                self.print_debug('Inhibits failed')
+            self.print_debug('Get all levels failed')
+        return response
 
-    def parse_poll(self):
-        '''Parse the poll, for getting events'''
-        for event in self.poll.events:
-            handle_event(self, event)
-        self.events.append((0, 0, Status.NO_EVENT))
+    def get_all_levels(self):
+        '''Read the levels of the payout again, the payload of the result
+        is the {(value, currency): count} levels. self.inventory usually
+        holds them already.
+        '''
+        return self.queue_action(actions.GetAllLevels())
+
+    def enable_validator(self):
+        '''Enable the validator'''
+        return self.queue_action(actions.EnableValidator())
+
+    def parse_poll(self, events=None):
+        '''Parse the poll, for getting events. The PollEvents are decoded
+        from the response buffer unless given in <events>.
+        '''
+        if events is None:
+            events = decode_poll(
+                self._response,
+                self._command.ResponseDataLength,
+            )
+        self.poll_events = events
+        recorded = [handle_event(self, event) for event in self.poll_events]
+        for subscription in self.subscriptions:
+            for event in recorded:
+                if subscription.wants(event):
+                    subscription.deliver(event)
+        if not self.inventory.synced and self.inventory.supported:
+            # A reset or an event the cache could not account for
+            self.queue_action(actions.GetAllLevels())
+        self.polled = True
+
+    def device_reset(self):
+        '''After a reset reported by a poll: the device lost its inhibits
+        and payout enable. Reported by the first poll, the reset came
+        before the start, which must then send the configuration it
+        skipped. Later, the saved configuration no longer holds.
+        '''
+        if not self.polled:
+            skipped = self.skipped_configuration
+            if skipped is not None:
+                self.print_debug('Reset before the start, configuring')
+                self.queue_action(actions.EnableValidator())
+                if skipped.get('payout'):
+                    self.queue_action(actions.EnablePayout())
+        elif self.profile_store is not None:
+            self.profile_store.set_configuration(self.profile_key, None)
+
+    def poll_once(self):
+        '''Poll the validator once and handle the events of its answer.
+        Return False if the validator did not answer.
+        '''
+        response = C_LIBRARY.ssp6_poll_raw(self.sspC)
+        if response != SspResponseEnum.SSP_RESPONSE_OK:
+            return self._poll_error(response)
+        self.parse_poll()
+        return True
+
+    def _poll_error(self, response):
+        '''Handle a poll answered with <response>, not OK. Return False if
+        the validator did not answer.
+        '''
+        if response == SspResponseEnum.SSP_RESPONSE_TIMEOUT:
+            self.print_debug('SSP poll timeout')
+            return self.fall_back_baud_rate()
+        elif response == SspResponseEnum.SSP_RESPONSE_KEY_NOT_SET:
+            # The self has responded with key not set, so we should
+            # try to negotiate one
+            if C_LIBRARY.ssp6_setup_encryption(
+                        self.sspC,
+                        c_ulonglong(0x123456701234567),
+                    ) == SspResponseEnum.SSP_RESPONSE_OK:
+                self.print_debug('Encryption setup')
+            else:
+                self.print_debug('Encryption failed')
+            # The response buffer now holds the key exchange
+            self.poll_events = []
+            return True
+        else:
+            # Not theses two, stop the program
+            raise Exception(f'SSP poll error {response}')
 
     def system_loop(self):
         '''Looping to get the alive signal (mandatory in eSSP6)'''
-        while True:
-            response = C_LIBRARY.ssp6_poll(
-                self.sspC,
-                byref(self.poll),
+        while not self.closed:
+            if not self.poll_once():
+                self.close()
+                exit(0)
+            self.do_actions()
+            self.scheduler.update(
+                self.poll_statuses(),
+                not self.actions.empty(),
             )
-            if response != SspResponseEnum.SSP_RESPONSE_OK:
-                if response == SspResponseEnum.SSP_RESPONSE_TIMEOUT:
-                    self.print_debug('SSP poll timeout')
-                    self.close()
-                    exit(0)
-                elif response == SspResponseEnum.SSP_RESPONSE_KEY_NOT_SET:
-                    # The self has responded with key not set, so we should
-                    # try to negotiate one
-                    if C_LIBRARY.ssp6_setup_encryption(
-                                self.sspC,
-                                c_ulonglong(0x123456701234567),
-                            ) == SspResponseEnum.SSP_RESPONSE_OK:
-                        self.print_debug('Encryption setup')
-                    else:
-                        self.print_debug('Encryption failed')
-                else:
-                    # Not theses two, stop the program
-                    raise Exception(f'SSP poll error {response}')
-            self.parse_poll()
+            self.scheduler.wait()
+
+    def native_loop(self):
+        '''Handle the polls sent by the native poller, run the actions and
+        pass it the interval chosen by the scheduler
+        '''
+        records = (SspPollRecord * 16)()
+        # Only close frees the poller, after this loop has ended
+        poller = self.poller
+        while not self.closed:
+            C_LIBRARY.ssp_poller_wait(poller, 1000)
+            count = C_LIBRARY.ssp_poller_read(poller, records, len(records))
+            for record in records[:count]:
+                if record.response != SspResponseEnum.SSP_RESPONSE_OK.value:
+                    if not self._poll_error(
+                            SspResponseEnum(record.response)):
+                        self.close()
+                        return
+                    continue
+                poll = record.poll
+                self.parse_poll([
+                    PollEvent(event.event, event.data1, event.data2, event.cc)
+                    for event in poll.events[:poll.event_count]
+                ])
+            if self.closed:
+                break
             self.do_actions()
-            sleep(0.5)
+            interval = self.scheduler.update(
+                self.poll_statuses(),
+                not self.actions.empty(),
+            )
+            C_LIBRARY.ssp_poller_set_interval(poller, int(interval * 1e6))
+
+    def poller_stats(self):
+        '''Counters of the native poller: polls sent, late_polls (sent more
+        than 5 ms after their due time), max_late_ns, dropped (polls the
+        Python thread did not read in time) and commands. None without it.
+        '''
+        stats = SspPollerStats()
+        with self._poller_lock:
+            if not self.poller:
+                return None
+            C_LIBRARY.ssp_poller_stats(self.poller, byref(stats))
+        return {name: getattr(stats, name) for name, _ in stats._fields_}
+
+    def link_stats(self):
+        '''Snapshot of the link statistics kept by libessp for this device,
+        an SspStats: bytes, bad frames and, in commands[code], the round
+        trips, retries and timeouts of every command code. None before the
+        first command. See eSSP.metrics to export them.
+        '''
+        stats = SspStats()
+        if not C_LIBRARY.ssp_get_stats(self.sspC, byref(stats)):
+            return None
+        return stats
+
+    def poll_statuses(self):
+        '''Statuses reported by the last poll'''
+        return [event.event for event in self.poll_events]
+
+    def queue_action(self, action):
+        '''Queue <action> and wake the poll thread to run it. Return the
+        future of its (SspResponseEnum, payload) result.
+        '''
+        self.actions.put(action)
+        self.scheduler.wake()
+        if self.poller:
+            with self._poller_lock:
+                if self.poller:
+                    C_LIBRARY.ssp_poller_wake(self.poller)
+        return action.future
+
+    def subscribe(self, target, statuses=None, executor=None):
+        '''Deliver the events of <statuses> (all by default) to <target>, a
+        callback taking the (amount, currency, event) tuple or a queue,
+        right after each poll. Slow callbacks should be given an
+        <executor> so that they do not delay the next poll.
+        Return the Subscription, to pass to unsubscribe.
+        '''
+        subscription = Subscription(target, statuses, executor)
+        # replaced rather than modified, parse_poll may be iterating it
+        self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions = [
+            other for other in self.subscriptions if other is not subscription
+        ]
+
+    def get_event(self, timeout=None):
+        '''Remove and return the oldest unread (amount, currency, event),
+        waiting up to <timeout> seconds (forever if None) for one.
+        Raise queue.Empty on timeout.
+        '''
+        return self.events.get(timeout=timeout)
+
+    def drain_events(self, limit=None):
+        '''Remove and return the unread events, oldest first'''
+        return self.events.drain(limit)
 
     def get_last_event(self):
-        '''Get the last event and delete it from the event list'''
-        event = self.events[len(self.events) - 1]
-        self.events.pop(len(self.events) - 1)
-        return event
+        '''Remove and return the oldest unread event, or
+        (0, 0, Status.NO_EVENT) if there is none. Use get_event to wait for
+        one.
+        '''
+        try:
+            return self.events.get(block=False)
+        except queue.Empty:
+            return 0, 0, Status.NO_EVENT
 
     def set_route_cashbox(self, amount, currency='CHF'):
         '''Will set the route of <amount> in the cashbox
         NV11: Will set the route of <= amount in the cashbox
         '''
-        self.actions.put(actions.RouteToCashbox(
+        return self.queue_action(actions.RouteToCashbox(
             amount=amount * 100,
             currency=currency,
         ))
@@ -223,21 +657,23 @@ class eSSP:
         '''Set the bills <amount> in the storage
         NV11: Set the bills <= amount in the storage
         '''
-        self.actions.put(actions.RouteToStorage(
+        return self.queue_action(actions.RouteToStorage(
             amount=amount * 100,
             currency=currency,
         ))
 
     def payout(self, amount, currency='CHF'):
         '''Payout note(s) for completing the amount passed in parameter'''
-        self.actions.put(actions.Payout(
+        return self.queue_action(actions.Payout(
             amount=amount * 100,
             currency=currency,
         ))
 
     def get_note_amount(self, amount, currency='CHF'):
-        '''Get the numbers of note of value X in the smart payout device'''
-        self.actions.put(actions.GetNoteAmount(
+        '''Get the numbers of note of value X in the smart payout device,
+        the payload of the result is the number of notes.
+        '''
+        return self.queue_action(actions.GetNoteAmount(
             amount=amount * 100,
             currency=currency,
         ))
@@ -248,24 +684,61 @@ class eSSP:
         self.print_debug('Reset complete')
 
     def nv11_payout_next_note(self):
-        self.actions.put(actions.PayoutNextNoteNv11())
+        return self.queue_action(actions.PayoutNextNoteNv11())
 
     def nv11_stack_next_note(self):
-        self.actions.put(actions.StackNextNoteNv11())
+        return self.queue_action(actions.StackNextNoteNv11())
 
     def empty_storage(self):
-        self.actions.put(actions.EmptyStorage())
+        return self.queue_action(actions.EmptyStorage())
 
     def disable_payout(self):
-        self.actions.put(actions.DisablePayout())
+        return self.queue_action(actions.DisablePayout())
 
     def disable_validator(self):
-        self.actions.put(actions.DisableValidator())
+        return self.queue_action(actions.DisableValidator())
 
     @staticmethod
-    def update_device(file_path, com_port, ssp_address):
-        return C_LIBRARY.update_device(
-            file_path.encode(),
-            com_port.encode(),
-            ssp_address.encode(),
-        )
+    def update_device(file_path, com_port, ssp_address, progress=None):
+        '''Send the firmware file <file_path> to the device and wait for
+        the end, return the UpdateDeviceResponseEnum. <progress> is called
+        with the status of the update after each block, see
+        eSSP.update.FirmwareUpdate to update in the background.
+        '''
+        return FirmwareUpdate(
+            file_path,
+            com_port,
+            ssp_address,
+            progress,
+        ).wait()
+
+
+def _configuration(profile):
+    '''The configuration the start sends to the device of <profile>, as
+    saved in the profile_store
+    '''
+    if profile.is_smart_hopper:
+        return {'coin_inhibits': 'enabled'}
+    return {'inhibits': [0xFF, 0xFF], 'payout': profile.has_payout}
+
+
+def open_many(com_ports, max_workers=None, **kwargs):
+    '''Open the validators of <com_ports> in parallel, each with
+    eSSP(com_port, **kwargs), rather than one start after the other. Return
+    their eSSP in the same order. If one fails the others are closed and
+    its exception is raised.
+    '''
+    com_ports = list(com_ports)
+    with ThreadPoolExecutor(max_workers or len(com_ports) or 1) as executor:
+        futures = [
+            executor.submit(eSSP, com_port, **kwargs)
+            for com_port in com_ports
+        ]
+        wait(futures)
+    errors = [future.exception() for future in futures if future.exception()]
+    if errors:
+        for future in futures:
+            if future.exception() is None:
+                future.result().close()
+        raise errors[0]
+    return [future.result() for future in futures]
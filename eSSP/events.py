@@ -0,0 +1,122 @@
+'''Bounded buffer of the events reported by a validator'''
+import collections
+import threading
+
+from six.moves import queue
+
+
+class EventBuffer:
+    '''Thread safe FIFO ring of (amount, currency, event) tuples.
+
+    Holds at most <capacity> events: when it is full the oldest event is
+    dropped to make room and counted in ``dropped``. Every event gets a
+    sequence number, a gap in the numbers read by get_entry means events
+    were dropped in between.
+    '''
+
+    def __init__(self, capacity=1024):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self._entries = collections.deque(maxlen=capacity)
+        self._ready = threading.Condition(threading.Lock())
+        self.next_seq = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, event):
+        '''Add <event>, dropping the oldest one if the buffer is full'''
+        with self._ready:
+            if len(self._entries) == self.capacity:
+                self.dropped += 1
+            self._entries.append((self.next_seq, event))
+            self.next_seq += 1
+            self.high_water = max(self.high_water, len(self._entries))
+            self._ready.notify()
+
+    def get_entry(self, block=True, timeout=None):
+        '''Remove and return the oldest (seq, event), waiting up to
+        <timeout> seconds for one if <block>. Raise queue.Empty if there is
+        none.
+        '''
+        with self._ready:
+            if block and not self._ready.wait_for(
+                    lambda: self._entries,
+                    timeout,
+            ):
+                raise queue.Empty
+            if not self._entries:
+                raise queue.Empty
+            return self._entries.popleft()
+
+    def get(self, block=True, timeout=None):
+        '''Remove and return the oldest event, see get_entry'''
+        return self.get_entry(block, timeout)[1]
+
+    def drain(self, limit=None):
+        '''Remove and return up to <limit> events (all by default), oldest
+        first, without waiting.
+        '''
+        with self._ready:
+            count = len(self._entries)
+            if limit is not None:
+                count = min(count, limit)
+            return [self._entries.popleft()[1] for _ in range(count)]
+
+    def clear(self):
+        with self._ready:
+            self._entries.clear()
+
+    def stats(self):
+        '''Counters, for monitoring'''
+        with self._ready:
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'appended': self.next_seq,
+                'dropped': self.dropped,
+                'high_water': self.high_water,
+            }
+
+
+class Subscription:
+    '''Delivers the (amount, currency, event) tuples of some statuses to a
+    callback, or to a queue (anything with put_nowait or put).
+
+    <statuses> is an iterable of Status, None for every status. With an
+    <executor> the deliveries are submitted to it instead of running on the
+    poll thread; use a single worker to keep them in order. Exceptions
+    raised by the callback are counted in ``errors``.
+    '''
+
+    def __init__(self, target, statuses=None, executor=None):
+        if hasattr(target, 'put_nowait'):
+            target = target.put_nowait
+        elif hasattr(target, 'put'):
+            target = target.put
+        self.target = target
+        self.statuses = None if statuses is None else frozenset(
+            int(status) for status in statuses
+        )
+        self.executor = executor
+        self.delivered = 0
+        self.errors = 0
+
+    def wants(self, event):
+        return self.statuses is None or int(event[2]) in self.statuses
+
+    def deliver(self, event):
+        if self.executor is None:
+            self._deliver(event)
+        else:
+            self.executor.submit(self._deliver, event)
+
+    def _deliver(self, event):
+        try:
+            self.target(event)
+            self.delivered += 1
+        except Exception:
+            self.errors += 1
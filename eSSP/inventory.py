@@ -0,0 +1,173 @@
+'''Cache of the notes or coins stored in a payout device'''
+import threading
+
+# Ways of making a dispensed value tried before giving up and resyncing
+MAX_DECOMPOSITION_STEPS = 10000
+
+
+def _decompositions(value, available, limit=2):
+    '''Up to <limit> ways of making <value> from <available>, a list of
+    (denomination, count) sorted by decreasing denomination. Each way is a
+    {denomination: count} dict. Return None if the search took too long.
+    '''
+    found = []
+    steps = [0]
+
+    def search(index, remaining, used):
+        steps[0] += 1
+        if steps[0] > MAX_DECOMPOSITION_STEPS:
+            raise OverflowError
+        if remaining == 0:
+            found.append(dict(used))
+            return len(found) >= limit
+        if index == len(available):
+            return False
+        denomination, count = available[index]
+        for n in range(min(count, remaining // denomination), -1, -1):
+            if n:
+                used[denomination] = n
+            if search(index + 1, remaining - n * denomination, used):
+                return True
+            used.pop(denomination, None)
+        return False
+
+    try:
+        search(0, value, {})
+    except OverflowError:
+        return None
+    return found
+
+
+class Inventory:
+    '''Number of notes or coins of every denomination in the payout, by
+    (value, currency), value in cents as in get all levels.
+
+    Loaded with one get all levels command, then kept up to date from the
+    poll events: a credit followed by stored adds the note, dispensed and
+    cashbox paid remove the value paid out, an empty clears the levels.
+    Reading it never talks to the device. Events it cannot account for (a
+    value that can be made of stored notes in several ways, a level going
+    negative, a reset...) leave it ``synced`` False until eSSP has run a
+    get all levels again.
+    '''
+
+    def __init__(self):
+        self._levels = {}
+        self._lock = threading.Lock()
+        self._credited = None
+        self.synced = False
+        # False when the device does not answer get all levels
+        self.supported = True
+        self.loads = 0
+        self.updates = 0
+        self.mismatches = 0
+
+    def levels(self):
+        '''Copy of the {(value, currency): count} levels'''
+        with self._lock:
+            return dict(self._levels)
+
+    def count(self, value, currency):
+        with self._lock:
+            return self._levels.get((value, currency), 0)
+
+    def total(self, currency):
+        '''Value stored in <currency>, in cents'''
+        with self._lock:
+            return sum(
+                value * count
+                for (value, other), count in self._levels.items()
+                if other == currency
+            )
+
+    def load(self, all_levels):
+        '''Replace the levels with those of an Ssp6AllLevels'''
+        levels = {
+            (level.value, level.cc.decode()): level.level
+            for level in all_levels.Levels[:all_levels.NumberOfLevels]
+        }
+        with self._lock:
+            self._levels = levels
+            self._credited = None
+            self.synced = True
+            self.loads += 1
+
+    def invalidate(self):
+        '''Mark the levels stale, eSSP loads them again after the poll'''
+        with self._lock:
+            self._credited = None
+            self.synced = False
+
+    def set_level(self, value, currency, count):
+        '''Record the <count> read by a get note amount'''
+        with self._lock:
+            key = (value, currency)
+            if self.synced and self._levels.get(key, 0) != count:
+                self._mismatch()
+            self._levels[key] = count
+
+    def credit(self, note):
+        '''The note in escrow, a (value, currency), was credited. None if
+        its value is not known. Stored may follow.
+        '''
+        self._credited = note
+
+    def stacked(self):
+        '''The credited note went to the cashbox'''
+        self._credited = None
+
+    def stored(self):
+        '''The credited note went to the payout'''
+        with self._lock:
+            key, self._credited = self._credited, None
+            if key is None:
+                self._mismatch()
+                return
+            self._levels[key] = self._levels.get(key, 0) + 1
+            self.updates += 1
+
+    def removed(self, value, currency):
+        '''<value> cents of <currency> left the payout (dispensed or paid
+        to the cashbox). The levels are updated only when one set of stored
+        denominations makes that value.
+        '''
+        if not value:
+            return
+        with self._lock:
+            available = sorted(
+                (
+                    (denomination, count)
+                    for (denomination, other), count in self._levels.items()
+                    if other == currency and count > 0
+                ),
+                reverse=True,
+            )
+            ways = _decompositions(value, available)
+            if ways is None or len(ways) != 1:
+                self._mismatch()
+                return
+            for denomination, count in ways[0].items():
+                self._levels[(denomination, currency)] -= count
+            self.updates += 1
+
+    def emptied(self):
+        '''Everything stored went to the cashbox'''
+        with self._lock:
+            self._levels = {key: 0 for key in self._levels}
+            self._credited = None
+            self.updates += 1
+
+    def _mismatch(self):
+        self.mismatches += 1
+        self.synced = False
+
+    def stats(self):
+        '''Counters, for monitoring'''
+        with self._lock:
+            return {
+                'synced': self.synced,
+                'supported': self.supported,
+                'loads': self.loads,
+                'updates': self.updates,
+                'mismatches': self.mismatches,
+            }
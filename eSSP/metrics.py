@@ -0,0 +1,158 @@
+'''Link statistics of eSSP devices in the Prometheus text format.
+
+libessp counts, for every device, the round trip time of each command code
+(as a histogram), the retries and timeouts, the frames dropped on a bad CRC
+or packet counter and the bytes sent and received. Export them for a fleet:
+
+    server = serve({'kiosk-1': validator, 'kiosk-1-hopper': hopper}, 9101)
+
+or render them in an existing endpoint with prometheus_text.
+'''
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .clib import SSP_STATS_BUCKET_US
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Device counters: (SspStats field, metric name, help)
+LINK_COUNTERS = (
+    ('bytes_sent', 'essp_bytes_sent_total', 'Bytes written to the port'),
+    ('bytes_received', 'essp_bytes_received_total', 'Bytes read from the port'),
+    ('crc_errors', 'essp_crc_errors_total', 'Replies dropped on a bad CRC'),
+    (
+        'counter_mismatches',
+        'essp_counter_mismatches_total',
+        'Encrypted replies dropped on a wrong packet counter',
+    ),
+    (
+        'packet_errors',
+        'essp_packet_errors_total',
+        'Encrypted replies dropped on a bad inner CRC or length',
+    ),
+    ('port_errors', 'essp_port_errors_total', 'Failed writes to the port'),
+    ('negotiations', 'essp_negotiations_total', 'Encryption key exchanges'),
+    (
+        'negotiation_failures',
+        'essp_negotiation_failures_total',
+        'Encryption key exchanges that failed',
+    ),
+    (
+        'precomputed_keys',
+        'essp_precomputed_keys_total',
+        'Key exchanges with host keys made in the background',
+    ),
+)
+
+# Command counters: (SspCommandStats field, metric name, help)
+COMMAND_COUNTERS = (
+    ('timeouts', 'essp_command_timeouts_total', 'Commands never answered'),
+    ('retries', 'essp_command_retries_total', 'Frames sent again'),
+)
+
+
+def command_stats(stats):
+    '''{command code: SspCommandStats} of the codes sent at least once'''
+    return {
+        code: command
+        for code, command in enumerate(stats.commands)
+        if command.count
+    }
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _labels(**labels):
+    return '{' + ','.join(
+        f'{name}="{_escape(value)}"' for name, value in labels.items()
+    ) + '}'
+
+
+def prometheus_text(devices):
+    '''Prometheus text exposition of the link statistics of <devices>, a
+    {name: eSSP} dict. The name is the device label, the command label is
+    the command code in hex.
+    '''
+    snapshots = {}
+    for name, device in devices.items():
+        stats = device.link_stats()
+        if stats is not None:
+            snapshots[name] = (stats, command_stats(stats))
+
+    lines = []
+    for field, metric, text in LINK_COUNTERS:
+        lines.append(f'# HELP {metric} {text}')
+        lines.append(f'# TYPE {metric} counter')
+        for name, (stats, _) in snapshots.items():
+            lines.append(
+                f'{metric}{_labels(device=name)} {getattr(stats, field)}',
+            )
+
+    for field, metric, text in COMMAND_COUNTERS:
+        lines.append(f'# HELP {metric} {text}')
+        lines.append(f'# TYPE {metric} counter')
+        for name, (_, commands) in snapshots.items():
+            for code, command in commands.items():
+                labels = _labels(device=name, command=f'0x{code:02X}')
+                lines.append(f'{metric}{labels} {getattr(command, field)}')
+
+    metric = 'essp_negotiation_seconds'
+    lines.append(f'# HELP {metric} Time taken by the encryption key exchanges')
+    lines.append(f'# TYPE {metric} summary')
+    for name, (stats, _) in snapshots.items():
+        labels = _labels(device=name)
+        lines.append(
+            f'{metric}_sum{labels} {stats.negotiation_total_us / 1e6}',
+        )
+        lines.append(f'{metric}_count{labels} {stats.negotiations}')
+
+    metric = 'essp_command_round_trip_seconds'
+    lines.append(f'# HELP {metric} Time from the first frame to the reply')
+    lines.append(f'# TYPE {metric} histogram')
+    for name, (_, commands) in snapshots.items():
+        for code, command in commands.items():
+            command_label = f'0x{code:02X}'
+            cumulative = 0
+            bounds = [bound / 1e6 for bound in SSP_STATS_BUCKET_US]
+            for bound, count in zip(bounds + ['+Inf'], command.buckets):
+                cumulative += count
+                labels = _labels(device=name, command=command_label, le=bound)
+                lines.append(f'{metric}_bucket{labels} {cumulative}')
+            labels = _labels(device=name, command=command_label)
+            lines.append(f'{metric}_sum{labels} {command.total_us / 1e6}')
+            lines.append(f'{metric}_count{labels} {command.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def serve(devices, port, address=''):
+    '''Serve prometheus_text(<devices>) on http://<address>:<port>/metrics
+    from a daemon thread. Return the server, shutdown() stops it.
+    '''
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text(devices).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -1,37 +1,84 @@
+import sys
+
 from . import C_LIBRARY
-from .clib import SspPollEvent6, SspResponseEnum
+from .clib import SspResponseEnum
 from .constants import Status, FailureStatus
 
 events = {}
 
+# Indexed by the status byte, built once so that handling an event is a
+# couple of list lookups
+HANDLERS = [None] * 256
+# Debug text of each status, None for those not printed
+DEBUG_TEXT = [None] * 256
+# The (0, 0, status) recorded for events whose handler returns nothing
+DEFAULT_RECORDS = [(0, 0, status) for status in range(256)]
+
+for _status in range(256):
+    try:
+        DEBUG_TEXT[_status] = str(Status(_status))
+    except ValueError:
+        DEBUG_TEXT[_status] = f'Unknown status: {_status}'
+DEBUG_TEXT[Status.DISABLED.value] = None
+
+# Country codes as interned str, by their bytes
+_currencies = {b'': ''}
+
+
+def currency(cc):
+    '''The str of the country code bytes <cc>, the same object every time'''
+    try:
+        return _currencies[cc]
+    except KeyError:
+        text = sys.intern(cc.decode('ascii', 'replace'))
+        if len(_currencies) < 256:
+            _currencies[bytes(cc)] = text
+        return text
+
 
 def register_event(constant):
+    '''Register the handler of the <constant> status. The handler is
+    called with (essp, data1, data2, currency), currency a str. It may
+    return the (amount, currency, event) tuple to record, by default
+    (0, 0, status) is recorded.
+    '''
     def internal(event_function):
         events[constant.value] = event_function
+        HANDLERS[constant.value] = event_function
         return event_function
     return internal
 
 
 def handle_event(essp, event):
-    try:
-        if event.event != Status.DISABLED:
-            essp.print_debug(Status(event.event))
-    except ValueError:
-        essp.print_debug(f'Unknown status: {event.event}')
+    '''Run the handler of <event> and record it, return the recorded
+    (amount, currency, event) tuple.
+    '''
+    status = event.event
+    if essp.debug and DEBUG_TEXT[status] is not None:
+        essp.print_debug(DEBUG_TEXT[status])
 
-    try:
-        events[event.event](essp, event.data1, event.data2, event.cc)
-    except KeyError:
-        # Most events don't require a specialised function.
-        pass
+    # Most events don't require a specialised function.
+    handler = HANDLERS[status]
+    recorded = None
+    if handler is not None:
+        recorded = handler(essp, event.data1, event.data2, currency(event.cc))
 
-    essp.events.append((0, 0, event.event))
+    recorded = recorded or DEFAULT_RECORDS[status]
+    essp.events.append(recorded)
+    return recorded
 
 
 @register_event(Status.SSP_POLL_RESET)
 def poll_reset(essp, _data1, _data2, _cc):
-    if (C_LIBRARY.ssp6_host_protocol(essp.sspC, 0x06)
-            != SspResponseEnum.SSP_RESPONSE_OK):  # Magic number
+    # The device may have been updated or reconfigured
+    essp.invalidate_profile()
+    essp.inventory.invalidate()
+    essp.device_reset()
+    response = C_LIBRARY.ssp6_host_protocol(essp.sspC, 0x06)  # Magic number
+    if (response == SspResponseEnum.SSP_RESPONSE_TIMEOUT
+            and essp.fall_back_baud_rate()):
+        response = C_LIBRARY.ssp6_host_protocol(essp.sspC, 0x06)
+    if response != SspResponseEnum.SSP_RESPONSE_OK:
         raise Exception('Host Protocol Failed')
         essp.close()
 
@@ -39,42 +86,96 @@ def poll_reset(essp, _data1, _data2, _cc):
 @register_event(Status.SSP_POLL_READ)
 def poll_read(essp, data1, data2, cc):
     if data1 > 0:
-        essp.print_debug(f'Note Read {data1} {cc.decode()}')
-        essp.events.append(
-            (data1, cc.decode(), Status.SSP_POLL_READ),
-        )
+        if essp.debug:
+            essp.print_debug(f'Note Read {data1} {cc}')
+        return data1, cc, Status.SSP_POLL_READ
+
+
+def channel_note(essp, channel):
+    '''(value in cents, currency) of the notes of <channel>, None if the
+    profile does not know it
+    '''
+    profile = essp.profile
+    if profile is None or not 0 < channel <= len(profile.channels):
+        return None
+    value, currency, _security = profile.channels[channel - 1]
+    return value * profile.real_value_multiplier, currency
 
 
 @register_event(Status.SSP_POLL_CREDIT)
 def poll_credit(essp, data1, data2, cc):
-    essp.print_debug(f'Credit {data1} {cc.decode()}')
-    essp.events.append(
-        (data1, cc.decode(), Status.SSP_POLL_CREDIT),
-    )
+    if essp.debug:
+        essp.print_debug(f'Credit {data1} {cc}')
+    essp.inventory.credit(channel_note(essp, data1))
+    return data1, cc, Status.SSP_POLL_CREDIT
+
+
+@register_event(Status.SSP_POLL_STACKED)
+def poll_stacked(essp, _data1, _data2, _cc):
+    essp.inventory.stacked()
+
+
+@register_event(Status.SSP_POLL_STORED)
+def poll_stored(essp, _data1, _data2, _cc):
+    essp.inventory.stored()
+
+
+@register_event(Status.SSP_POLL_DISPENSED)
+def poll_dispensed(essp, data1, data2, cc):
+    if essp.debug:
+        essp.print_debug(f'Dispensed {data1} {cc}')
+    essp.inventory.removed(data1, cc)
+
+
+@register_event(Status.SSP_POLL_CASHBOX_PAID)
+def poll_cashbox_paid(essp, data1, data2, cc):
+    if essp.debug:
+        essp.print_debug(f'Cashbox paid {data1} {cc}')
+    essp.inventory.removed(data1, cc)
+
+
+@register_event(Status.SSP_POLL_SMART_EMPTIED)
+def poll_smart_emptied(essp, _data1, _data2, _cc):
+    essp.inventory.emptied()
+
+
+@register_event(Status.SSP_POLL_EMPTY)
+def poll_empty(essp, _data1, _data2, _cc):
+    essp.inventory.emptied()
 
 
 @register_event(Status.SSP_POLL_INCOMPLETE_PAYOUT)
 def poll_incomplete_payout(essp, data1, data2, cc):
-    essp.print_debug(f'Incomplete payout {data1} of {data2} {cc.decode()}')
+    if essp.debug:
+        essp.print_debug(f'Incomplete payout {data1} of {data2} {cc}')
+    essp.inventory.invalidate()
 
 
 @register_event(Status.SSP_POLL_INCOMPLETE_FLOAT)
 def poll_incomplete_float(essp, data1, data2, cc):
-    essp.print_debug(f'Incomplete float {data1} of {data2} {cc.decode()}')
+    if essp.debug:
+        essp.print_debug(f'Incomplete float {data1} of {data2} {cc}')
+    essp.inventory.invalidate()
+
+
+@register_event(Status.SSP_POLL_FLOATED)
+def poll_floated(essp, _data1, _data2, _cc):
+    # The coins left after the float are not reported
+    essp.inventory.invalidate()
 
 
 @register_event(Status.SSP_POLL_FRAUD_ATTEMPT)
 def poll_fraud_attempt(essp, data1, data2, cc):
-    essp.print_debug(f'Fraud Attempt {data1} {cc.decode()}')
-    essp.events.append(
-        (data1, cc.decode(), Status.SSP_POLL_FRAUD_ATTEMPT),
-    )
+    if essp.debug:
+        essp.print_debug(f'Fraud Attempt {data1} {cc}')
+    return data1, cc, Status.SSP_POLL_FRAUD_ATTEMPT
 
 
 @register_event(Status.SSP_POLL_CALIBRATION_FAIL)
 def poll_calibration_fail(essp, data1, data2, cc):
-    essp.print_debug('Calibration fail:')
-    essp.print_debug(FailureStatus(data1))
+    if essp.debug:
+        essp.print_debug('Calibration fail:')
+        essp.print_debug(FailureStatus(data1))
     if data1 == FailureStatus.COMMAND_RECAL:
         essp.print_debug('Trying to run autocalibration')
         C_LIBRARY.ssp6_run_calibration(essp.sspC)
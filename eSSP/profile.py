@@ -0,0 +1,206 @@
+'''What a device reports about itself in its setup request'''
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+UNIT_VALIDATOR = 0x00
+UNIT_SMART_HOPPER = 0x03
+UNIT_SMART_PAYOUT = 0x06
+UNIT_NV11 = 0x07
+
+Channel = namedtuple('Channel', 'value currency security')
+
+
+class DeviceProfile(namedtuple('DeviceProfile', (
+        'unit_type',
+        'firmware_version',
+        'channels',
+        'real_value_multiplier',
+        'protocol_version',
+))):
+    '''Read-only copy of an Ssp6SetupRequestData. ``channels`` holds the
+    Channel of each note or coin channel, channel 1 first.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_setup_request(cls, setup_req):
+        return cls(
+            unit_type=setup_req.UnitType,
+            firmware_version=setup_req.FirmwareVersion.decode(
+                'utf8',
+                'replace',
+            ),
+            channels=tuple(
+                Channel(channel.value, channel.cc.decode(), channel.security)
+                for channel in
+                setup_req.ChannelData[:setup_req.NumberOfChannels]
+            ),
+            real_value_multiplier=setup_req.RealValueMultiplier,
+            protocol_version=setup_req.ProtocolVersion,
+        )
+
+    def to_dict(self):
+        '''JSON serialisable copy, see from_dict'''
+        return {
+            'unit_type': self.unit_type,
+            'firmware_version': self.firmware_version,
+            'channels': [list(channel) for channel in self.channels],
+            'real_value_multiplier': self.real_value_multiplier,
+            'protocol_version': self.protocol_version,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            unit_type=data['unit_type'],
+            firmware_version=data['firmware_version'],
+            channels=tuple(Channel(*channel) for channel in data['channels']),
+            real_value_multiplier=data['real_value_multiplier'],
+            protocol_version=data['protocol_version'],
+        )
+
+    @property
+    def has_payout(self):
+        return self.unit_type in (UNIT_SMART_PAYOUT, UNIT_NV11)
+
+    @property
+    def is_nv11(self):
+        return self.unit_type == UNIT_NV11
+
+    @property
+    def is_smart_hopper(self):
+        return self.unit_type == UNIT_SMART_HOPPER
+
+
+class ProfileStore:
+    '''Device profiles and configuration saved in a JSON file, for the warm
+    start of eSSP (see eSSP profile_store).
+
+    An entry is kept by port and SSP address and holds the DeviceProfile,
+    the routes set on the device, which keeps them over a reset, the
+    configuration sent by the start, which the device keeps until a reset,
+    and the baud rates it was heard at or failed at. The routes and the
+    configuration are dropped when the firmware changes.
+    '''
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._entries = None
+
+    @staticmethod
+    def key(com_port, ssp_address):
+        return f'{com_port}#{int(ssp_address)}'
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as store:
+                    self._entries = json.load(store)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Unique to the thread: two stores may save the same path at once
+        temporary = (
+            f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        )
+        with open(temporary, 'w') as store:
+            json.dump(self._entries, store, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+    def get(self, key):
+        '''(DeviceProfile, entry dict) saved for <key>, None if there is
+        none
+        '''
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return None
+            try:
+                profile = DeviceProfile.from_dict(entry['profile'])
+            except (KeyError, TypeError, ValueError):
+                return None
+            return profile, dict(entry)
+
+    def put(self, key, profile):
+        '''Save the <profile> of <key>, keeping its routes and
+        configuration if the firmware did not change
+        '''
+        with self._lock:
+            entry = self._load().setdefault(key, {})
+            old_profile = entry.get('profile') or {}
+            if old_profile.get('firmware_version') != profile.firmware_version:
+                entry['routes'] = {}
+                entry.pop('configuration', None)
+            entry['profile'] = profile.to_dict()
+            entry['saved_at'] = time.time()
+            self._save()
+
+    def set_route(self, key, amount, currency, route):
+        '''Record that the notes of <amount> (in cents) <currency> go to
+        <route>, 'storage' or 'cashbox'
+        '''
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return
+            routes = entry.setdefault('routes', {})
+            name = f'{amount} {currency}'
+            if routes.get(name) != route:
+                routes[name] = route
+                self._save()
+
+    def set_configuration(self, key, configuration):
+        '''Record the <configuration> dict sent to the device of <key>,
+        None when it is not known
+        '''
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None or entry.get('configuration') == configuration:
+                return
+            if configuration is None:
+                del entry['configuration']
+            else:
+                entry['configuration'] = configuration
+            self._save()
+
+    def baud_rate(self, key):
+        '''(rate the device was last set to, [rates it failed at]) of
+        <key>, (9600, []) if unknown
+        '''
+        with self._lock:
+            entry = self._load().get(key) or {}
+            return (
+                entry.get('baud_rate', 9600),
+                list(entry.get('failed_baud_rates', [])),
+            )
+
+    def set_baud_rate(self, key, rate, failed=None):
+        '''Record that the device of <key> is now at <rate>, and could not
+        be set to <failed>
+        '''
+        with self._lock:
+            entry = self._load().setdefault(key, {})
+            failures = set(entry.get('failed_baud_rates', []))
+            if failed is not None:
+                failures.add(failed)
+            failures.discard(rate)
+            if (entry.get('baud_rate') == rate
+                    and failures == set(entry.get('failed_baud_rates', []))):
+                return
+            entry['baud_rate'] = rate
+            entry['failed_baud_rates'] = sorted(failures)
+            self._save()
+
+    def forget(self, key):
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
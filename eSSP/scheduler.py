@@ -0,0 +1,78 @@
+'''Adaptive poll cadence of a validator'''
+import threading
+
+from .constants import Status
+
+# While one of these is reported a transaction is in progress: a note in
+# escrow or moving, a payout dispensing, the storage emptying...
+ACTIVE_EVENTS = frozenset(status.value for status in (
+    Status.SSP_POLL_READ,
+    Status.SSP_POLL_STACKING,
+    Status.SSP_POLL_REJECTING,
+    Status.SSP_POLL_DISPENSING,
+    Status.SSP_POLL_FLOATING,
+    Status.SSP_POLL_EMPTYING,
+    Status.SSP_POLL_SMART_EMPTYING,
+))
+
+
+class PollScheduler:
+    '''Chooses the delay before the next poll.
+
+    Polls every <fast_interval> seconds while a transaction is in progress
+    (see ACTIVE_EVENTS) or actions are pending, then backs off by
+    <backoff> per idle poll up to <idle_interval>. <idle_interval> must stay
+    below the keep-alive timeout of the device, after which it disables
+    itself. <on_change> is called with (old, new) each time the interval
+    changes. <wake_event> is the threading.Event set by wake, the devices of
+    a bus share the one of their Bus.
+    '''
+
+    def __init__(
+            self,
+            fast_interval=0.1,
+            idle_interval=1.0,
+            backoff=2.0,
+            on_change=None,
+            wake_event=None,
+    ):
+        if not 0 < fast_interval <= idle_interval:
+            raise ValueError('0 < fast_interval <= idle_interval expected')
+        self.fast_interval = fast_interval
+        self.idle_interval = idle_interval
+        self.backoff = backoff
+        self.on_change = on_change
+        self.interval = idle_interval
+        self.changes = 0
+        self.wake_event = wake_event or threading.Event()
+
+    def update(self, events=(), pending=False):
+        '''Compute the interval after a poll that returned the <events>
+        statuses, <pending> is True when actions are waiting to run.
+        '''
+        if pending or any(int(event) in ACTIVE_EVENTS for event in events):
+            interval = self.fast_interval
+        else:
+            interval = min(self.interval * self.backoff, self.idle_interval)
+        self._set_interval(interval)
+        return self.interval
+
+    def _set_interval(self, interval):
+        if interval != self.interval:
+            old, self.interval = self.interval, interval
+            self.changes += 1
+            if self.on_change is not None:
+                self.on_change(old, interval)
+
+    def wake(self):
+        '''Poll now: stops the current wait and goes back to fast polling'''
+        self._set_interval(self.fast_interval)
+        self.wake_event.set()
+
+    def wait(self):
+        '''Sleep for the current interval, or until wake is called.
+        Return True when woken.
+        '''
+        woken = self.wake_event.wait(self.interval)
+        self.wake_event.clear()
+        return woken
@@ -0,0 +1,960 @@
+'''Simulated SSP device listening on a Linux pseudo-terminal.
+
+The simulator speaks the same wire protocol as ``SSPSendCommand`` and
+``SSPDataIn`` in ``_eSSP/lib/SSPComs.c`` (STX framing, byte stuffing, CCITT
+CRC, sequence bit, eSSP key exchange and encrypted packets) so an ``eSSP``
+object can be pointed at it without any hardware:
+
+    sim = Simulator()
+    sim.start()
+    validator = eSSP(com_port=sim.port)
+    sim.insert_note(4)
+
+Several devices can share the same pty (multi-drop) by passing one
+``SimulatedDevice`` per SSP address.
+
+A device only hears the frames sent at its baud rate, 9600 until it gets a
+set baud rate command. With ``line_time`` the replies also take the time
+the frames would take on a serial line at that rate.
+
+A firmware file can be sent with ``update_device``: the device takes the
+RAM file and the blocks of the main file, answering their checksums, and
+restarts at 9600 baud when the host syncs again at that rate.
+'''
+import os
+import random
+import select
+import termios
+import threading
+import time
+import tty
+from collections import deque
+
+SSP_STX = 0x7F
+SSP_STEX = 0x7E
+CRC_SSP_SEED = 0xFFFF
+CRC_SSP_POLY = 0x8005
+
+# Commands (see _eSSP/inc/ssp_defines.h and _eSSP/ssp_helpers.h)
+CMD_RESET = 0x01
+CMD_SET_INHIBITS = 0x02
+CMD_SETUP_REQUEST = 0x05
+CMD_HOST_PROTOCOL = 0x06
+CMD_POLL = 0x07
+CMD_REJECT_NOTE = 0x08
+CMD_DISABLE = 0x09
+CMD_ENABLE = 0x0A
+CMD_SYNC = 0x11
+CMD_PAYOUT_VALUE = 0x33
+CMD_GET_NOTE_AMOUNT = 0x35
+CMD_SET_ROUTING = 0x3B
+CMD_EMPTY = 0x3F
+CMD_PAYOUT_NOTE = 0x42
+CMD_STACK_NOTE = 0x43
+CMD_RUN_CALIBRATION = 0x48
+CMD_SET_GENERATOR = 0x4A
+CMD_SET_MODULUS = 0x4B
+CMD_REQ_KEY_EXCHANGE = 0x4C
+CMD_SET_BAUD_RATE = 0x4D
+CMD_PROGRAM = 0x0B
+PROGRAM_RAM_FILE = 0x03
+
+# Firmware download (see _eSSP/update.c)
+DOWNLOAD_HEADER_SIZE = 128
+DOWNLOAD_ACK = 0x32
+CMD_SMART_EMPTY = 0x52
+CMD_DISABLE_PAYOUT = 0x5B
+CMD_ENABLE_PAYOUT = 0x5C
+
+# Generic responses
+RESPONSE_OK = 0xF0
+RESPONSE_UNKNOWN_COMMAND = 0xF2
+RESPONSE_INCORRECT_PARAMETERS = 0xF3
+RESPONSE_COMMAND_NOT_PROCESSED = 0xF5
+RESPONSE_KEY_NOT_SET = 0xFA
+
+# Poll events
+POLL_RESET = 0xF1
+POLL_READ = 0xEF
+POLL_CREDIT = 0xEE
+POLL_REJECTING = 0xED
+POLL_REJECTED = 0xEC
+POLL_STACKING = 0xCC
+POLL_STACKED = 0xEB
+POLL_DISABLED = 0xE8
+POLL_DISPENSING = 0xDA
+POLL_DISPENSED = 0xD2
+POLL_STORED = 0xDB
+POLL_CASHBOX_PAID = 0xDE
+POLL_SMART_EMPTYING = 0xB3
+POLL_SMART_EMPTIED = 0xB4
+POLL_EMPTYING = 0xC2
+POLL_EMPTY = 0xC3
+
+UNIT_VALIDATOR = 0x00
+UNIT_SMART_PAYOUT = 0x06
+UNIT_NV11 = 0x07
+
+ROUTE_PAYOUT = 0x00
+ROUTE_CASHBOX = 0x01
+
+PAYOUT_NOT_ENOUGH = 0x01
+PAYOUT_EXACT_AMOUNT = 0x02
+PAYOUT_BUSY = 0x03
+PAYOUT_DISABLED = 0x04
+
+OPTION_BYTE_DO = 0x58
+
+DEFAULT_CHANNELS = (
+    (1000, 'CHF'),
+    (2000, 'CHF'),
+    (5000, 'CHF'),
+    (10000, 'CHF'),
+    (20000, 'CHF'),
+    (100000, 'CHF'),
+)
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ CRC_SSP_POLY) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(data, crc=CRC_SSP_SEED):
+    '''CCITT CRC as computed by cal_crc_loop_CCITT_A'''
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def frame(address, data):
+    '''Build a stuffed SSP frame from the address/seq byte and its data'''
+    body = bytes([address, len(data)]) + bytes(data)
+    crc = crc16(body)
+    body += bytes([crc & 0xFF, crc >> 8])
+    return bytes([SSP_STX]) + body.replace(b'\x7f', b'\x7f\x7f')
+
+
+# --- AES-128 (ECB), used for eSSP encrypted packets -------------------------
+
+def _xtime(a):
+    a <<= 1
+    return (a ^ 0x11B) if a & 0x100 else a
+
+
+def _aes_tables():
+    sbox = [0] * 256
+    p = q = 1
+    while True:
+        p ^= _xtime(p)
+        q ^= q << 1
+        q ^= q << 2
+        q ^= q << 4
+        q &= 0xFF
+        if q & 0x80:
+            q ^= 0x09
+        x = q ^ (q << 1 | q >> 7) ^ (q << 2 | q >> 6) \
+            ^ (q << 3 | q >> 5) ^ (q << 4 | q >> 4)
+        sbox[p] = (x ^ 0x63) & 0xFF
+        if p == 1:
+            break
+    sbox[0] = 0x63
+    inv = [0] * 256
+    for i, s in enumerate(sbox):
+        inv[s] = i
+    return sbox, inv
+
+
+_SBOX, _INV_SBOX = _aes_tables()
+_RCON = (0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80, 0x1B, 0x36)
+
+
+def _mul(a, b):
+    r = 0
+    while b:
+        if b & 1:
+            r ^= a
+        a = _xtime(a)
+        b >>= 1
+    return r
+
+
+def _expand_key(key):
+    words = [list(key[i:i + 4]) for i in range(0, 16, 4)]
+    for i in range(4, 44):
+        temp = list(words[i - 1])
+        if i % 4 == 0:
+            temp = temp[1:] + temp[:1]
+            temp = [_SBOX[b] for b in temp]
+            temp[0] ^= _RCON[i // 4 - 1]
+        words.append([a ^ b for a, b in zip(words[i - 4], temp)])
+    return [sum(words[r * 4:r * 4 + 4], []) for r in range(11)]
+
+
+def _encrypt_block(round_keys, block):
+    s = [b ^ k for b, k in zip(block, round_keys[0])]
+    for r in range(1, 11):
+        s = [_SBOX[b] for b in s]
+        s = [s[(i + 4 * (i % 4)) % 16] for i in range(16)]
+        if r != 10:
+            mixed = []
+            for c in range(4):
+                a = s[c * 4:c * 4 + 4]
+                mixed += [
+                    _mul(a[0], 2) ^ _mul(a[1], 3) ^ a[2] ^ a[3],
+                    a[0] ^ _mul(a[1], 2) ^ _mul(a[2], 3) ^ a[3],
+                    a[0] ^ a[1] ^ _mul(a[2], 2) ^ _mul(a[3], 3),
+                    _mul(a[0], 3) ^ a[1] ^ a[2] ^ _mul(a[3], 2),
+                ]
+            s = mixed
+        s = [b ^ k for b, k in zip(s, round_keys[r])]
+    return bytes(s)
+
+
+def _decrypt_block(round_keys, block):
+    s = [b ^ k for b, k in zip(block, round_keys[10])]
+    for r in range(9, -1, -1):
+        s = [s[(i - 4 * (i % 4)) % 16] for i in range(16)]
+        s = [_INV_SBOX[b] for b in s]
+        s = [b ^ k for b, k in zip(s, round_keys[r])]
+        if r != 0:
+            mixed = []
+            for c in range(4):
+                a = s[c * 4:c * 4 + 4]
+                mixed += [
+                    _mul(a[0], 14) ^ _mul(a[1], 11)
+                    ^ _mul(a[2], 13) ^ _mul(a[3], 9),
+                    _mul(a[0], 9) ^ _mul(a[1], 14)
+                    ^ _mul(a[2], 11) ^ _mul(a[3], 13),
+                    _mul(a[0], 13) ^ _mul(a[1], 9)
+                    ^ _mul(a[2], 14) ^ _mul(a[3], 11),
+                    _mul(a[0], 11) ^ _mul(a[1], 13)
+                    ^ _mul(a[2], 9) ^ _mul(a[3], 14),
+                ]
+            s = mixed
+    return bytes(s)
+
+
+def aes_encrypt(key, data):
+    round_keys = _expand_key(key)
+    return b''.join(
+        _encrypt_block(round_keys, data[i:i + 16])
+        for i in range(0, len(data), 16)
+    )
+
+
+def aes_decrypt(key, data):
+    round_keys = _expand_key(key)
+    return b''.join(
+        _decrypt_block(round_keys, data[i:i + 16])
+        for i in range(0, len(data), 16)
+    )
+
+
+# Rates of the set baud rate command, by its code
+BAUD_RATES = (9600, 38400, 115200)
+# Bits sent for each byte: start, 8 data, 2 stop
+BITS_PER_BYTE = 11
+_SPEEDS = {
+    getattr(termios, f'B{rate}'): rate
+    for rate in (9600, 19200, 38400, 57600, 115200)
+}
+
+
+def _xor(data, checksum=0):
+    '''XOR of the bytes of <data> and <checksum>'''
+    value = int.from_bytes(data, 'little')
+    size = len(data)
+    # Fold the halves onto each other down to one byte
+    while size > 1:
+        half = (size + 1) // 2
+        value = (value & ((1 << half * 8) - 1)) ^ (value >> half * 8)
+        size = half
+    return checksum ^ value
+
+
+def _le(value, size):
+    return int(value).to_bytes(size, 'little')
+
+
+class SimulatedDevice:
+    '''State of one simulated SSP slave (NV200, NV11 or SMART Payout).
+
+    Notes are inserted with ``insert_note`` and the resulting events are
+    reported over the following polls, one step per poll, the way a real
+    validator reports reading, escrow, stacking and credit.
+    '''
+
+    def __init__(self, address=0, unit_type=UNIT_SMART_PAYOUT,
+                 firmware='0450', channels=DEFAULT_CHANNELS,
+                 protocol_version=6, levels=None, fixed_key=0x123456701234567,
+                 require_encryption=False, baud_rates=BAUD_RATES,
+                 download_block_size=512):
+        self.address = address
+        self.unit_type = unit_type
+        self.firmware = firmware
+        self.channels = list(channels)
+        self.protocol_version = protocol_version
+        self.fixed_key = fixed_key
+        self.require_encryption = require_encryption
+        # Rates accepted by the set baud rate command, None if the device
+        # does not know it
+        self.baud_rates = baud_rates
+        self.baud_rate = 9600
+        self.baud_persists = False
+        self.download_block_size = download_block_size
+        # The header of the firmware file once the program command is sent
+        self.programming = False
+        self.download_header = None
+        # Firmware files received in full
+        self.updates = 0
+        # value, currency -> number of notes in the payout
+        self.levels = dict(levels or {})
+        self.routes = {channel: ROUTE_CASHBOX for channel in self.channels}
+        self.command_delays = {}
+        self.commands = []
+        self.poll_times = []
+        self.reset()
+
+    def reset(self):
+        '''Power cycle the device'''
+        if not self.baud_persists:
+            self.baud_rate = 9600
+        self.enabled = False
+        self.payout_enabled = False
+        self.inhibits = 0
+        self.encryption_key = None
+        self.generator = None
+        self.modulus = None
+        self.count = 0
+        self.last_seq = None
+        self.last_reply = None
+        self.escrow = None
+        self.script = deque([[bytes([POLL_RESET])]])
+        self.pending = deque()
+
+    # --- Scripting ----------------------------------------------------------
+
+    def insert_note(self, channel):
+        '''Insert a note of <channel> (1 based) into the validator'''
+        value, currency = self.channels[channel - 1]
+        if not self.enabled or not self.inhibits & (1 << (channel - 1)):
+            self.script.extend([
+                [bytes([POLL_READ, 0])],
+                [bytes([POLL_REJECTING])],
+                [bytes([POLL_REJECTED])],
+            ])
+            return
+        self.script.extend([
+            [bytes([POLL_READ, 0])],
+            [bytes([POLL_READ, channel])],
+            self._stack_note,
+        ])
+
+    def queue_events(self, *events):
+        '''Report the raw <events> (bytes each) on the next poll'''
+        self.script.append([bytes(event) for event in events])
+
+    def set_response_delay(self, seconds, command=None):
+        '''Delay every reply, or the replies to one <command> code'''
+        self.command_delays[command] = seconds
+
+    def response_delay(self, command):
+        return self.command_delays.get(
+            command,
+            self.command_delays.get(None, 0),
+        )
+
+    def _stack_note(self):
+        value, currency = self.escrow_note()
+        channel = self.escrow
+        self.escrow = None
+        if (self.payout_enabled
+                and self.routes.get((value, currency)) == ROUTE_PAYOUT):
+            key = (value, currency)
+            self.levels[key] = self.levels.get(key, 0) + 1
+            self.script.appendleft([
+                bytes([POLL_CREDIT, channel]),
+                bytes([POLL_STORED]),
+            ])
+        else:
+            self.script.appendleft([
+                bytes([POLL_CREDIT, channel]),
+                bytes([POLL_STACKED]),
+            ])
+        return [bytes([POLL_STACKING])]
+
+    def escrow_note(self):
+        return self.channels[self.escrow - 1]
+
+    # --- Poll ---------------------------------------------------------------
+
+    def poll(self):
+        self.poll_times.append(time.monotonic())
+        events = []
+        if self.script:
+            step = self.script.popleft()
+            if callable(step):
+                step = step()
+            for event in step:
+                if event[0] == POLL_READ and event[1] != 0:
+                    self.escrow = event[1]
+                events.append(event)
+        if not self.enabled and not events:
+            events.append(bytes([POLL_DISABLED]))
+        return b''.join(events)
+
+    # --- Commands -----------------------------------------------------------
+
+    def handle(self, data):
+        '''Handle a decoded command and return the response data'''
+        command = data[0]
+        self.commands.append(command)
+        handler = getattr(self, f'_cmd_{command:02x}', None)
+        if handler is None:
+            return bytes([RESPONSE_UNKNOWN_COMMAND])
+        return handler(data[1:])
+
+    def _cmd_11(self, data):
+        return bytes([RESPONSE_OK])
+
+    def _cmd_01(self, data):
+        self.reset()
+        return bytes([RESPONSE_OK])
+
+    def _cmd_06(self, data):
+        if not data or data[0] > self.protocol_version:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED])
+        return bytes([RESPONSE_OK])
+
+    def _cmd_05(self, data):
+        n = len(self.channels)
+        response = bytearray([RESPONSE_OK, self.unit_type])
+        response += self.firmware.encode()[:4].rjust(4, b'0')
+        response += self.channels[0][1].encode() if n else b'\0\0\0'
+        response += bytes(3)  # value multiplier, obsolete in SSPv6
+        response.append(n)
+        response += bytes(n)  # channel values, obsolete in SSPv6
+        response += bytes([2] * n)  # security
+        response += (100).to_bytes(3, 'big')
+        response.append(self.protocol_version)
+        for _value, currency in self.channels:
+            response += currency.encode()
+        for value, _currency in self.channels:
+            response += _le(value // 100, 4)
+        return bytes(response)
+
+    def _cmd_0a(self, data):
+        self.enabled = True
+        return bytes([RESPONSE_OK])
+
+    def _cmd_09(self, data):
+        self.enabled = False
+        return bytes([RESPONSE_OK])
+
+    def _cmd_02(self, data):
+        if len(data) < 2:
+            return bytes([RESPONSE_INCORRECT_PARAMETERS])
+        self.inhibits = data[0] | data[1] << 8
+        return bytes([RESPONSE_OK])
+
+    def _cmd_08(self, data):
+        if self.escrow is None:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED])
+        self.escrow = None
+        self.script = deque(
+            step for step in self.script if step != self._stack_note
+        )
+        self.script.appendleft([bytes([POLL_REJECTED])])
+        self.script.appendleft([bytes([POLL_REJECTING])])
+        return bytes([RESPONSE_OK])
+
+    def _cmd_07(self, data):
+        return bytes([RESPONSE_OK]) + self.poll()
+
+    def _cmd_5c(self, data):
+        self.payout_enabled = True
+        return bytes([RESPONSE_OK])
+
+    def _cmd_5b(self, data):
+        self.payout_enabled = False
+        return bytes([RESPONSE_OK])
+
+    def _cmd_3b(self, data):
+        if len(data) < 8:
+            return bytes([RESPONSE_INCORRECT_PARAMETERS])
+        value = int.from_bytes(data[1:5], 'little')
+        currency = data[5:8].decode()
+        if (value, currency) not in self.channels:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED])
+        self.routes[(value, currency)] = data[0]
+        return bytes([RESPONSE_OK])
+
+    def _cmd_35(self, data):
+        value = int.from_bytes(data[0:4], 'little')
+        currency = data[4:7].decode()
+        return bytes([RESPONSE_OK]) + _le(
+            self.levels.get((value, currency), 0), 2,
+        )
+
+    def _cmd_22(self, data):
+        response = bytearray([RESPONSE_OK, len(self.levels)])
+        for (value, currency), count in self.levels.items():
+            response += _le(count, 2) + _le(value, 4) + currency.encode()
+        return bytes(response)
+
+    def _cmd_33(self, data):
+        value = int.from_bytes(data[0:4], 'little')
+        currency = data[4:7].decode()
+        option = data[7] if len(data) > 7 else OPTION_BYTE_DO
+        if not self.payout_enabled:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED, PAYOUT_DISABLED])
+        if any(step for step in self.script):
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED, PAYOUT_BUSY])
+        available = sorted(
+            ((v, n) for (v, c), n in self.levels.items()
+             if c == currency and n > 0),
+            reverse=True,
+        )
+        if sum(v * n for v, n in available) < value:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED, PAYOUT_NOT_ENOUGH])
+        remaining = value
+        notes = {}
+        for note_value, count in available:
+            used = min(count, remaining // note_value)
+            if used:
+                notes[note_value] = used
+                remaining -= used * note_value
+        if remaining:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED, PAYOUT_EXACT_AMOUNT])
+        if option == OPTION_BYTE_DO:
+            for note_value, count in notes.items():
+                self.levels[(note_value, currency)] -= count
+            self.enabled = False
+            self._queue_value_event(POLL_DISPENSING, 0, currency)
+            self._queue_value_event(POLL_DISPENSING, value, currency)
+            self._queue_value_event(POLL_DISPENSED, value, currency)
+        return bytes([RESPONSE_OK])
+
+    def _cmd_42(self, data):
+        stored = [(v, c) for (v, c), n in self.levels.items() if n > 0]
+        if self.unit_type != UNIT_NV11 or not stored:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED])
+        value, currency = stored[-1]
+        self.levels[(value, currency)] -= 1
+        self._queue_value_event(POLL_DISPENSING, value, currency)
+        self._queue_value_event(POLL_DISPENSED, value, currency)
+        return bytes([RESPONSE_OK])
+
+    def _cmd_43(self, data):
+        stored = [(v, c) for (v, c), n in self.levels.items() if n > 0]
+        if self.unit_type != UNIT_NV11 or not stored:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED])
+        value, currency = stored[-1]
+        self.levels[(value, currency)] -= 1
+        self.script.append([bytes([POLL_STACKING])])
+        self.script.append([bytes([POLL_STACKED])])
+        return bytes([RESPONSE_OK])
+
+    def _cmd_52(self, data):
+        return self._empty(POLL_SMART_EMPTYING, POLL_SMART_EMPTIED)
+
+    def _cmd_3f(self, data):
+        return self._empty(POLL_EMPTYING, POLL_EMPTY)
+
+    def _empty(self, emptying, emptied):
+        totals = {}
+        for (value, currency), count in self.levels.items():
+            totals[currency] = totals.get(currency, 0) + value * count
+        self.levels = {key: 0 for key in self.levels}
+        for currency, total in totals.items() or [('CHF', 0)]:
+            if emptying == POLL_SMART_EMPTYING:
+                self._queue_value_event(emptying, 0, currency)
+                self._queue_value_event(emptied, total, currency)
+            else:
+                self.script.append([bytes([emptying])])
+                self.script.append([bytes([emptied])])
+        return bytes([RESPONSE_OK])
+
+    def _cmd_48(self, data):
+        return bytes([RESPONSE_OK])
+
+    def _queue_value_event(self, event, value, currency):
+        self.script.append(
+            [bytes([event, 1]) + _le(value, 4) + currency.encode()],
+        )
+
+    # --- Key exchange -------------------------------------------------------
+
+    def _cmd_4a(self, data):
+        self.generator = int.from_bytes(data[:8], 'little')
+        return bytes([RESPONSE_OK])
+
+    def _cmd_4b(self, data):
+        self.modulus = int.from_bytes(data[:8], 'little')
+        return bytes([RESPONSE_OK])
+
+    def _cmd_0b(self, data):
+        if not data or data[0] != PROGRAM_RAM_FILE:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED])
+        self.programming = True
+        return bytes([RESPONSE_OK]) + _le(self.download_block_size, 2)
+
+    def _cmd_49(self, data):
+        # 'I' of 'ITL', the header of the firmware file as a command
+        if not self.programming or len(data) != DOWNLOAD_HEADER_SIZE - 1:
+            return bytes([RESPONSE_UNKNOWN_COMMAND])
+        self.download_header = b'I' + bytes(data)
+        return bytes([RESPONSE_OK])
+
+    def download_baud_rate(self):
+        '''The rate of the transfer, read from the firmware header'''
+        header = self.download_header
+        if header[5] in (0x09, 0x0A):
+            return 38400
+        return int.from_bytes(header[68:72], 'big') or 38400
+
+    def _cmd_4d(self, data):
+        if self.baud_rates is None:
+            return bytes([RESPONSE_UNKNOWN_COMMAND])
+        if len(data) < 2 or data[0] >= len(BAUD_RATES):
+            return bytes([RESPONSE_INCORRECT_PARAMETERS])
+        rate = BAUD_RATES[data[0]]
+        if rate not in self.baud_rates:
+            return bytes([RESPONSE_COMMAND_NOT_PROCESSED])
+        # Only the frames received are checked, the reply can go at once
+        self.baud_rate = rate
+        self.baud_persists = bool(data[1])
+        return bytes([RESPONSE_OK])
+
+    def _cmd_4c(self, data):
+        if not self.generator or not self.modulus:
+            return bytes([RESPONSE_KEY_NOT_SET])
+        host_inter = int.from_bytes(data[:8], 'little')
+        slave_random = random.randrange(1, 1 << 31)
+        slave_inter = pow(self.generator, slave_random, self.modulus)
+        self.encryption_key = (
+            _le(self.fixed_key, 8)
+            + _le(pow(host_inter, slave_random, self.modulus), 8)
+        )
+        self.count = 0
+        return bytes([RESPONSE_OK]) + _le(slave_inter, 8)
+
+    # --- Encrypted packets --------------------------------------------------
+
+    def decrypt(self, data):
+        '''Decrypt an encrypted command, None if it must be ignored'''
+        if self.encryption_key is None or (len(data) - 1) % 16:
+            return None
+        plain = aes_decrypt(self.encryption_key, bytes(data[1:]))
+        crc = crc16(plain[:-2])
+        if plain[-2:] != bytes([crc & 0xFF, crc >> 8]):
+            return None
+        if int.from_bytes(plain[1:5], 'little') != self.count:
+            return None
+        self.count += 1
+        return plain[5:5 + plain[0]]
+
+    def encrypt(self, data, key=None, count=None):
+        '''Encrypt a reply, with the current key and count by default'''
+        if key is None:
+            key, count = self.encryption_key, self.count
+        length = len(data) + 7
+        packing = (-length) % 16
+        plain = (
+            bytes([len(data)]) + _le(count, 4) + data
+            + bytes(random.randrange(255) for _ in range(packing))
+        )
+        crc = crc16(plain)
+        plain += bytes([crc & 0xFF, crc >> 8])
+        return bytes([SSP_STEX]) + aes_encrypt(key, plain)
+
+
+class Simulator:
+    '''Pseudo-terminal hosting one or more simulated devices.
+
+    ``port`` is the pty device path to give to ``eSSP(com_port=...)``.
+    '''
+
+    def __init__(self, devices=None, line_time=False):
+        if devices is None:
+            devices = [SimulatedDevice()]
+        self.devices = {device.address: device for device in devices}
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.line_time = line_time
+        self.frames_received = 0
+        self.crc_errors = 0
+        # Frames sent by the host at another rate than the device's
+        self.baud_mismatches = 0
+        # The device receiving a firmware file, and where it is at
+        self._download = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._rx = bytearray()
+
+    @property
+    def device(self):
+        '''The device at the lowest address'''
+        return self.devices[min(self.devices)]
+
+    def insert_note(self, channel, address=None):
+        self._device(address).insert_note(channel)
+
+    def queue_events(self, *events, address=None):
+        self._device(address).queue_events(*events)
+
+    def set_response_delay(self, seconds, command=None, address=None):
+        self._device(address).set_response_delay(seconds, command)
+
+    def host_baud_rate(self):
+        '''The rate the host set on the pty'''
+        return _SPEEDS.get(termios.tcgetattr(self.slave)[5])
+
+    def _device(self, address):
+        if address is None:
+            return self.device
+        return self.devices[address]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def run(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                if self._download is not None:
+                    self._download_idle()
+                continue
+            try:
+                data = os.read(self.master, 65536)
+            except OSError:
+                continue
+            if self._download is not None:
+                data = self._download_in(data)
+            for byte in data:
+                self._data_in(byte)
+
+    def _start_download(self, device):
+        device.baud_rate = device.download_baud_rate()
+        header = device.download_header
+        self._download = {
+            'device': device,
+            'stage': 'ram',
+            'remaining': int.from_bytes(header[7:11], 'big'),
+            'checksum': 0,
+            'data': bytearray(),
+        }
+
+    def _download_in(self, data):
+        '''Take the bytes of the firmware file, return those that are SSP
+        frames again
+        '''
+        download = self._download
+        device = download['device']
+        host_rate = self.host_baud_rate()
+        if host_rate != device.baud_rate:
+            if download['stage'] == 'blocks' and host_rate == 9600:
+                # The host waits for the device to restart
+                self._download_idle()
+                self._download = None
+                device.programming = False
+                device.download_header = None
+                device.baud_persists = False
+                device.reset()
+                device.updates += 1
+                return data
+            self.baud_mismatches += 1
+            return b''
+        stage = download['stage']
+        if stage == 'ram':
+            taken = data[:download['remaining']]
+            download['checksum'] = _xor(taken, download['checksum'])
+            download['remaining'] -= len(taken)
+            if download['remaining'] == 0:
+                os.write(self.master, bytes([download['checksum']]))
+                download['stage'] = 'start'
+        elif stage == 'start':
+            ok = data[:1] == device.download_header[6:7]
+            os.write(self.master, bytes([DOWNLOAD_ACK if ok else 0]))
+            download['stage'] = 'header'
+            download['data'] = bytearray(data[1:])
+        else:
+            download['data'] += data
+        if download['stage'] == 'header' and (
+                len(download['data']) >= DOWNLOAD_HEADER_SIZE):
+            ok = download['data'][:3] == b'ITL'
+            os.write(self.master, bytes([DOWNLOAD_ACK if ok else 0]))
+            download['stage'] = 'blocks'
+            del download['data'][:DOWNLOAD_HEADER_SIZE]
+        if download['stage'] == 'blocks':
+            size = device.download_block_size + 1
+            while len(download['data']) >= size:
+                self._download_block(download['data'][:size])
+                del download['data'][:size]
+        return b''
+
+    def _download_idle(self):
+        '''The host stopped sending: the last, shorter, block is in'''
+        download = self._download
+        if download['stage'] == 'blocks' and download['data']:
+            self._download_block(download['data'])
+            download['data'] = bytearray()
+
+    def _download_block(self, block):
+        # The checksum the device computed, the host compares it to its own
+        os.write(self.master, bytes([_xor(block[:-1])]))
+
+    def _data_in(self, byte):
+        '''Receive state machine, same rules as SSPDataIn'''
+        rx = self._rx
+        if not rx:
+            if byte == SSP_STX:
+                rx.append(byte)
+                self._stuffed = False
+            return
+        if self._stuffed:
+            self._stuffed = False
+            if byte != SSP_STX:
+                # A lone STX starts a new packet
+                rx[:] = bytes([SSP_STX, byte])
+                return
+            rx.append(byte)
+        elif byte == SSP_STX:
+            self._stuffed = True
+            return
+        else:
+            rx.append(byte)
+        if len(rx) >= 3 and len(rx) == rx[2] + 5:
+            packet = bytes(rx)
+            rx.clear()
+            self._packet_in(packet)
+
+    def _packet_in(self, packet):
+        crc = crc16(packet[1:-2])
+        if packet[-2:] != bytes([crc & 0xFF, crc >> 8]):
+            self.crc_errors += 1
+            return
+        self.frames_received += 1
+        address = packet[1] & 0x7F
+        seq = packet[1] & 0x80
+        device = self.devices.get(address)
+        if device is None:
+            return
+        if self.host_baud_rate() != device.baud_rate:
+            # The device would only read noise
+            self.baud_mismatches += 1
+            return
+        data = packet[3:-2]
+        encrypted = data[0] == SSP_STEX
+        if encrypted and device.encryption_key is None:
+            os.write(self.master, frame(
+                address | seq,
+                bytes([RESPONSE_KEY_NOT_SET]),
+            ))
+            return
+        if encrypted:
+            data = device.decrypt(data)
+            if data is None:
+                return
+            # A reset forgets the key, its reply still goes with the old one
+            key, count = device.encryption_key, device.count
+        if data[0] == CMD_SYNC:
+            device.last_seq = None
+        elif seq == device.last_seq and device.last_reply is not None:
+            # Retransmission: the host did not get our last reply
+            os.write(self.master, device.last_reply)
+            return
+        if (device.require_encryption and not encrypted
+                and data[0] in (CMD_PAYOUT_VALUE, CMD_SET_ROUTING)):
+            response = bytes([RESPONSE_KEY_NOT_SET])
+        else:
+            response = device.handle(data)
+        delay = device.response_delay(data[0])
+        if delay:
+            time.sleep(delay)
+        if encrypted:
+            response = device.encrypt(response, key, count)
+        reply = frame(address | seq, response)
+        device.last_seq = seq
+        device.last_reply = reply
+        if self.line_time:
+            time.sleep(
+                (len(packet) + len(reply)) * BITS_PER_BYTE / device.baud_rate,
+            )
+        os.write(self.master, reply)
+        if device.download_header is not None and self._download is None:
+            self._start_download(device)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--unit',
+        choices=('validator', 'smart-payout', 'nv11'),
+        default='smart-payout',
+    )
+    parser.add_argument('--address', type=int, default=0)
+    parser.add_argument('--delay', type=float, default=0)
+    parser.add_argument(
+        '--line-time',
+        action='store_true',
+        help='take the time of a serial line at the baud rate',
+    )
+    args = parser.parse_args()
+
+    unit_type = {
+        'validator': UNIT_VALIDATOR,
+        'smart-payout': UNIT_SMART_PAYOUT,
+        'nv11': UNIT_NV11,
+    }[args.unit]
+    simulator = Simulator(
+        [SimulatedDevice(args.address, unit_type)],
+        line_time=args.line_time,
+    )
+    simulator.set_response_delay(args.delay)
+    simulator.start()
+    print(simulator.port, flush=True)
+    print('Enter a channel number to insert a note, Ctrl-D to quit')
+    try:
+        while True:
+            line = input('')
+            if line.strip().isdigit():
+                simulator.insert_note(int(line))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''Firmware update of a device, in the background.
+
+libessp maps the firmware file in memory and streams it to the device block
+by block from its own thread, the caller only follows the progress:
+
+    update = FirmwareUpdate('NV0200.bv1', '/dev/ttyUSB0', progress=print)
+    ...
+    update.status()  # {'stage': UpdateStage.MAIN_FILE, 'blocks_sent': 12...}
+    update.wait()    # UpdateDeviceResponseEnum.OK
+
+The port must not be used by an eSSP object during the update.
+'''
+import threading
+
+from . import C_LIBRARY
+from .clib import (
+    SspUpdateStatus,
+    UpdateDeviceResponseEnum,
+    UpdateProgressCallback,
+    UpdateStage,
+)
+
+# The updates not waited for yet, libessp calls their callback until then
+_running = set()
+
+
+def _status_dict(status):
+    '''The dict of an SspUpdateStatus'''
+    seconds = status.elapsed_us / 1e6
+    return {
+        'stage': UpdateStage(status.stage),
+        'response': UpdateDeviceResponseEnum(status.response),
+        'blocks_sent': status.blocks_sent,
+        'blocks_total': status.blocks_total,
+        'bytes_sent': status.bytes_sent,
+        'bytes_total': status.bytes_total,
+        'seconds': seconds,
+        'bytes_per_second': status.bytes_sent / seconds if seconds else 0.0,
+    }
+
+
+class FirmwareUpdate:
+    '''Send the firmware file <file_path> to the device at <ssp_address>
+    on <com_port>, from a thread of libessp.
+
+    <progress> is called with the status dict after each block the device
+    checked and once the update is done, from the update thread: it must
+    return quickly, its exceptions are printed and ignored. The update is
+    freed by wait, which must be called.
+    '''
+
+    def __init__(self, file_path, com_port, ssp_address='0', progress=None):
+        self._lock = threading.Lock()
+        self._final = None
+        # A NULL function pointer without <progress>
+        self._callback = UpdateProgressCallback()
+        if progress is not None:
+            # Kept referenced until the update is freed
+            self._callback = UpdateProgressCallback(
+                lambda status, _user: progress(_status_dict(status.contents)),
+            )
+        self._update = C_LIBRARY.update_device_start(
+            str(file_path).encode(),
+            com_port.encode(),
+            ssp_address.encode(),
+            self._callback,
+            None,
+        )
+        if not self._update:
+            raise Exception(f'Cannot start the update of {com_port}')
+        _running.add(self)
+
+    def status(self):
+        '''The status dict: stage (UpdateStage), response
+        (UpdateDeviceResponseEnum, IN_PROGRESS until done), blocks_sent and
+        blocks_total of the main file, bytes_sent and bytes_total of the
+        file, seconds since the start and bytes_per_second.
+        '''
+        with self._lock:
+            if self._final is not None:
+                return dict(self._final)
+            status = SspUpdateStatus()
+            C_LIBRARY.update_device_status(self._update, status)
+        return _status_dict(status)
+
+    def done(self):
+        return self.status()['stage'] == UpdateStage.DONE
+
+    def wait(self, timeout=None):
+        '''Wait up to <timeout> seconds (forever if None) for the end of
+        the update, return its UpdateDeviceResponseEnum, None on timeout
+        '''
+        with self._lock:
+            if self._final is not None:
+                return self._final['response']
+            update = self._update
+        milliseconds = -1 if timeout is None else int(timeout * 1000)
+        if not C_LIBRARY.update_device_wait(update, milliseconds):
+            return None
+        with self._lock:
+            if self._final is None:
+                status = SspUpdateStatus()
+                C_LIBRARY.update_device_status(self._update, status)
+                self._final = _status_dict(status)
+                C_LIBRARY.update_device_free(self._update)
+                self._update = None
+                self._callback = None
+                _running.discard(self)
+            return self._final['response']